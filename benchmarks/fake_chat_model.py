@@ -0,0 +1,110 @@
+# %%
+import asyncio
+import hashlib
+import random
+import re
+import time
+from typing import List
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+_LEGAL_MOVES = re.compile(r"envisage de jouer \[([^\]]*)\]")
+
+
+class FakeServerError(ConnectionError):
+    pass
+
+
+class FakeChatModel:
+    """Deterministic stand-in for ChatOllama that answers with canned ChessOutput JSON.
+
+    The move is picked from the legal moves in the prompt (or the schema enum under constrained
+    output) by hashing the prompt, so a game replays identically for a given `seed`. `latency` is
+    the time per request, `error_rate` the share of requests that raise and `illegal_rate` the share
+    that answer a move that isn't on the board. Responses carry Ollama-style token counts.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, illegal_rate: float = 0.0,
+                 seed: int = 0, chunk_chars: int = 16, **ollama_kwargs):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.illegal_rate = illegal_rate
+        self.seed = seed
+        self.chunk_chars = chunk_chars
+        self.model = ollama_kwargs.get("model")
+        self.base_url = None
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def _legal_moves(self, text: str, kwargs: dict) -> List[str]:
+        schema = kwargs.get("format")
+        if isinstance(schema, dict):
+            return schema["properties"]["best_move"]["items"]["properties"]["move"]["enum"]
+        match = _LEGAL_MOVES.search(text)
+        return match.group(1).split() if match else []
+
+    def _answer(self, prompt, kwargs: dict) -> str:
+        self.calls += 1
+        if self._random.random() < self.error_rate:
+            raise FakeServerError("fake server error")
+        text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        moves = self._legal_moves(text, kwargs) or ["e7e5"]
+        digest = hashlib.md5(f"{self.seed}:{text}".encode()).digest()
+        ranked = sorted(moves, key=lambda move: hashlib.md5(digest + move.encode()).digest())
+        # An illegal answer has no legal candidates either, so the player has to retry.
+        illegal = self._random.random() < self.illegal_rate
+        best = "z9z9" if illegal else ranked[0]
+        candidates = ", ".join(f'{{"move": "{move}", "explanation": "Develops a piece."}}'
+                               for move in ([] if illegal else ranked[:5]))
+        return (f'{{"candidate_moves": [{candidates}], '
+                f'"best_move": [{{"move": "{best}", "explanation": "Keeps the position balanced."}}]}}')
+
+    def _metadata(self, prompt, content: str) -> dict:
+        prompt_tokens, eval_tokens = len(str(prompt)) // 4, len(content) // 4
+        # Split the latency between prompt evaluation and generation, in nanoseconds like Ollama.
+        return {"model": self.model, "prompt_eval_count": prompt_tokens, "eval_count": eval_tokens,
+                "prompt_eval_duration": int(self.latency * 0.3e9), "eval_duration": int(self.latency * 0.7e9)}
+
+    def invoke(self, prompt, **kwargs) -> AIMessage:
+        content = self._answer(prompt, kwargs)
+        time.sleep(self.latency)
+        return AIMessage(content=content, response_metadata=self._metadata(prompt, content))
+
+    async def ainvoke(self, prompt, **kwargs) -> AIMessage:
+        content = self._answer(prompt, kwargs)
+        await asyncio.sleep(self.latency)
+        return AIMessage(content=content, response_metadata=self._metadata(prompt, content))
+
+    def _chunks(self, content: str) -> List[str]:
+        return [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+
+    def stream(self, prompt, **kwargs):
+        content = self._answer(prompt, kwargs)
+        chunks = self._chunks(content)
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield AIMessageChunk(content=chunk)
+        yield AIMessageChunk(content="", response_metadata=self._metadata(prompt, content))
+
+    async def astream(self, prompt, **kwargs):
+        content = self._answer(prompt, kwargs)
+        chunks = self._chunks(content)
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield AIMessageChunk(content=chunk)
+        yield AIMessageChunk(content="", response_metadata=self._metadata(prompt, content))
+
+
+def install(latency: float = 0.0, error_rate: float = 0.0, illegal_rate: float = 0.0, seed: int = 0,
+            module=None):
+    """Make LLMPlayer.init_llm_model build FakeChatModels. Forked worker processes inherit the patch."""
+    if module is None:
+        # init_llm_model imports ChatOllama from langchain_ollama each time it builds a model.
+        import langchain_ollama as module
+
+    def factory(**ollama_kwargs) -> FakeChatModel:
+        return FakeChatModel(latency=latency, error_rate=error_rate, illegal_rate=illegal_rate, seed=seed,
+                             **ollama_kwargs)
+
+    module.ChatOllama = factory
+    return factory
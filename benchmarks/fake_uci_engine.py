@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Tiny UCI engine that speaks just enough of the protocol for the `stockfish`
+# wrapper and python-chess. Moves are chosen deterministically from the
+# position hash; scores are the material balance.
+import hashlib
+import os
+import sys
+import time
+
+import chess
+
+VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900}
+
+
+def material(board: chess.Board) -> int:
+    score = 0
+    for piece_type, value in VALUES.items():
+        score += value * (len(board.pieces(piece_type, chess.WHITE)) - len(board.pieces(piece_type, chess.BLACK)))
+    return score if board.turn == chess.WHITE else -score
+
+
+def ranked_moves(board: chess.Board):
+    moves = sorted(board.legal_moves, key=lambda m: m.uci())
+    seed = hashlib.md5(board.fen().encode()).digest()
+    return sorted(moves, key=lambda m: hashlib.md5(seed + m.uci().encode()).digest())
+
+
+def main():
+    # The stockfish wrapper starts the binary without arguments, so the delay comes from the environment.
+    delay = float(sys.argv[1]) if len(sys.argv) > 1 else float(os.environ.get("FAKE_UCI_DELAY", "0"))
+    board = chess.Board()
+    multipv = 1
+    out = sys.stdout
+    out.write("Stockfish 16 by the fake engine authors\n")
+    out.flush()
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        cmd = tokens[0]
+        if cmd == "uci":
+            out.write("id name Stockfish 16\nid author fake\n")
+            out.write("option name MultiPV type spin default 1 min 1 max 500\n")
+            out.write("option name UCI_Elo type spin default 1350 min 100 max 3190\n")
+            out.write("option name UCI_LimitStrength type check default false\n")
+            out.write("option name Hash type spin default 16 min 1 max 1024\n")
+            out.write("option name Threads type spin default 1 min 1 max 64\n")
+            out.write("uciok\n")
+        elif cmd == "isready":
+            out.write("readyok\n")
+        elif cmd == "setoption":
+            if "MultiPV" in tokens:
+                multipv = int(tokens[-1])
+        elif cmd == "ucinewgame":
+            board = chess.Board()
+        elif cmd == "position":
+            if tokens[1] == "startpos":
+                board = chess.Board()
+                rest = tokens[2:]
+            else:
+                end = tokens.index("moves") if "moves" in tokens else len(tokens)
+                board = chess.Board(" ".join(tokens[2:end]))
+                rest = tokens[end:]
+            if rest and rest[0] == "moves":
+                for uci in rest[1:]:
+                    board.push_uci(uci)
+        elif cmd == "d":
+            out.write(f"\n{board}\n\nFen: {board.fen()}\nKey: 0\nCheckers:\n")
+        elif cmd == "go":
+            if delay and multipv == 1:
+                # MultiPV searches stand for the shallow predictor engine: answer at once.
+                time.sleep(delay)
+            moves = ranked_moves(board)
+            if not moves:
+                score = "mate 0" if board.is_checkmate() else "cp 0"
+                out.write(f"info depth 0 score {score}\nbestmove (none)\n")
+            else:
+                depth = tokens[tokens.index("depth") + 1] if "depth" in tokens else "1"
+                for rank, move in enumerate(moves[:multipv], start=1):
+                    out.write(f"info depth {depth} multipv {rank} score cp {material(board)} nodes 1 pv {move.uci()}\n")
+                out.write(f"bestmove {moves[0].uci()}\n")
+        elif cmd == "quit":
+            break
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# %%
+"""Benchmarks of the game orchestration that need neither a GPU nor a Stockfish binary.
+
+    python benchmarks/run_benchmarks.py run [--quick]     # writes benchmarks/results/<commit>.json
+    python benchmarks/run_benchmarks.py diff OLD NEW      # result files or commit ids
+
+The LLM is a FakeChatModel (fake_chat_model.py) and Stockfish is fake_uci_engine.py, so the numbers
+measure our own code: per-ply overhead outside inference and search, games/sec at several
+concurrency levels, memory per game and import/startup time.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import pickle
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+SOURCE_DIR = BENCH_DIR.parent / "llm-vs-stockfish"
+RESULTS_DIR = BENCH_DIR / "results"
+FAKE_ENGINE = str(BENCH_DIR / "fake_uci_engine.py")
+sys.path.insert(0, str(SOURCE_DIR))
+
+import fake_chat_model  # noqa: E402
+from game_events import configure_logging  # noqa: E402
+from tournament import GameSpec, play_single_game, run_async_tournament, run_tournament  # noqa: E402
+
+STARTUP_MODULES = ("tournament", "chess_game_manager", "llm_player", "stockfish_player")
+
+
+def make_spec(**overrides) -> GameSpec:
+    fields = dict(model_name="fake", temperature=0.0, stockfish_path=FAKE_ENGINE, stockfish_depth=1)
+    fields.update(overrides)
+    return GameSpec(**fields)
+
+
+def _span_seconds(summary: dict, name: str) -> float:
+    return summary.get(name, {}).get("seconds", 0.0)
+
+
+def bench_ply_overhead(num_moves: int = 40, repeats: int = 3) -> dict:
+    """Wall time per ply minus the time spent inside the LLM and the engine search."""
+    fake_chat_model.install(latency=0.0)
+    spec = make_spec(num_moves=num_moves, trace=True)
+    play_single_game(spec, 0)  # spawns the pooled engine
+    runs = []
+    for i in range(repeats):
+        result = play_single_game(spec, i + 1)
+        if result.error is not None:
+            raise RuntimeError(result.error)
+        summary = result.trace_summary
+        plies = summary["board_update"]["count"]
+        external = _span_seconds(summary, "llm_inference") + _span_seconds(summary, "stockfish_search")
+        runs.append({"plies": plies,
+                     "wall_per_ply_ms": 1000 * result.wall_time / plies,
+                     "overhead_per_ply_ms": 1000 * (result.wall_time - external) / plies,
+                     "prompt_build_ms": 1000 * _span_seconds(summary, "prompt_build") / plies,
+                     "parse_validate_ms": 1000 * _span_seconds(summary, "parse_validate") / plies,
+                     "board_update_ms": 1000 * _span_seconds(summary, "board_update") / plies})
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def bench_throughput(levels: List[int], games: int, num_moves: int, latency: float, engine_delay: float,
+                     error_rate: float = 0.0, illegal_rate: float = 0.0) -> dict:
+    """Games/sec with the async runner (max LLM requests) and the process pool (workers) per level."""
+    fake_chat_model.install(latency=latency, error_rate=error_rate, illegal_rate=illegal_rate)
+    os.environ["FAKE_UCI_DELAY"] = str(engine_delay)
+    spec = make_spec(num_games=games, num_moves=num_moves)
+    results = {"async": {}, "processes": {}}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        store = os.path.join(tmp, "bench.sqlite")
+        for level in levels:
+            report = run_async_tournament(spec, max_llm_requests=level, store_path=store)
+            results["async"][str(level)] = report.games_played / report.wall_time
+            report = run_tournament(spec, workers=level, store_path=store)
+            results["processes"][str(level)] = report.games_played / report.wall_time
+    os.environ.pop("FAKE_UCI_DELAY")
+    return {"games": games, "num_moves": num_moves, "llm_latency": latency, "engine_delay": engine_delay,
+            "games_per_second": results}
+
+
+def bench_memory(num_moves: int = 40) -> dict:
+    """Python allocations while one game is played in-process, what it leaves behind and the size
+    of the GameResult a worker process sends back."""
+    fake_chat_model.install(latency=0.0)
+    spec = make_spec(num_moves=num_moves)
+    play_single_game(spec, 0)
+    gc.collect()
+    tracemalloc.start()
+    result = play_single_game(spec, 1)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"peak_kb": peak / 1024, "retained_kb": retained / 1024,
+            "pickled_result_kb": len(pickle.dumps(result)) / 1024,
+            "process_max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def _time_command(args: List[str], repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=SOURCE_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_startup(repeats: int = 5) -> dict:
+    """Median seconds to start Python and import each entry module, interpreter start subtracted."""
+    baseline = _time_command([sys.executable, "-c", "pass"], repeats)
+    results = {"interpreter_s": baseline}
+    for module in STARTUP_MODULES:
+        results[f"import_{module}_s"] = _time_command([sys.executable, "-c", f"import {module}"], repeats) - baseline
+    results["tournament_help_s"] = _time_command([sys.executable, "tournament.py", "--help"], repeats) - baseline
+    return results
+
+
+def git_revision() -> Dict[str, Optional[str]]:
+    def git(*args) -> Optional[str]:
+        try:
+            return subprocess.run(["git", *args], cwd=BENCH_DIR, check=True, capture_output=True,
+                                  text=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {"commit": git("rev-parse", "--short", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def run(args) -> dict:
+    configure_logging(logging.ERROR)
+    quick = args.quick
+    levels = [1, 2] if quick else [1, 2, 4, 8]
+    benchmarks = {}
+    print("> ply overhead")
+    benchmarks["ply_overhead"] = bench_ply_overhead(num_moves=10 if quick else 40, repeats=1 if quick else 3)
+    print("> throughput")
+    benchmarks["throughput"] = bench_throughput(levels, games=max(levels) if quick else 2 * max(levels),
+                                                num_moves=5 if quick else 10, latency=args.llm_latency,
+                                                engine_delay=args.engine_delay, error_rate=args.error_rate,
+                                                illegal_rate=args.illegal_rate)
+    print("> memory")
+    benchmarks["memory"] = bench_memory(num_moves=10 if quick else 40)
+    print("> startup")
+    benchmarks["startup"] = bench_startup(repeats=2 if quick else 5)
+
+    revision = git_revision()
+    results = {**revision, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "quick": quick,
+               "python": platform.python_version(), "platform": platform.platform(), "benchmarks": benchmarks}
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{revision['commit'] or 'unknown'}{'-dirty' if revision['dirty'] else ''}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(format_results(results))
+    print(f"> saved {output}")
+    return results
+
+
+def flatten(tree: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def format_results(results: dict) -> str:
+    return "\n".join(f"{name:<48} {value:>12.4f}" for name, value in flatten(results["benchmarks"]).items())
+
+
+def load_results(name: str) -> dict:
+    path = Path(name)
+    if not path.exists():
+        # A commit id: the newest results file whose name starts with it.
+        matches = sorted(RESULTS_DIR.glob(f"{name}*.json"), key=lambda p: p.stat().st_mtime)
+        if not matches:
+            raise SystemExit(f"No benchmark results for {name!r} in {RESULTS_DIR}")
+        path = matches[-1]
+    return json.loads(path.read_text())
+
+
+def diff(args) -> str:
+    old, new = load_results(args.old), load_results(args.new)
+    old_flat, new_flat = flatten(old["benchmarks"]), flatten(new["benchmarks"])
+    lines = [f"{'metric':<48} {old.get('commit') or args.old:>12} {new.get('commit') or args.new:>12} {'change':>8}"]
+    for name in sorted(old_flat.keys() | new_flat.keys()):
+        before, after = old_flat.get(name), new_flat.get(name)
+        change = f"{(after - before) / abs(before):+.1%}" if before and after is not None else ""
+        lines.append(f"{name:<48} {'-' if before is None else f'{before:.4f}':>12} "
+                     f"{'-' if after is None else f'{after:.4f}':>12} {change:>8}")
+    report = "\n".join(lines)
+    print(report)
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Orchestration benchmarks with a fake LLM and a fake UCI engine.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks and save the results.")
+    run_parser.add_argument("--quick", action="store_true", help="Fewer games, plies and repeats.")
+    run_parser.add_argument("--output", default=None, help="Results file (default: results/<commit>.json).")
+    run_parser.add_argument("--llm-latency", type=float, default=0.02, help="Seconds per fake LLM request.")
+    run_parser.add_argument("--engine-delay", type=float, default=0.005, help="Seconds per fake engine search.")
+    run_parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake LLM requests that fail.")
+    run_parser.add_argument("--illegal-rate", type=float, default=0.0, help="Share of fake LLM answers that are illegal.")
+    diff_parser = commands.add_parser("diff", help="Compare two results files or commits.")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else diff(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# %%
+from typing import NamedTuple, Optional
+
+import chess
+
+REASONS = ("resign", "draw", "tablebase")
+
+
+class Adjudication(NamedTuple):
+    result: str
+    winner: Optional[str]
+    reason: str
+    ply: int
+
+
+def _decided(board: chess.Board, winner: Optional[chess.Color], reason: str) -> Adjudication:
+    if winner is None:
+        return Adjudication("1/2-1/2", None, reason, len(board.move_stack))
+    return Adjudication("1-0" if winner == chess.WHITE else "0-1", "White" if winner == chess.WHITE else "Black",
+                        reason, len(board.move_stack))
+
+
+class Adjudicator:
+    """Ends games whose outcome is no longer in doubt, before the move cap or a checkmate.
+
+    - resign: Stockfish's evaluation stays at or beyond `resign_cp` (either way) for `resign_moves`
+      consecutive searches; the side it is against resigns.
+    - draw: the evaluation stays within `draw_cp` for `draw_moves` consecutive searches while pieces
+      shuffle (no capture or pawn move for `draw_halfmoves` plies).
+    - tablebase: with Syzygy tables in `syzygy_path`, any position they cover is scored from them
+      (cursed wins and blessed losses are draws under the 50-move rule).
+
+    Evaluations are centipawns from White's side (mates folded in, see StockfishPlayer.last_score);
+    rules left as None are off.
+    """
+
+    def __init__(self, resign_cp: Optional[int] = None, resign_moves: int = 5,
+                 draw_cp: Optional[int] = None, draw_moves: int = 10, draw_halfmoves: int = 20,
+                 syzygy_path: Optional[str] = None):
+        self.resign_cp = resign_cp
+        self.resign_moves = resign_moves
+        self.draw_cp = draw_cp
+        self.draw_moves = draw_moves
+        self.draw_halfmoves = draw_halfmoves
+        self.syzygy_path = syzygy_path
+        self.tablebase = None
+        self.max_pieces = 0
+        if syzygy_path is not None:
+            import chess.syzygy
+            self.tablebase = chess.syzygy.open_tablebase(syzygy_path)
+            # Table names list the pieces on both sides, e.g. "KRvK".
+            self.max_pieces = max((len(name) - 1 for name in self.tablebase.wdl), default=0)
+        self._winning_streak = 0
+        self._winning_side: Optional[chess.Color] = None
+        self._quiet_streak = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.resign_cp is not None or self.draw_cp is not None or self.tablebase is not None
+
+    def reset(self):
+        self._winning_streak = 0
+        self._winning_side = None
+        self._quiet_streak = 0
+
+    def _probe(self, board: chess.Board) -> Optional[Adjudication]:
+        if self.tablebase is None or chess.popcount(board.occupied) > self.max_pieces:
+            return None
+        try:
+            wdl = self.tablebase.probe_wdl(board)
+        except KeyError:
+            # A table missing from the directory, or castling rights left on the board.
+            return None
+        if abs(wdl) < 2:
+            return _decided(board, None, "tablebase")
+        return _decided(board, board.turn if wdl > 0 else not board.turn, "tablebase")
+
+    def _score(self, board: chess.Board, white_cp: int) -> Optional[Adjudication]:
+        if self.resign_cp is not None:
+            side = chess.WHITE if white_cp >= self.resign_cp else chess.BLACK if white_cp <= -self.resign_cp else None
+            if side is not None and side == self._winning_side:
+                self._winning_streak += 1
+            else:
+                self._winning_side, self._winning_streak = side, int(side is not None)
+            if self._winning_streak >= self.resign_moves:
+                return _decided(board, self._winning_side, "resign")
+        if self.draw_cp is not None:
+            self._quiet_streak = self._quiet_streak + 1 if abs(white_cp) <= self.draw_cp else 0
+            if self._quiet_streak >= self.draw_moves and board.halfmove_clock >= self.draw_halfmoves:
+                return _decided(board, None, "draw")
+        return None
+
+    def close(self):
+        if self.tablebase is not None:
+            self.tablebase.close()
+
+    def check(self, board: chess.Board, white_cp: Optional[int] = None) -> Optional[Adjudication]:
+        """Call after every move; `white_cp` is the evaluation of the search that produced it, if any."""
+        decision = self._probe(board)
+        if decision is None and white_cp is not None:
+            decision = self._score(board, white_cp)
+        return decision
@@ -0,0 +1,281 @@
+# %%
+# Columnar analytics over the experiment store. Games are replayed once, when they first appear, into
+# flat per-ply NumPy arrays (one row per ply, addressed through per-game offsets); every table below is
+# then a handful of vectorized group-bys over those arrays. Arrays and tables are cached in a file next
+# to the store and only recomputed when new games have been recorded.
+import os
+import pickle
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import chess
+import numpy as np
+import pandas as pd
+
+from experiment_store import LLM_COUNTERS, ExperimentStore
+from game_record import unpack_move
+
+CACHE_VERSION = 1
+CONFIG = ("model_name", "llm_temp", "stockfish_elo", "prompt_hash")
+PIECE_VALUES = (0, 1, 3, 3, 5, 9, 0)  # by chess piece type; kings don't count
+
+# Store row key -> games frame column.
+_ROW_COLUMNS = {"id": "id", "LLM_color": "llm_color", "LLM_model_name": "model_name", "Win": "winner",
+                "Stockfish_elo": "stockfish_elo", "LLM_temp": "llm_temp", "prompt_hash": "prompt_hash",
+                "Plies": "plies", "Result": "result", "Adjudication": "adjudication",
+                **LLM_COUNTERS}
+
+
+def material_balance(board: chess.Board) -> int:
+    """White's material minus Black's, in pawns."""
+    return sum(PIECE_VALUES[piece.piece_type] * (1 if piece.color == chess.WHITE else -1)
+               for piece in board.piece_map().values())
+
+
+def material_deltas(start_fen: str, codes) -> Tuple[int, np.ndarray]:
+    """Material balance of the start position and its change at every ply, from White's side."""
+    board = chess.Board(start_fen)
+    deltas = np.zeros(len(codes), dtype=np.int16)
+    for ply, code in enumerate(codes):
+        move = unpack_move(code)
+        gain = 0
+        if board.is_en_passant(move):
+            gain = 1
+        elif board.piece_type_at(move.to_square) is not None:
+            gain = PIECE_VALUES[board.piece_type_at(move.to_square)]
+        if move.promotion is not None:
+            gain += PIECE_VALUES[move.promotion] - 1
+        deltas[ply] = gain if board.turn == chess.WHITE else -gain
+        board.push(move)
+    return material_balance(chess.Board(start_fen)), deltas
+
+
+def segment_cumsum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Cumulative sums restarting at every offset."""
+    totals = np.cumsum(values, dtype=np.int64)
+    before = np.concatenate(([0], totals))[offsets[:-1]]
+    return totals - np.repeat(before, np.diff(offsets))
+
+
+class ExperimentAnalytics:
+    """The experiment store as columnar arrays plus cached derived tables.
+
+    `games` has one row per game (in id order); the per-ply arrays hold, for game i, the entries
+    `offsets[i]:offsets[i + 1]`. Stored games never change, so `refresh` only replays games with an
+    id above the last one seen, and derived tables are dropped only when it finds some.
+    """
+
+    def __init__(self, store_path: str = "ChessGameExperiment.sqlite", cache_path: Optional[str] = None):
+        self.store_path = store_path
+        self.cache_path = cache_path if cache_path is not None else store_path + ".analytics.pkl"
+        self._reset()
+        self._load_cache()
+        self.refresh()
+
+    def _reset(self):
+        self.games = pd.DataFrame(columns=list(_ROW_COLUMNS.values()))
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.start_material = np.zeros(0, dtype=np.int16)
+        self.deltas = np.zeros(0, dtype=np.int16)
+        self._tables: Dict[tuple, pd.DataFrame] = {}
+
+    @property
+    def last_id(self) -> int:
+        return int(self.games["id"].iloc[-1]) if len(self.games) else 0
+
+    def _load_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        if state.get("version") != CACHE_VERSION:
+            return
+        self.games, self.offsets = state["games"], state["offsets"]
+        self.start_material, self.deltas = state["start_material"], state["deltas"]
+        self._tables = state["tables"]
+
+    def _save_cache(self):
+        if self.cache_path is None:
+            return
+        state = {"version": CACHE_VERSION, "games": self.games, "offsets": self.offsets,
+                 "start_material": self.start_material, "deltas": self.deltas, "tables": self._tables}
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self) -> int:
+        """Append the games recorded since the last refresh; returns how many there were."""
+        store = ExperimentStore(self.store_path)
+        try:
+            if store.count(after_id=self.last_id) + len(self.games) != store.count():
+                # Games were removed: not the store the cache was built from, start over.
+                self._reset()
+            rows, starts, deltas = [], [], []
+            for row in store.iter_games(after_id=self.last_id):
+                record = row["Game_record"]
+                start, game_deltas = material_deltas(record.start_fen, record.moves)
+                rows.append({column: row[key] for key, column in _ROW_COLUMNS.items()})
+                starts.append(start)
+                deltas.append(game_deltas)
+        finally:
+            store.close()
+        if not rows:
+            return 0
+
+        new_games = pd.DataFrame(rows, columns=list(_ROW_COLUMNS.values()))
+        self.games = pd.concat([self.games, new_games], ignore_index=True) if len(self.games) else new_games
+        self.games = self.games.astype({"id": np.int64, "plies": np.int64, "llm_temp": float, "stockfish_elo": "Int64",
+                                        **{column: float for column in LLM_COUNTERS.values()}})
+        lengths = np.array([len(game_deltas) for game_deltas in deltas], dtype=np.int64)
+        self.offsets = np.concatenate((self.offsets, self.offsets[-1] + np.cumsum(lengths)))
+        self.start_material = np.concatenate((self.start_material, np.array(starts, dtype=np.int16)))
+        self.deltas = np.concatenate([self.deltas, *deltas])
+        self._tables = {}
+        self._save_cache()
+        return len(rows)
+
+    # Per-ply views, one entry per ply of every game.
+
+    def ply_game(self) -> np.ndarray:
+        """Index into `games` of every ply."""
+        return np.repeat(np.arange(len(self.games)), np.diff(self.offsets))
+
+    def ply_number(self) -> np.ndarray:
+        """1-based ply of every entry within its game."""
+        return np.arange(len(self.deltas)) - np.repeat(self.offsets[:-1], np.diff(self.offsets)) + 1
+
+    def llm_sign(self) -> np.ndarray:
+        """+1 for games where the LLM played White, -1 where it played Black."""
+        return np.where(self.games["llm_color"].to_numpy() == "White", 1, -1)
+
+    def llm_material(self) -> np.ndarray:
+        """The LLM's material balance after every ply."""
+        white = segment_cumsum(self.deltas, self.offsets) + np.repeat(self.start_material, np.diff(self.offsets))
+        return white * np.repeat(self.llm_sign(), np.diff(self.offsets))
+
+    def final_material(self) -> np.ndarray:
+        """The LLM's material balance at the end of every game."""
+        sums = np.diff(np.concatenate(([0], np.cumsum(self.deltas, dtype=np.int64)))[self.offsets])
+        return (self.start_material + sums) * self.llm_sign()
+
+    # Derived tables, cached until new games arrive.
+
+    def _table(self, key: tuple, build) -> pd.DataFrame:
+        if key not in self._tables:
+            self._tables[key] = build()
+            self._save_cache()
+        return self._tables[key]
+
+    def _groups(self, by: Sequence[str]) -> Tuple[np.ndarray, pd.DataFrame]:
+        grouped = self.games.groupby(list(by), dropna=False, sort=True)
+        codes = grouped.ngroup().to_numpy()
+        keys = grouped.size().reset_index()[list(by)]
+        return codes, keys
+
+    def results(self, by: Sequence[str] = CONFIG) -> pd.DataFrame:
+        """Win rate, game length, failed-answer and random-fallback rates and final material per group.
+
+        Unfinished games (no winner) count as draws. The failed-answer rate is the share of LLM
+        attempts that produced no legal move (illegal or unparsable answers, failed requests); the
+        fallback rate is the share of LLM moves that had to be played at random. Both only count
+        games recorded with the LLM move counters.
+        """
+        return self._table(("results", tuple(by)), lambda: self._results(by))
+
+    def _results(self, by: Sequence[str]) -> pd.DataFrame:
+        codes, table = self._groups(by)
+        if not len(self.games):
+            return table
+        n = len(table)
+
+        def total(values):
+            return np.bincount(codes, weights=values, minlength=n)
+
+        winner = self.games["winner"].to_numpy(dtype=object)
+        llm_color = self.games["llm_color"].to_numpy(dtype=object)
+        finished = pd.notna(self.games["winner"]).to_numpy()
+        wins = total(finished & (winner == llm_color))
+        losses = total(finished & (winner != llm_color))
+        games = total(np.ones(len(self.games)))
+        counters = self.games[list(LLM_COUNTERS.values())].to_numpy(dtype=float)
+        counted = ~np.isnan(counters).any(axis=1)
+        moves, attempts, retries, fallbacks = (total(np.where(counted, counters[:, i], 0.0)) for i in range(4))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            table["games"] = games.astype(np.int64)
+            table["wins"] = wins.astype(np.int64)
+            table["draws"] = (games - wins - losses).astype(np.int64)
+            table["losses"] = losses.astype(np.int64)
+            table["win_rate"] = wins / games
+            table["score"] = (wins + 0.5 * (games - wins - losses)) / games
+            table["mean_plies"] = total(self.games["plies"].to_numpy(dtype=float)) / games
+            table["adjudicated"] = total(pd.notna(self.games["adjudication"]).to_numpy()) / games
+            table["failed_rate"] = np.where(attempts > 0, (retries + fallbacks) / attempts, np.nan)
+            table["fallback_rate"] = np.where(moves > 0, fallbacks / moves, np.nan)
+            table["final_material"] = total(self.final_material().astype(float)) / games
+        return table
+
+    def material_curves(self, by: Sequence[str] = CONFIG) -> pd.DataFrame:
+        """Mean LLM material balance at every ply per group, over the games still running at that ply."""
+        return self._table(("material_curves", tuple(by)), lambda: self._material_curves(by))
+
+    def _material_curves(self, by: Sequence[str]) -> pd.DataFrame:
+        codes, keys = self._groups(by)
+        if not len(self.deltas):
+            return pd.DataFrame(columns=[*by, "ply", "games", "material"])
+        max_ply = int(np.diff(self.offsets).max())
+        cell = np.repeat(codes, np.diff(self.offsets)) * max_ply + self.ply_number() - 1
+        size = len(keys) * max_ply
+        games = np.bincount(cell, minlength=size).reshape(len(keys), max_ply)
+        material = np.bincount(cell, weights=self.llm_material(), minlength=size).reshape(len(keys), max_ply)
+        group, ply = np.nonzero(games)
+        curves = keys.iloc[group].reset_index(drop=True)
+        curves["ply"] = ply + 1
+        curves["games"] = games[group, ply]
+        curves["material"] = material[group, ply] / games[group, ply]
+        return curves
+
+
+def format_results(table: pd.DataFrame) -> str:
+    table = table.copy()
+    if "prompt_hash" in table:
+        table["prompt_hash"] = table["prompt_hash"].str[:8]
+    return table.to_string(index=False, na_rep="-", float_format=lambda value: f"{value:.3f}")
+
+
+def format_curves(curves: pd.DataFrame, by: Sequence[str], every: int = 10) -> str:
+    """Material curves as one row per group and one column every `every` plies."""
+    if curves.empty:
+        return "(no moves)"
+    curves = curves[curves["ply"] % every == 0].copy()
+    if "prompt_hash" in by:
+        curves["prompt_hash"] = curves["prompt_hash"].str[:8]
+    table = curves.pivot_table(index=list(by), columns="ply", values="material", dropna=False)
+    return table.to_string(na_rep="-", float_format=lambda value: f"{value:+.2f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Win rates, game lengths, failed-answer and fallback rates and "
+                                                 "material curves per configuration, from the experiment store.")
+    parser.add_argument("--store", default="ChessGameExperiment.sqlite")
+    parser.add_argument("--cache", default=None, help="Cache file (default: <store>.analytics.pkl).")
+    parser.add_argument("--by", nargs="+", default=list(CONFIG), choices=list(_ROW_COLUMNS.values()),
+                        help="Columns to group games by.")
+    parser.add_argument("--curves", type=int, default=0, metavar="PLIES",
+                        help="Also print the LLM's mean material balance every PLIES plies.")
+    args = parser.parse_args(argv)
+
+    analytics = ExperimentAnalytics(args.store, cache_path=args.cache)
+    print(format_results(analytics.results(args.by)))
+    if args.curves:
+        print()
+        print(format_curves(analytics.material_curves(args.by), args.by, every=args.curves))
+    print(f"> {len(analytics.games)} games, {len(analytics.deltas)} plies in {args.store}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,84 @@
 # %%
+import logging
 import chess
 import chess.svg
-from typing import List, Tuple
-from llm_player import LLMPlayer
-from stockfish_player import StockfishPlayer
-from IPython.display import display, clear_output
-import pandas as pd
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from game_record import GameRecord
+from game_events import emit, get_logger
+from instrumentation import NULL_TRACER
+
+if TYPE_CHECKING:
+    # Only annotations need the players here: llm_player imports langchain, which dominates startup.
+    from llm_player import LLMPlayer
+    from stockfish_player import StockfishPlayer
+
+logger = get_logger("game")
 
 class ChessGameManager:
-    def __init__(self, llm_player: LLMPlayer, stockfish_player: StockfishPlayer):
+    def __init__(self, llm_player: "LLMPlayer", stockfish_player: "StockfishPlayer", headless: bool = True):
+        # Headless games render nothing; progress is reported as log events and the board can be
+        # drawn afterwards from game_record(). headless=False restores the notebook display.
         self.board = chess.Board()
         self.llm_player = llm_player
         self.stockfish_player = stockfish_player
         self.move_history: List[str] = []
         self.board_svg = None
-        self.jupyter_board = True
+        self.headless = headless
+        self.jupyter_board = not headless
         self.turn = 1
         self.record_fen:List[str] = [self.get_current_fen()]
         self.color_winner = None
+        self.speculator = None
+        self.tracer = NULL_TRACER
+        self.adjudicator = None
+        self.adjudication = None
+        self.checkpointer = None
 
     def reset_game(self):
         self.board.reset()
         self.move_history.clear()
+        self.turn = 1
+        self.record_fen = [self.get_current_fen()]
         self.stockfish_player.reset_game()
-        print("Game has been reset.")
+        self.adjudication = None
+        if self.adjudicator is not None:
+            self.adjudicator.reset()
+        emit(logger, logging.INFO, "game_reset")
 
     def make_move(self, move: str) -> bool:
         try:
-            self.record_fen.append(self.get_current_fen())
-            chess_move = self.board.parse_san(move)
+            # Players answer in UCI; SAN is still accepted for moves typed by hand.
+            try:
+                chess_move = chess.Move.from_uci(move)
+            except ValueError:
+                chess_move = self.board.parse_san(move)
             if chess_move in self.board.legal_moves:
                 self.board.push(chess_move)
-                print(chess_move)
+                self.record_fen.append(self.get_current_fen())
                 self.move_history.append(str(self.turn) + ". " + move)
                 self.turn += 1
                 return True
             else:
-                print(f"Illegal move: {move}")
+                emit(logger, logging.WARNING, "illegal_move", move=move, fen=self.get_current_fen())
                 return False
         except ValueError:
-            print(f"Invalid move format: {move}")
+            emit(logger, logging.WARNING, "invalid_move_format", move=move, fen=self.get_current_fen())
             return False
 
+    def game_record(self) -> GameRecord:
+        return GameRecord.from_board(self.board)
+
+    def resume(self, record: GameRecord):
+        """Continue a checkpointed game: its moves are replayed onto a fresh board before play_game.
+
+        A checkpoint holds the moves only, so adjudication (whose streaks count Stockfish evaluations)
+        starts afresh from the resumed position.
+        """
+        self.reset_game()
+        for move in record.ucis():
+            if not self.make_move(move):
+                raise ValueError(f"checkpoint move {move} is illegal after {len(self.board.move_stack)} plies")
+
     def get_current_fen(self) -> str:
         return self.board.fen()
 
@@ -54,7 +91,6 @@ class ChessGameManager:
     def is_game_over(self) -> Tuple[bool, str]:
         if self.board.is_game_over():
             result = self.board.result()
-            df_histo = pd.read_csv("ChessGameExperiment.csv")
             if result == "1-0":
                 self.color_winner = "White"
                 return True, "White wins"
@@ -65,92 +101,244 @@ class ChessGameManager:
                 return True, "Draw"
         return False, ""
 
+    def enable_tracing(self, tracer):
+        # Per-ply timing spans for the manager and the LLM player (see instrumentation.py).
+        self.tracer = tracer
+        self.llm_player.tracer = tracer
+
+    def enable_adjudication(self, adjudicator):
+        # Decided games end early (resignation, dead draw, tablebase result; see adjudication.py).
+        self.adjudicator = adjudicator
+        adjudicator.reset()
+
+    def _stockfish_white_cp(self) -> Optional[int]:
+        score = self.stockfish_player.last_score
+        if score is None:
+            return None
+        # Stockfish scored the position for the side it just moved, which is no longer to move.
+        return score if self.board.turn == chess.BLACK else -score
+
+    def adjudicate(self, white_cp: Optional[int] = None) -> bool:
+        if self.adjudicator is None:
+            return False
+        decision = self.adjudicator.check(self.board, white_cp)
+        if decision is None:
+            return False
+        self.adjudication = decision
+        self.color_winner = decision.winner
+        emit(logger, logging.INFO, "game_adjudicated", reason=decision.reason, result=decision.result,
+             plies=decision.ply)
+        return True
+
+    def result(self) -> str:
+        return self.adjudication.result if self.adjudication is not None else self.board.result()
+
+    def enable_checkpoints(self, checkpointer):
+        # Called with the GameRecord after every ply that doesn't end the game (see job_queue.py).
+        self.checkpointer = checkpointer
+
+    def _checkpoint(self):
+        if self.checkpointer is not None:
+            with self.tracer.span("checkpoint"):
+                self.checkpointer(self.game_record())
+
+    def enable_speculation(self, speculator):
+        # The LLM starts answering Stockfish's likely moves while the real search runs (see speculative.py).
+        self.speculator = speculator
+
     def play_llm_turn(self):
+        self._prepare_llm_turn()
+        llm_output = None
+        if self.speculator is not None:
+            with self.tracer.span("speculation_take"):
+                llm_output = self.speculator.take(self)
+        if llm_output is None:
+            llm_output = self.llm_player.get_llm_best_move()
+        return self._apply_llm_move(llm_output)
+
+    async def aplay_llm_turn(self):
+        self._prepare_llm_turn()
+        llm_output = None
+        if self.speculator is not None:
+            with self.tracer.span("speculation_take"):
+                llm_output = await self.speculator.atake(self)
+        if llm_output is None:
+            llm_output = await self.llm_player.aget_llm_best_move()
+        return self._apply_llm_move(llm_output)
+
+    def _prepare_llm_turn(self):
+        self.tracer.ply = len(self.board.move_stack)
         legal_move_list = self.get_legal_move_list()
-        print("> List of legal movement", legal_move_list)
-        print("> List of past movement", self.move_history)
+        emit(logger, logging.DEBUG, "llm_turn", ply=len(self.board.move_stack),
+             legal_moves=legal_move_list, history=self.move_history)
 
-        self.llm_player.current_fen_board = self.get_current_fen()
-        self.llm_player.current_chess_board = self.get_board_visual()
-        self.llm_player.movement_history = " ".join(self.move_history) if self.move_history else "[]"
-        self.llm_player.legal_moves = " ".join(legal_move_list)
+        self.set_llm_position(self.llm_player, self.board, self.move_history)
 
-        llm_output = self.llm_player.get_llm_best_move()
-        llm_move = llm_output
+    @staticmethod
+    def set_llm_position(llm_player: "LLMPlayer", board: chess.Board, move_history: List[str]):
+        llm_player.current_fen_board = board.fen()
+        llm_player.current_chess_board = str(board)
+        llm_player.movement_history = " ".join(move_history) if move_history else "[]"
+        llm_player.legal_moves = " ".join(move.uci() for move in board.legal_moves)
+        llm_player.move_stack = board.move_stack
 
-        if self.make_move(llm_move):
-            print(f"LLM move: {llm_move}")
+    def _apply_llm_move(self, llm_output):
+        llm_move = llm_output
 
-            if self.jupyter_board == True:
-                self._get_board_visualization_jupyter()
-            else: 
-                print(self.board)
+        with self.tracer.span("board_update"):
+            moved = self.make_move(llm_move)
+        if moved:
+            emit(logger, logging.INFO, "move", player="llm", ply=len(self.board.move_stack), move=llm_move)
+            self._render()
             return True
         return False
 
     def play_stockfish_turn(self):
+        self.tracer.ply = len(self.board.move_stack)
+        if self.speculator is not None:
+            with self.tracer.span("speculation_launch"):
+                self.speculator.launch(self)
+        current_fen = self.get_current_fen()
+        self.stockfish_player.set_position_with_fen(current_fen)
+        with self.tracer.span("stockfish_search"):
+            stockfish_move = self.stockfish_player.get_stockfish_best_move()
+        return self._apply_stockfish_move(stockfish_move)
+
+    async def aplay_stockfish_turn(self):
+        self.tracer.ply = len(self.board.move_stack)
+        if self.speculator is not None:
+            with self.tracer.span("speculation_launch"):
+                await self.speculator.alaunch(self)
         current_fen = self.get_current_fen()
         self.stockfish_player.set_position_with_fen(current_fen)
-        stockfish_move = self.stockfish_player.get_stockfish_best_move()
-
-        if self.make_move(stockfish_move):
-            print(f"Stockfish move: {stockfish_move}")
-            
-            if self.jupyter_board == True:
-                self._get_board_visualization_jupyter()
-            else: 
-                print(self.board)
-            
+        with self.tracer.span("stockfish_search"):
+            stockfish_move = await self.stockfish_player.aget_stockfish_best_move()
+        return self._apply_stockfish_move(stockfish_move)
+
+    def _apply_stockfish_move(self, stockfish_move: str):
+        with self.tracer.span("board_update"):
+            moved = self.make_move(stockfish_move)
+        if moved:
+            emit(logger, logging.INFO, "move", player="stockfish", ply=len(self.board.move_stack),
+                 move=stockfish_move)
+            self._render()
             return True
         return False
 
+    def _stockfish_turn_ends_game(self, moved: bool) -> bool:
+        if not moved:
+            emit(logger, logging.WARNING, "game_aborted", reason="illegal stockfish move")
+            return True
+
+        game_over, result = self.is_game_over()
+
+        if game_over:
+            emit(logger, logging.INFO, "game_over", result=result, plies=len(self.board.move_stack))
+            return True
+
+        if self.adjudicate(self._stockfish_white_cp()):
+            return True
+
+        self._checkpoint()
+        return False
+
+    def _llm_turn_ends_game(self, moved: bool) -> bool:
+        if not moved:
+            emit(logger, logging.WARNING, "game_aborted", reason="illegal llm move")
+            return True
+
+        game_over, result = self.is_game_over()
+        if game_over:
+            emit(logger, logging.INFO, "game_over", result=result, plies=len(self.board.move_stack))
+            return True
+
+        if self.adjudicate():
+            return True
+
+        self._checkpoint()
+        return False
+
     def play_game(self, num_moves: int = 2):
-        for _ in range(num_moves):
+        # A resumed game continues from its move count; it may stop with the LLM to move.
+        if len(self.board.move_stack) % 2 and self._llm_turn_ends_game(self.play_llm_turn()):
+            return self._log_final_position()
 
-            if not self.play_stockfish_turn():
-                print("Stockfish made an illegal move. Game over.")
-                break
+        for _ in range(len(self.board.move_stack) // 2, num_moves):
 
-            game_over, result = self.is_game_over()
+            if self._stockfish_turn_ends_game(self.play_stockfish_turn()):
+                break
 
-            if game_over:
-                print(f"Game over: {result}")
+            if self._llm_turn_ends_game(self.play_llm_turn()):
                 break
 
+        self._log_final_position()
 
-            if not self.play_llm_turn():
-                print("LLM made an illegal move. Game over.")
+    async def aplay_game(self, num_moves: int = 2):
+        # Same loop as play_game, but the engine search and the LLM request yield to the
+        # event loop so many games can share one process.
+        if len(self.board.move_stack) % 2 and self._llm_turn_ends_game(await self.aplay_llm_turn()):
+            return self._log_final_position()
+
+        for _ in range(len(self.board.move_stack) // 2, num_moves):
+
+            if self._stockfish_turn_ends_game(await self.aplay_stockfish_turn()):
                 break
 
-            game_over, result = self.is_game_over()
-            if game_over:
-                print(f"Game over: {result}")
+            if self._llm_turn_ends_game(await self.aplay_llm_turn()):
                 break
 
-        print("Final board position:")
-        print(self.get_board_visual())
-        print(f"Move history: {', '.join(self.move_history)}")
+        self._log_final_position()
+
+    def _log_final_position(self):
+        if self.speculator is not None:
+            self.speculator.discard()
+        emit(logger, logging.INFO, "game_end", winner=self.color_winner, plies=len(self.board.move_stack),
+             fen=self.get_current_fen())
+        emit(logger, logging.DEBUG, "final_position", board="\n" + self.get_board_visual(),
+             history=", ".join(self.move_history))
+
+    def _render(self):
+        if self.headless:
+            return
+        if self.jupyter_board == True:
+            self._get_board_visualization_jupyter()
+        else:
+            print(self.board)
+
+    def get_board_svg(self, ply: Optional[int] = None, size: int = 350) -> str:
+        # On-demand drawing of any position of the current game, headless or not.
+        board = self.board if ply is None else self.game_record().board_at(ply)
+        return chess.svg.board(board, size=size)
 
     def _get_board_visualization_jupyter(self):
+        # IPython is only needed when a board is actually shown in a notebook.
+        from IPython.display import display, clear_output
         self.board_svg = chess.svg.board(self.board, size=350)
         clear_output(wait=True)
         display(self.board_svg)
 
-    def show_replay(self, liste_of_fen_move):
-        for i in liste_of_fen_move:
-            board_vierge = chess.Board(i)
-            display(board_vierge)
+    def show_replay(self, liste_of_fen_move, frame_seconds: float = 0.5):
+        # Accepts a GameRecord or a plain list of FEN strings; the game is shown as one replay player
+        # instead of a board per position.
+        from IPython.display import HTML, display
+        from replay_export import replay_html
+        if not isinstance(liste_of_fen_move, GameRecord):
+            liste_of_fen_move = GameRecord.from_fens(list(liste_of_fen_move))
+        display(HTML(replay_html(liste_of_fen_move, frame_seconds=frame_seconds)))
 
 
 # %%
 
 
 def test():
+    from llm_player import LLMPlayer
+    from stockfish_player import StockfishPlayer
+
     llm_player = LLMPlayer()
     llm_player.init_llm_model("phi3:3.8b", temperature=0.9)
 
     stockfish_player = StockfishPlayer("/Users/tancredeh/Desktop/DSProject/AI-Chess/llmVSstockfish/llm-vs-stockfish/stockfish/stockfish-macos-m1-apple-silicon")
     stockfish_player.init_stockfish(set_elo_rating=1000, set_depth=15)
 
-    game_manager = ChessGameManager(llm_player, stockfish_player)
+    game_manager = ChessGameManager(llm_player, stockfish_player, headless=False)
     game_manager.play_game(num_moves=50)
\ No newline at end of file
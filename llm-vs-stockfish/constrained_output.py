@@ -0,0 +1,73 @@
+# %%
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# JSON-schema structured outputs ("format": <schema>) were added to the Ollama server in 0.5.0.
+MIN_OLLAMA_VERSION = (0, 5, 0)
+
+_support: Dict[Tuple[str, str], bool] = {}
+_server_versions: Dict[str, Optional[Tuple[int, ...]]] = {}
+_lock = threading.Lock()
+
+
+def legal_move_schema(legal_moves: List[str], max_candidates: int = 5) -> dict:
+    """ChessOutput as a JSON schema whose moves can only be one of `legal_moves`."""
+    chess_move = {"type": "object",
+                  "properties": {"move": {"type": "string", "enum": list(legal_moves)},
+                                 "explanation": {"type": "string"}},
+                  "required": ["move", "explanation"]}
+    return {"type": "object",
+            "properties": {"candidate_moves": {"type": "array", "items": chess_move,
+                                               "maxItems": max_candidates},
+                           "best_move": {"type": "array", "items": chess_move, "minItems": 1, "maxItems": 1}},
+            "required": ["candidate_moves", "best_move"]}
+
+
+def _parse_version(text: str) -> Optional[Tuple[int, ...]]:
+    try:
+        return tuple(int(part) for part in text.split("-")[0].split(".")[:3])
+    except ValueError:
+        return None
+
+
+def server_version(base_url: Optional[str]) -> Optional[Tuple[int, ...]]:
+    import httpx
+
+    base_url = base_url or "http://127.0.0.1:11434"
+    with _lock:
+        if base_url in _server_versions:
+            return _server_versions[base_url]
+    try:
+        version = _parse_version(httpx.get(f"{base_url.rstrip('/')}/api/version", timeout=5).json()["version"])
+    except Exception:
+        version = None
+    with _lock:
+        _server_versions[base_url] = version
+    return version
+
+
+def supports_schema(base_url: Optional[str], model_name: str) -> bool:
+    """Whether constrained decoding is worth trying for this server and model.
+
+    Servers older than MIN_OLLAMA_VERSION are ruled out up front; a model is ruled out when a
+    constrained request to it has been rejected (see `mark_unsupported`).
+    """
+    with _lock:
+        known = _support.get((base_url or "", model_name))
+    if known is not None:
+        return known
+    version = server_version(base_url)
+    supported = version is None or version >= MIN_OLLAMA_VERSION
+    with _lock:
+        _support.setdefault((base_url or "", model_name), supported)
+        return _support[(base_url or "", model_name)]
+
+
+def mark_unsupported(base_url: Optional[str], model_name: str):
+    with _lock:
+        _support[(base_url or "", model_name)] = False
+
+
+def is_schema_rejection(error: Exception) -> bool:
+    # ollama.ResponseError carries the HTTP status; a 400 on a schema request means the format was refused.
+    return type(error).__name__ == "ResponseError" and getattr(error, "status_code", None) == 400
@@ -0,0 +1,321 @@
+# %%
+import argparse
+import itertools
+import logging
+import math
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from game_events import configure_logging
+
+STATUSES = ("open", "weaker", "stronger", "capped", "settled", "failed")
+
+
+class Cell(NamedTuple):
+    model_name: str
+    temperature: float
+    stockfish_elo: int
+
+    @property
+    def config(self) -> Tuple[str, float]:
+        return self.model_name, self.temperature
+
+
+def expected_score(llm_elo: float, opponent_elo: float) -> float:
+    return 1.0 / (1.0 + 10.0 ** ((opponent_elo - llm_elo) / 400.0))
+
+
+def game_score(row: dict, unfinished: Optional[float] = 0.5) -> Optional[float]:
+    """The LLM's score in a stored game: 1 win, 0.5 draw, 0 loss; `unfinished` for games stopped at the move cap."""
+    if row.get("Win") is not None:
+        return 1.0 if row["Win"] == row.get("LLM_color") else 0.0
+    if row.get("Result") == "1/2-1/2":
+        return 0.5
+    return unfinished
+
+
+class _CellStats:
+    __slots__ = ("games", "score", "pending", "ignored", "failures", "status")
+
+    def __init__(self):
+        self.games = 0
+        self.score = 0.0
+        self.pending = 0
+        self.ignored = 0
+        self.failures = 0
+        self.status = "open"
+
+    @property
+    def played(self) -> int:
+        # Games counting towards max_games_per_cell: scored or not, but not crashed.
+        return self.games + self.ignored
+
+
+class EloPlanner:
+    """Plans LLM vs Stockfish games cell by cell (model x temperature x Stockfish Elo) until the
+    LLM's Elo is known well enough, instead of playing a fixed number of games everywhere.
+
+    Each cell runs an SPRT between "the LLM is `elo_delta` weaker than this Stockfish" and "`elo_delta`
+    stronger" (draws count as half a point); a cell stops once either is accepted or after
+    `max_games_per_cell` games. Each configuration (model, temperature) gets a grid posterior over its
+    Elo from all its games under a normal prior; the configuration stops once the 95% credible interval
+    is narrower than `target_ci`. The next games go to the open cells with the most Fisher information
+    at the current estimate, i.e. whose Stockfish is closest to the LLM's strength.
+    """
+
+    def __init__(self, cells: Iterable[Cell], elo_delta: float = 200.0, alpha: float = 0.05, beta: float = 0.05,
+                 max_games_per_cell: int = 40, target_ci: float = 200.0, max_failures: int = 3,
+                 prior_mean: float = 1000.0, prior_sd: float = 800.0, grid_step: float = 10.0):
+        self.cells: Dict[Cell, _CellStats] = {cell: _CellStats() for cell in cells}
+        self.elo_delta = elo_delta
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+        self.max_games_per_cell = max_games_per_cell
+        self.target_ci = target_ci
+        self.max_failures = max_failures
+        self.prior_mean = prior_mean
+        self.prior_sd = prior_sd
+        elos = [cell.stockfish_elo for cell in self.cells] or [prior_mean]
+        low, high = min(elos) - 1200, max(elos) + 1200
+        self.grid = [low + i * grid_step for i in range(int((high - low) / grid_step) + 1)]
+
+    @classmethod
+    def sweep(cls, models: Iterable[str], temperatures: Iterable[float], elos: Iterable[int], **kwargs) -> "EloPlanner":
+        return cls((Cell(m, t, e) for m, t, e in itertools.product(models, temperatures, elos)), **kwargs)
+
+    def configs(self) -> List[Tuple[str, float]]:
+        return list(dict.fromkeys(cell.config for cell in self.cells))
+
+    def llr(self, cell: Cell) -> float:
+        stats = self.cells[cell]
+        p0 = expected_score(cell.stockfish_elo - self.elo_delta, cell.stockfish_elo)
+        p1 = expected_score(cell.stockfish_elo + self.elo_delta, cell.stockfish_elo)
+        return (stats.score * math.log(p1 / p0)
+                + (stats.games - stats.score) * math.log((1 - p1) / (1 - p0)))
+
+    def _update_status(self, cell: Cell):
+        stats = self.cells[cell]
+        if stats.status == "open":
+            llr = self.llr(cell)
+            if llr >= self.upper:
+                stats.status = "stronger"
+            elif llr <= self.lower:
+                stats.status = "weaker"
+            elif stats.played >= self.max_games_per_cell:
+                stats.status = "capped"
+            elif stats.failures >= self.max_failures:
+                stats.status = "failed"
+        if self.estimate(cell.config)["ci_width"] <= self.target_ci:
+            for other, other_stats in self.cells.items():
+                if other.config == cell.config and other_stats.status == "open":
+                    other_stats.status = "settled"
+
+    def record(self, cell: Cell, score: Optional[float]):
+        """A finished game; `score` None marks a game without a result (stopped at the move cap while
+        unfinished games are ignored), which only counts towards the cell's game cap."""
+        stats = self.cells[cell]
+        stats.pending = max(stats.pending - 1, 0)
+        if score is None:
+            stats.ignored += 1
+        else:
+            stats.games += 1
+            stats.score += score
+        self._update_status(cell)
+
+    def record_error(self, cell: Cell):
+        """A game that crashed; the cell is given up after `max_failures` of them."""
+        stats = self.cells[cell]
+        stats.pending = max(stats.pending - 1, 0)
+        stats.failures += 1
+        self._update_status(cell)
+
+    def start(self, cell: Cell):
+        self.cells[cell].pending += 1
+
+    def load_store(self, store, unfinished: Optional[float] = 0.5) -> int:
+        """Count the games already in an ExperimentStore towards their cells; returns how many were used."""
+        used = 0
+        for row in store.iter_games():
+            cell = Cell(row["LLM_model_name"], row["LLM_temp"], row["Stockfish_elo"])
+            score = game_score(row, unfinished)
+            if cell in self.cells and score is not None:
+                stats = self.cells[cell]
+                stats.games += 1
+                stats.score += score
+                used += 1
+        for cell in self.cells:
+            self._update_status(cell)
+        return used
+
+    def posterior(self, config: Tuple[str, float]) -> List[float]:
+        log_post = [-0.5 * ((elo - self.prior_mean) / self.prior_sd) ** 2 for elo in self.grid]
+        for cell, stats in self.cells.items():
+            if cell.config != config or stats.games == 0:
+                continue
+            for i, elo in enumerate(self.grid):
+                p = min(max(expected_score(elo, cell.stockfish_elo), 1e-12), 1 - 1e-12)
+                log_post[i] += stats.score * math.log(p) + (stats.games - stats.score) * math.log(1 - p)
+        top = max(log_post)
+        weights = [math.exp(value - top) for value in log_post]
+        total = sum(weights)
+        return [weight / total for weight in weights]
+
+    def estimate(self, config: Tuple[str, float], level: float = 0.95) -> dict:
+        posterior = self.posterior(config)
+        mean = sum(elo * p for elo, p in zip(self.grid, posterior))
+        tail, cumulative, low, high = (1 - level) / 2, 0.0, self.grid[0], self.grid[-1]
+        for elo, p in zip(self.grid, posterior):
+            if cumulative < tail <= cumulative + p:
+                low = elo
+            if cumulative < 1 - tail <= cumulative + p:
+                high = elo
+            cumulative += p
+        games = sum(stats.games for cell, stats in self.cells.items() if cell.config == config)
+        return {"elo": mean, "low": low, "high": high, "ci_width": high - low, "games": games}
+
+    def _information(self, cell: Cell, estimates: Dict[Tuple[str, float], dict]) -> float:
+        p = expected_score(estimates[cell.config]["elo"], cell.stockfish_elo)
+        stats = self.cells[cell]
+        # Spread concurrent games: each pending game already claims part of the cell's information.
+        return p * (1 - p) / (1 + stats.pending)
+
+    def _playable(self, cell: Cell) -> bool:
+        stats = self.cells[cell]
+        return stats.status == "open" and stats.played + stats.pending < self.max_games_per_cell
+
+    def open_models(self) -> List[str]:
+        """Models with cells still to play, in sweep order."""
+        return list(dict.fromkeys(cell.model_name for cell in self.cells if self._playable(cell)))
+
+    def next_cells(self, n: int, model_name: Optional[str] = None) -> List[Cell]:
+        """Up to `n` cells to play next (a cell can appear several times), only of `model_name` if given."""
+        estimates = {config: self.estimate(config) for config in self.configs()}
+        chosen = []
+        for _ in range(n):
+            candidates = [cell for cell in self.cells
+                          if self._playable(cell) and model_name in (None, cell.model_name)]
+            if not candidates:
+                break
+            cell = max(candidates, key=lambda c: (self._information(c, estimates), -self.cells[c].games))
+            self.start(cell)
+            chosen.append(cell)
+        return chosen
+
+    @property
+    def games_played(self) -> int:
+        return sum(stats.games for stats in self.cells.values())
+
+    def summary(self, fixed_games_per_cell: Optional[int] = None) -> str:
+        lines = [f"{'model':<24} {'temp':>5} {'elo':>7} {'95% CI':>15} {'games':>6}"]
+        for config in self.configs():
+            estimate = self.estimate(config)
+            lines.append(f"{config[0]:<24} {config[1]:>5.2f} {estimate['elo']:>7.0f} "
+                         f"{estimate['low']:>7.0f}-{estimate['high']:<7.0f} {estimate['games']:>6}")
+        lines.append(f"{'model':<24} {'temp':>5} {'sf elo':>7} {'games':>6} {'score':>6} {'llr':>6}  status")
+        for cell, stats in self.cells.items():
+            lines.append(f"{cell.model_name:<24} {cell.temperature:>5.2f} {cell.stockfish_elo:>7} {stats.games:>6} "
+                         f"{stats.score / stats.games if stats.games else 0.0:>6.2f} {self.llr(cell):>6.2f}  {stats.status}")
+        if fixed_games_per_cell:
+            fixed = fixed_games_per_cell * len(self.cells)
+            lines.append(f"{self.games_played} games played instead of {fixed} for a fixed "
+                         f"{fixed_games_per_cell}-game grid ({1 - self.games_played / fixed:.0%} saved)")
+        return "\n".join(lines)
+
+
+def run_plan(planner: EloPlanner, base_spec, workers: int = 1, store_path: str = "ChessGameExperiment.sqlite",
+             unfinished: Optional[float] = 0.5, residency=None) -> EloPlanner:
+    """Play the planner's games in a process pool, refilling each worker as soon as its game ends.
+
+    Games are played one model at a time: the next model only starts once every cell of the current
+    one is decided and its last games are done, so Ollama swaps models once per model instead of
+    between interleaved games. A ModelResidency, if given, loads each model before its first game.
+    """
+    from experiment_store import ExperimentStore
+    from tournament import play_single_game
+
+    store = ExperimentStore(store_path)
+    index = itertools.count()
+    pending = {}
+    model = None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            models = planner.open_models()
+            if model not in models and models and not pending:
+                model = models[0]
+                if residency is not None:
+                    residency.activate(model)
+            for cell in planner.next_cells(workers - len(pending), model_name=model) if model in models else []:
+                spec = base_spec.model_copy(update={"model_name": cell.model_name, "temperature": cell.temperature,
+                                                    "stockfish_elo": cell.stockfish_elo, "num_games": 1})
+                pending[pool.submit(play_single_game, spec, next(index))] = cell
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                cell = pending.pop(future)
+                result = future.result()
+                if result.error is not None:
+                    print(f"> {cell} failed: {result.error}")
+                    planner.record_error(cell)
+                    continue
+                store.record_game(result.row)
+                score = game_score(result.row, unfinished)
+                planner.record(cell, score)
+                print(f"> {cell.model_name} t={cell.temperature} vs {cell.stockfish_elo}: score {score}, "
+                      f"cell {planner.cells[cell].status}")
+    return planner
+
+
+def main(argv: Optional[List[str]] = None):
+    from tournament import GameSpec
+
+    parser = argparse.ArgumentParser(description="Estimate LLM Elo with sequential tests instead of fixed game counts.")
+    parser.add_argument("--model", action="append", required=True)
+    parser.add_argument("--temperature", type=float, action="append", default=None)
+    parser.add_argument("--elo", type=int, nargs="+", required=True, help="Stockfish Elo levels of the sweep.")
+    parser.add_argument("--stockfish-path", default=None, help="Needed unless --estimate-only.")
+    parser.add_argument("--depth", type=int, default=15)
+    parser.add_argument("--moves", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--store", default="ChessGameExperiment.sqlite")
+    parser.add_argument("--use-store", action="store_true", help="Count the games already in the store.")
+    parser.add_argument("--estimate-only", action="store_true", help="Only print estimates from the store.")
+    parser.add_argument("--elo-delta", type=float, default=200.0, help="SPRT hypotheses: LLM this much weaker/stronger.")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--max-games-per-cell", type=int, default=40)
+    parser.add_argument("--target-ci", type=float, default=200.0, help="Stop a configuration below this 95%% CI width.")
+    parser.add_argument("--unfinished", choices=["draw", "ignore"], default="draw",
+                        help="How games stopped at the move cap are scored.")
+    parser.add_argument("--ollama-url", default=None)
+    parser.add_argument("--keep-alive", default=None, help="How long Ollama keeps a model loaded between requests.")
+    parser.add_argument("--prewarm", action="store_true",
+                        help="Load each model (unloading the previous one) before its first game.")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args(argv)
+    configure_logging(getattr(logging, args.log_level))
+
+    planner = EloPlanner.sweep(args.model, args.temperature or [0.1], args.elo, elo_delta=args.elo_delta,
+                               alpha=args.alpha, beta=args.beta, max_games_per_cell=args.max_games_per_cell,
+                               target_ci=args.target_ci)
+    unfinished = 0.5 if args.unfinished == "draw" else None
+    if args.use_store or args.estimate_only:
+        from experiment_store import ExperimentStore
+        print(f"> {planner.load_store(ExperimentStore(args.store), unfinished)} stored games used")
+    if not args.estimate_only:
+        if args.stockfish_path is None:
+            parser.error("--stockfish-path is required to play games")
+        spec = GameSpec(model_name=args.model[0], stockfish_path=args.stockfish_path, stockfish_depth=args.depth,
+                        num_moves=args.moves, ollama_base_url=args.ollama_url, ollama_keep_alive=args.keep_alive)
+        residency = None
+        if args.prewarm:
+            from model_residency import ModelResidency
+            residency = ModelResidency(args.ollama_url, keep_alive=args.keep_alive or "30m")
+        run_plan(planner, spec, workers=args.workers, store_path=args.store, unfinished=unfinished,
+                 residency=residency)
+    print(planner.summary(fixed_games_per_cell=None if args.estimate_only else args.max_games_per_cell))
+    return planner
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# %%
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional
+
+from stockfish import Stockfish, StockfishException
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+class EngineKey(NamedTuple):
+    path: str
+    elo: Optional[int]  # None plays at full strength
+    depth: int
+    hash_mb: int = 16
+    threads: int = 1
+    multipv: int = 1
+
+
+class _WrapperProcess:
+    """The UCI process behind a `stockfish.Stockfish` wrapper.
+
+    Written against the stockfish wrapper 3.28, which has no public health check or shutdown that
+    is safe on a crashed process: this is the only place touching its private `_stockfish` (the
+    Popen), `_is_ready` and `_put`. Check it when upgrading the wrapper.
+    """
+
+    def __init__(self, engine: Stockfish):
+        self.engine = engine
+        self.popen = engine._stockfish
+
+    def exited(self) -> bool:
+        return self.popen.poll() is not None
+
+    def ping(self):
+        self.engine._is_ready()
+
+    def quit(self):
+        try:
+            self.engine._put("quit")
+            self.popen.wait(timeout=2)
+        except Exception:
+            self.popen.kill()
+
+
+class EnginePool:
+    """Warm Stockfish processes shared by successive games, one bucket per EngineKey.
+
+    Engines belong to the process that spawned them. A pool inherited through fork (a process pool
+    worker) forgets the parent's engines without touching them and starts its own.
+    """
+
+    def __init__(self, max_engines_per_key: int = 4):
+        self.max_engines_per_key = max_engines_per_key
+        self._idle: Dict[EngineKey, List[Stockfish]] = {}
+        self._size: Dict[EngineKey, int] = {}
+        # id(engine) -> pid of the process that spawned it.
+        self._owners: Dict[int, int] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Condition()
+        self.stats = {"checkouts": 0, "created": 0, "reused": 0, "waits": 0,
+                      "wait_time": 0.0, "restarts": 0, "inherited": 0}
+
+    def _forget_inherited(self):
+        # Called with the lock held. Engines spawned by the parent process (idle or checked out at
+        # fork time) are the parent's to use and to quit; signalling them from here would send
+        # `quit` down the parent's pipes.
+        if self._pid == os.getpid():
+            return
+        self.stats["inherited"] += sum(len(engines) for engines in self._idle.values())
+        self._idle, self._size, self._owners = {}, {}, {}
+        self._pid = os.getpid()
+
+    def _owns(self, engine: Stockfish) -> bool:
+        return self._owners.get(id(engine)) == os.getpid()
+
+    def _spawn(self, key: EngineKey) -> Stockfish:
+        engine = Stockfish(path=key.path, depth=key.depth,
+                           parameters={"Hash": key.hash_mb, "Threads": key.threads, "MultiPV": key.multipv})
+        if key.elo is not None:
+            engine.set_elo_rating(key.elo)
+        return engine
+
+    @staticmethod
+    def is_alive(engine: Stockfish) -> bool:
+        process = _WrapperProcess(engine)
+        if process.exited():
+            return False
+        try:
+            process.ping()
+            return True
+        except (StockfishException, BrokenPipeError, OSError):
+            return False
+
+    @staticmethod
+    def _quit(engine: Stockfish):
+        _WrapperProcess(engine).quit()
+
+    def _retire(self, engine: Stockfish):
+        if self._owners.pop(id(engine), None) == os.getpid():
+            self._quit(engine)
+
+    def checkout(self, key: EngineKey, timeout: Optional[float] = None) -> Stockfish:
+        with self._lock:
+            self._forget_inherited()
+            self.stats["checkouts"] += 1
+            idle = self._idle.setdefault(key, [])
+            if not idle and self._size.get(key, 0) >= self.max_engines_per_key:
+                self.stats["waits"] += 1
+                start = time.perf_counter()
+                if not self._lock.wait_for(lambda: idle, timeout=timeout):
+                    raise TimeoutError(f"No Stockfish engine available for {key} after {timeout}s")
+                self.stats["wait_time"] += time.perf_counter() - start
+            engine = idle.pop() if idle else None
+            if engine is None:
+                self._size[key] = self._size.get(key, 0) + 1
+
+        if engine is None:
+            engine = self._spawn_or_free(key)
+            with self._lock:
+                self.stats["created"] += 1
+            return engine
+
+        with self._lock:
+            self.stats["reused"] += 1
+        if not self.is_alive(engine):
+            return self.restart(key, engine)
+        # ucinewgame clears the transposition table so games stay independent.
+        engine.set_fen_position(START_FEN, send_ucinewgame_token=True)
+        return engine
+
+    def _spawn_or_free(self, key: EngineKey) -> Stockfish:
+        # The caller holds one of the key's slots: give it back if no engine can be started.
+        try:
+            engine = self._spawn(key)
+        except Exception:
+            with self._lock:
+                self._size[key] -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._owners[id(engine)] = os.getpid()
+        return engine
+
+    def restart(self, key: EngineKey, engine: Stockfish) -> Stockfish:
+        self._retire(engine)
+        with self._lock:
+            self.stats["restarts"] += 1
+        return self._spawn_or_free(key)
+
+    def release(self, key: EngineKey, engine: Stockfish):
+        with self._lock:
+            self._forget_inherited()
+            if not self._owns(engine):
+                # Checked out before a fork: it isn't counted here any more.
+                return
+            self._idle.setdefault(key, []).append(engine)
+            self._lock.notify()
+
+    @contextmanager
+    def engine(self, key: EngineKey, timeout: Optional[float] = None):
+        engine = self.checkout(key, timeout=timeout)
+        try:
+            yield engine
+        finally:
+            self.release(key, engine)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            self._forget_inherited()
+            return dict(self.stats,
+                        engines=sum(self._size.values()),
+                        idle=sum(len(engines) for engines in self._idle.values()))
+
+    def close(self):
+        with self._lock:
+            self._forget_inherited()
+            for engines in self._idle.values():
+                for engine in engines:
+                    self._retire(engine)
+            for key, engines in self._idle.items():
+                self._size[key] -= len(engines)
+                engines.clear()
@@ -0,0 +1,257 @@
+# %%
+import ast
+import csv
+import hashlib
+import math
+import sqlite3
+import sys
+import time
+from typing import Iterator, List, Optional
+
+from game_record import GameRecord
+
+# Column names of the historical ChessGameExperiment.csv, kept as the row format of the store. The
+# per-ply FEN_game_historic list is replaced by a GameRecord; rows still carrying it are converted.
+# Result and Adjudication (the rule that ended the game early, if any) are absent from legacy rows, and
+# so are the LLM's move counters: answers asked for, attempts made, retries and random fallbacks.
+COLUMNS = ["Game_record", "LLM_color", "LLM_model_name", "Win", "Stockfish_elo",
+           "Prompt_schema", "LLM_temp", "Parser_schema", "Result", "Adjudication",
+           "LLM_moves", "LLM_attempts", "LLM_retries", "LLM_random_fallbacks"]
+
+# Row key -> games column of the LLM move counters.
+LLM_COUNTERS = {"LLM_moves": "llm_moves", "LLM_attempts": "llm_attempts", "LLM_retries": "llm_retries",
+                "LLM_random_fallbacks": "llm_fallbacks"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    hash TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at REAL NOT NULL,
+    source TEXT UNIQUE,
+    llm_color TEXT,
+    model_name TEXT,
+    winner TEXT,
+    stockfish_elo INTEGER,
+    llm_temp REAL,
+    prompt_hash TEXT REFERENCES texts(hash),
+    parser_hash TEXT REFERENCES texts(hash),
+    start_fen TEXT NOT NULL,
+    moves BLOB NOT NULL,
+    plies INTEGER NOT NULL,
+    result TEXT,
+    adjudication TEXT,
+    llm_moves INTEGER,
+    llm_attempts INTEGER,
+    llm_retries INTEGER,
+    llm_fallbacks INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS games_model ON games(model_name);
+CREATE INDEX IF NOT EXISTS games_elo ON games(stockfish_elo);
+CREATE INDEX IF NOT EXISTS games_temp ON games(llm_temp);
+CREATE INDEX IF NOT EXISTS games_winner ON games(winner);
+"""
+
+
+def text_hash(body: str) -> str:
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _clean(value):
+    # pandas writes missing values as NaN; the store uses NULL.
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value == "":
+        return None
+    return value
+
+
+class ExperimentStore:
+    """Append-only SQLite store of played games.
+
+    Each game is one INSERT inside its own transaction, so any number of processes can record
+    games concurrently. Prompt and parser texts are stored once in `texts` and referenced by hash.
+    """
+
+    def __init__(self, path: str = "ChessGameExperiment.sqlite"):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Stores created before games could be adjudicated lack the result columns, and older ones
+        # the LLM move counters.
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(games)")}
+        added = {"result": "TEXT", "adjudication": "TEXT", **{column: "INTEGER" for column in LLM_COUNTERS.values()}}
+        for column, kind in added.items():
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE games ADD COLUMN {column} {kind}")
+
+    def _put_text(self, body) -> Optional[str]:
+        body = _clean(body)
+        if body is None:
+            return None
+        body = str(body)
+        digest = text_hash(body)
+        self._db.execute("INSERT OR IGNORE INTO texts VALUES (?, ?)", (digest, body))
+        return digest
+
+    def record_game(self, row: dict, source: Optional[str] = None) -> Optional[int]:
+        """Append one game given as a row with the CSV column names; returns its id.
+
+        Rows carrying a `source` already in the store are skipped and None is returned.
+        """
+        record = row.get("Game_record")
+        if record is None:
+            record = GameRecord.from_fens(list(row.get("FEN_game_historic") or []))
+        elo = _clean(row.get("Stockfish_elo"))
+        temp = _clean(row.get("LLM_temp"))
+        counters = [_clean(row.get(key)) for key in LLM_COUNTERS]
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            prompt_hash = self._put_text(row.get("Prompt_schema"))
+            parser_hash = self._put_text(row.get("Parser_schema"))
+            cursor = self._db.execute(
+                """INSERT OR IGNORE INTO games (recorded_at, source, llm_color, model_name, winner, stockfish_elo,
+                                                llm_temp, prompt_hash, parser_hash, start_fen, moves, plies,
+                                                result, adjudication, llm_moves, llm_attempts, llm_retries,
+                                                llm_fallbacks)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (time.time(), source, _clean(row.get("LLM_color")), _clean(row.get("LLM_model_name")),
+                 _clean(row.get("Win")), int(elo) if elo is not None else None,
+                 float(temp) if temp is not None else None, prompt_hash, parser_hash,
+                 record.start_fen, record.to_bytes(), len(record),
+                 _clean(row.get("Result")), _clean(row.get("Adjudication")),
+                 *(int(value) if value is not None else None for value in counters)))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def get_text(self, digest: Optional[str]) -> Optional[str]:
+        if digest is None:
+            return None
+        row = self._db.execute("SELECT body FROM texts WHERE hash = ?", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def _where(self, model_name=None, stockfish_elo=None, llm_temp=None, winner=None, after_id=None):
+        clauses, params = [], []
+        for column, value in (("model_name", model_name), ("stockfish_elo", stockfish_elo),
+                              ("llm_temp", llm_temp), ("winner", winner)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if after_id is not None:
+            clauses.append("id > ?")
+            params.append(after_id)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, **filters) -> int:
+        where, params = self._where(**filters)
+        return self._db.execute(f"SELECT COUNT(*) FROM games{where}", params).fetchone()[0]
+
+    def iter_games(self, with_texts: bool = False, **filters) -> Iterator[dict]:
+        """Yield games as rows with the store column names plus `id`, `Plies`, `prompt_hash` and `parser_hash`.
+
+        Filters (model_name, stockfish_elo, llm_temp, winner, after_id) are answered from the indexes.
+        Prompt and parser texts are only joined in when `with_texts` is set.
+        """
+        where, params = self._where(**filters)
+        cursor = self._db.execute(
+            f"""SELECT id, llm_color, model_name, winner, stockfish_elo, llm_temp, prompt_hash, parser_hash,
+                       start_fen, moves, plies, result, adjudication, {", ".join(LLM_COUNTERS.values())}
+                FROM games{where} ORDER BY id""", params)
+        texts = {}
+        for (game_id, color, model_name, winner, elo, temp, prompt_hash, parser_hash,
+             start_fen, moves, plies, result, adjudication, *counters) in cursor:
+            row = {"id": game_id,
+                   "Game_record": GameRecord.from_bytes(moves, start_fen),
+                   "Plies": plies,
+                   "LLM_color": color,
+                   "LLM_model_name": model_name,
+                   "Win": winner,
+                   "Stockfish_elo": elo,
+                   "LLM_temp": temp,
+                   "Result": result,
+                   "Adjudication": adjudication,
+                   "prompt_hash": prompt_hash,
+                   "parser_hash": parser_hash,
+                   **dict(zip(LLM_COUNTERS, counters))}
+            if with_texts:
+                for digest in (prompt_hash, parser_hash):
+                    if digest not in texts:
+                        texts[digest] = self.get_text(digest)
+                row["Prompt_schema"] = texts[prompt_hash]
+                row["Parser_schema"] = texts[parser_hash]
+            yield row
+
+    def results_by_config(self, **filters) -> List[dict]:
+        """Games, LLM wins/draws/losses and mean plies per (model, temperature, Stockfish Elo), from SQL alone.
+
+        Unfinished games (no winner) count as draws, like the historical CSV analysis.
+        """
+        where, params = self._where(**filters)
+        cursor = self._db.execute(
+            f"""SELECT model_name, llm_temp, stockfish_elo, COUNT(*),
+                       SUM(winner IS NOT NULL AND winner = llm_color),
+                       SUM(winner IS NULL),
+                       SUM(winner IS NOT NULL AND winner != llm_color),
+                       AVG(plies)
+                FROM games{where} GROUP BY model_name, llm_temp, stockfish_elo
+                ORDER BY model_name, llm_temp, stockfish_elo""", params)
+        return [{"model_name": model_name, "llm_temp": temp, "stockfish_elo": elo, "games": games,
+                 "wins": wins, "draws": draws, "losses": losses, "score": (wins + 0.5 * draws) / games,
+                 "mean_plies": mean_plies}
+                for model_name, temp, elo, games, wins, draws, losses, mean_plies in cursor]
+
+    def to_dataframe(self, with_texts: bool = False, **filters):
+        import pandas as pd
+        return pd.DataFrame(list(self.iter_games(with_texts=with_texts, **filters)))
+
+    def import_csv(self, csv_path: str) -> int:
+        """One-shot import of a legacy experiment CSV; re-running it skips rows already imported."""
+        csv.field_size_limit(sys.maxsize)
+        imported = 0
+        with open(csv_path, newline="") as f:
+            for line_number, row in enumerate(csv.DictReader(f), start=1):
+                fens = row.get("FEN_game_historic") or "[]"
+                try:
+                    row["Game_record"] = GameRecord.from_fens([str(fen) for fen in ast.literal_eval(fens)])
+                except (ValueError, SyntaxError) as e:
+                    print(f"Skipping row {line_number} of {csv_path}: unreadable FEN history ({e})")
+                    continue
+                for column in ("Stockfish_elo", "LLM_temp"):
+                    try:
+                        row[column] = float(row[column]) if _clean(row.get(column)) is not None else None
+                    except ValueError:
+                        row[column] = None
+                if self.record_game(row, source=f"{csv_path}:{line_number}") is not None:
+                    imported += 1
+        return imported
+
+    def close(self):
+        self._db.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import legacy experiment CSV files into the experiment store.")
+    parser.add_argument("csv_files", nargs="+")
+    parser.add_argument("--store", default="ChessGameExperiment.sqlite")
+    args = parser.parse_args(argv)
+
+    store = ExperimentStore(args.store)
+    for csv_path in args.csv_files:
+        print(f"> {store.import_csv(csv_path)} games imported from {csv_path}")
+    print(f"> {store.count()} games in {args.store}")
+
+
+if __name__ == "__main__":
+    main()
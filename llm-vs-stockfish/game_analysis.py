@@ -0,0 +1,338 @@
+# %%
+import argparse
+import logging
+import math
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import chess
+
+from game_events import configure_logging, emit, get_logger
+
+logger = get_logger("analysis")
+
+# Same folding of mates into centipawns as StockfishPlayer.last_score.
+MATE_SCORE = 100_000
+# Centipawn loss is measured on evaluations clamped to +-CP_CAP, so a missed mate in a won position
+# doesn't swamp the average.
+CP_CAP = 1000
+# Drops in the mover's winning chances (on a -1..1 scale) classifying a move, as lichess does.
+THRESHOLDS = (("blunder", 0.3), ("mistake", 0.2), ("inaccuracy", 0.1))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    epd TEXT PRIMARY KEY,
+    depth INTEGER NOT NULL,
+    cp INTEGER NOT NULL,
+    best_move TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS move_analysis (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    ply INTEGER NOT NULL,
+    mover TEXT NOT NULL,
+    move TEXT NOT NULL,
+    best_move TEXT,
+    eval_before INTEGER NOT NULL,
+    eval_after INTEGER NOT NULL,
+    cp_loss INTEGER NOT NULL,
+    classification TEXT,
+    accuracy REAL NOT NULL,
+    PRIMARY KEY (game_id, ply)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS game_analysis (
+    game_id INTEGER PRIMARY KEY REFERENCES games(id),
+    depth INTEGER NOT NULL,
+    plies INTEGER NOT NULL,
+    llm_moves INTEGER NOT NULL,
+    acpl REAL,
+    accuracy REAL,
+    blunders INTEGER NOT NULL,
+    mistakes INTEGER NOT NULL,
+    inaccuracies INTEGER NOT NULL,
+    analyzed_at REAL NOT NULL
+);
+"""
+
+
+def winning_chances(cp: int) -> float:
+    """Expected result of the side the score is for, on a -1..1 scale (lichess' model)."""
+    return 2 / (1 + math.exp(-0.00368208 * max(-CP_CAP, min(CP_CAP, cp)))) - 1
+
+
+def move_accuracy(win_before: float, win_after: float) -> float:
+    """Lichess' accuracy of a move, 0-100, from the mover's win percentage (0-100) before and after it."""
+    drop = max(0.0, win_before - win_after)
+    return max(0.0, min(100.0, 103.1668 * math.exp(-0.04354 * drop) - 3.1669))
+
+
+def classify(win_before: float, win_after: float) -> Optional[str]:
+    for name, threshold in THRESHOLDS:
+        if win_before - win_after >= threshold:
+            return name
+    return None
+
+
+def terminal_cp(board: chess.Board) -> Optional[int]:
+    """White-side score of a finished position (no search needed), None if the game goes on."""
+    if board.is_checkmate():
+        return -MATE_SCORE if board.turn == chess.WHITE else MATE_SCORE
+    if board.is_stalemate() or board.is_insufficient_material():
+        return 0
+    return None
+
+
+# One engine per analyzer process, kept open between batches.
+_engines: Dict[Tuple[str, int, int], "chess.engine.SimpleEngine"] = {}
+
+
+def close_engines():
+    while _engines:
+        _engines.popitem()[1].quit()
+
+
+def _get_engine(stockfish_path: str, threads: int, hash_mb: int):
+    import chess.engine
+
+    key = (stockfish_path, threads, hash_mb)
+    if key not in _engines:
+        if not _engines:
+            # SimpleEngine runs a non-daemon thread: quit the engines before the worker process
+            # joins its threads on exit, or the pool never shuts down.
+            from multiprocessing import util
+            util.Finalize(None, close_engines, exitpriority=10)
+        engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+        engine.configure({"Threads": threads, "Hash": hash_mb})
+        _engines[key] = engine
+    return _engines[key]
+
+
+def evaluate_positions(stockfish_path: str, epds: List[str], depth: int, threads: int = 1,
+                       hash_mb: int = 16) -> List[Tuple[str, int, Optional[str]]]:
+    """(epd, white-side centipawns, best move) of every position, searched at full strength to `depth`."""
+    import chess.engine
+
+    engine = _get_engine(stockfish_path, threads, hash_mb)
+    results = []
+    for epd in epds:
+        board = chess.Board()
+        board.set_epd(epd)
+        info = engine.analyse(board, chess.engine.Limit(depth=depth))
+        pv = info.get("pv") or [None]
+        results.append((epd, info["score"].white().score(mate_score=MATE_SCORE),
+                        pv[0].uci() if pv[0] is not None else None))
+    return results
+
+
+def analyze_moves(row: dict, evals: Dict[str, Tuple[int, Optional[str]]]) -> List[dict]:
+    """Per-ply metrics of one stored game, from the evaluations of all its positions."""
+    llm_color = chess.WHITE if row["LLM_color"] == "White" else chess.BLACK
+    moves = []
+    before = _position_cp(row["Game_record"].board_at(0), evals)
+    for ply, board_after in enumerate(_iter_after(row["Game_record"])):
+        after = _position_cp(board_after, evals)
+        mover = not board_after.turn
+        sign = 1 if mover == chess.WHITE else -1
+        win_before, win_after = winning_chances(sign * before[0]), winning_chances(sign * after[0])
+        cp_before = max(-CP_CAP, min(CP_CAP, sign * before[0]))
+        cp_after = max(-CP_CAP, min(CP_CAP, sign * after[0]))
+        moves.append({"ply": ply, "mover": "llm" if mover == llm_color else "stockfish",
+                      "move": board_after.peek().uci(), "best_move": before[1],
+                      "eval_before": before[0], "eval_after": after[0],
+                      "cp_loss": max(0, cp_before - cp_after), "classification": classify(win_before, win_after),
+                      "accuracy": move_accuracy(50 + 50 * win_before, 50 + 50 * win_after)})
+        before = after
+    return moves
+
+
+def _iter_after(record) -> Iterator[chess.Board]:
+    boards = record.iter_boards()
+    next(boards)
+    return boards
+
+
+def _position_cp(board: chess.Board, evals: Dict[str, Tuple[int, Optional[str]]]) -> Tuple[int, Optional[str]]:
+    cp = terminal_cp(board)
+    return (cp, None) if cp is not None else evals[board.epd()]
+
+
+def summarize_moves(moves: List[dict]) -> dict:
+    llm = [move for move in moves if move["mover"] == "llm"]
+    summary = {"plies": len(moves), "llm_moves": len(llm),
+               "acpl": sum(move["cp_loss"] for move in llm) / len(llm) if llm else None,
+               "accuracy": sum(move["accuracy"] for move in llm) / len(llm) if llm else None}
+    for name, key in (("blunder", "blunders"), ("mistake", "mistakes"), ("inaccuracy", "inaccuracies")):
+        summary[key] = sum(move["classification"] == name for move in llm)
+    return summary
+
+
+class AnalysisStore:
+    """Engine analysis kept next to the games, in the experiment store's SQLite file.
+
+    `positions` caches one evaluation per position (EPD, so transpositions and openings shared by
+    many games are searched once), `move_analysis` holds the per-ply metrics and `game_analysis`
+    the per-game summary that marks a game as analyzed at a given depth.
+    """
+
+    def __init__(self, path: str = "ChessGameExperiment.sqlite"):
+        from experiment_store import ExperimentStore
+
+        # Opening the experiment store first creates (or migrates) the games table.
+        self.games = ExperimentStore(path)
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def pending_games(self, depth: int, **filters) -> Iterator[dict]:
+        """Stored games without an analysis at `depth` or deeper."""
+        analyzed = {game_id for (game_id,) in
+                    self._db.execute("SELECT game_id FROM game_analysis WHERE depth >= ?", (depth,))}
+        for row in self.games.iter_games(**filters):
+            if row["id"] not in analyzed:
+                yield row
+
+    def known_positions(self, epds: List[str], depth: int) -> Dict[str, Tuple[int, Optional[str]]]:
+        known = {}
+        for start in range(0, len(epds), 500):
+            chunk = epds[start:start + 500]
+            cursor = self._db.execute(f"SELECT epd, cp, best_move FROM positions WHERE depth >= ? AND epd IN "
+                                      f"({', '.join('?' * len(chunk))})", (depth, *chunk))
+            known.update((epd, (cp, best_move)) for epd, cp, best_move in cursor)
+        return known
+
+    def put_positions(self, results: List[Tuple[str, int, Optional[str]]], depth: int):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?)",
+                                 [(epd, depth, cp, best_move) for epd, cp, best_move in results])
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def put_game(self, game_id: int, depth: int, moves: List[dict]):
+        summary = summarize_moves(moves)
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute("DELETE FROM move_analysis WHERE game_id = ?", (game_id,))
+            self._db.executemany(
+                "INSERT INTO move_analysis VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(game_id, move["ply"], move["mover"], move["move"], move["best_move"], move["eval_before"],
+                  move["eval_after"], move["cp_loss"], move["classification"], move["accuracy"]) for move in moves])
+            self._db.execute("INSERT OR REPLACE INTO game_analysis VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (game_id, depth, summary["plies"], summary["llm_moves"], summary["acpl"],
+                              summary["accuracy"], summary["blunders"], summary["mistakes"],
+                              summary["inaccuracies"], time.time()))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def moves(self, game_id: int) -> List[dict]:
+        cursor = self._db.execute("SELECT * FROM move_analysis WHERE game_id = ? ORDER BY ply", (game_id,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def quality_by_config(self) -> List[dict]:
+        """LLM move quality per (model, temperature, Stockfish Elo) over the analyzed games."""
+        cursor = self._db.execute(
+            """SELECT g.model_name, g.llm_temp, g.stockfish_elo, COUNT(*), SUM(a.llm_moves),
+                      SUM(a.acpl * a.llm_moves) / SUM(a.llm_moves), SUM(a.accuracy * a.llm_moves) / SUM(a.llm_moves),
+                      SUM(a.blunders), SUM(a.mistakes), SUM(a.inaccuracies)
+               FROM game_analysis a JOIN games g ON g.id = a.game_id
+               GROUP BY g.model_name, g.llm_temp, g.stockfish_elo
+               ORDER BY g.model_name, g.llm_temp, g.stockfish_elo""")
+        return [{"model_name": model_name, "llm_temp": temp, "stockfish_elo": elo, "games": games,
+                 "llm_moves": moves or 0, "acpl": acpl, "accuracy": accuracy, "blunders": blunders,
+                 "mistakes": mistakes, "inaccuracies": inaccuracies}
+                for model_name, temp, elo, games, moves, acpl, accuracy, blunders, mistakes, inaccuracies in cursor]
+
+    def close(self):
+        self._db.close()
+        self.games.close()
+
+
+def analyze_store(store_path: str, stockfish_path: str, depth: int = 12, workers: int = 4,
+                  batch_games: int = 64, chunk_positions: int = 32, threads: int = 1, hash_mb: int = 16,
+                  **filters) -> dict:
+    """Analyze every stored game not yet analyzed at `depth`, `batch_games` games at a time.
+
+    Each batch collects the positions of its games, skips those already evaluated (in this or an
+    earlier run), spreads the rest over `workers` analyzer processes and then writes the games.
+    An interrupted run loses at most one batch of games; evaluated positions are kept.
+    """
+    analysis = AnalysisStore(store_path)
+    stats = {"games": 0, "positions": 0, "evaluated": 0, "cached": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    games = analysis.pending_games(depth, **filters)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = [row for _, row in zip(range(batch_games), games)]
+            if not batch:
+                break
+            epds = list(dict.fromkeys(board.epd() for row in batch for board in row["Game_record"].iter_boards()
+                                      if terminal_cp(board) is None))
+            evals = analysis.known_positions(epds, depth)
+            missing = [epd for epd in epds if epd not in evals]
+            futures = [pool.submit(evaluate_positions, stockfish_path, missing[i:i + chunk_positions], depth,
+                                   threads, hash_mb)
+                       for i in range(0, len(missing), chunk_positions)]
+            for future in as_completed(futures):
+                results = future.result()
+                analysis.put_positions(results, depth)
+                evals.update((epd, (cp, best_move)) for epd, cp, best_move in results)
+            for row in batch:
+                analysis.put_game(row["id"], depth, analyze_moves(row, evals))
+            stats["games"] += len(batch)
+            stats["positions"] += len(epds)
+            stats["evaluated"] += len(missing)
+            stats["cached"] += len(epds) - len(missing)
+            emit(logger, logging.INFO, "analysis_batch", games=stats["games"], evaluated=len(missing),
+                 cached=len(epds) - len(missing))
+    stats["seconds"] = time.perf_counter() - start
+    analysis.close()
+    return stats
+
+
+def format_quality(rows: List[dict]) -> str:
+    lines = [f"{'model':<24} {'temp':>5} {'sf elo':>7} {'games':>6} {'moves':>6} {'acpl':>6} {'acc%':>6} "
+             f"{'blund':>6} {'mist':>5} {'inacc':>6}"]
+    for row in rows:
+        temp = f"{row['llm_temp']:.2f}" if row["llm_temp"] is not None else "-"
+        acpl = f"{row['acpl']:.0f}" if row["acpl"] is not None else "-"
+        accuracy = f"{row['accuracy']:.1f}" if row["accuracy"] is not None else "-"
+        lines.append(f"{row['model_name'] or '-':<24} {temp:>5} {row['stockfish_elo'] or '-':>7} {row['games']:>6} "
+                     f"{row['llm_moves']:>6} {acpl:>6} {accuracy:>6} {row['blunders']:>6} {row['mistakes']:>5} "
+                     f"{row['inaccuracies']:>6}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Engine analysis of stored games: centipawn loss, blunders, accuracy.")
+    parser.add_argument("--store", default="ChessGameExperiment.sqlite")
+    parser.add_argument("--stockfish-path", required=True)
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=4, help="Analyzer processes, one engine each.")
+    parser.add_argument("--threads", type=int, default=1, help="Threads of every analyzer engine.")
+    parser.add_argument("--hash", type=int, default=16)
+    parser.add_argument("--batch-games", type=int, default=64)
+    parser.add_argument("--model", default=None, help="Only analyze games of this model.")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args(argv)
+    configure_logging(getattr(logging, args.log_level))
+
+    stats = analyze_store(args.store, args.stockfish_path, depth=args.depth, workers=args.workers,
+                          batch_games=args.batch_games, threads=args.threads, hash_mb=args.hash,
+                          model_name=args.model)
+    print(f"> {stats['games']} games analyzed in {stats['seconds']:.1f}s: {stats['positions']} positions,"
+          f" {stats['evaluated']} searched, {stats['cached']} already evaluated")
+    analysis = AnalysisStore(args.store)
+    print(format_quality(analysis.quality_by_config()))
+    analysis.close()
+
+
+if __name__ == "__main__":
+    main()
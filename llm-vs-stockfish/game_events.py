@@ -0,0 +1,38 @@
+# %%
+import json
+import logging
+from typing import Optional
+
+ROOT_LOGGER = "llm_vs_stockfish"
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def emit(logger: logging.Logger, level: int, event: str, **fields):
+    """Log a structured event: the message reads `event key=value ...` and the record keeps the raw fields."""
+    if not logger.isEnabledFor(level):
+        return
+    message = " ".join([event] + [f"{key}={value}" for key, value in fields.items()])
+    logger.log(level, message, extra={"event": event, "fields": fields})
+
+
+class JsonEventFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {"time": record.created, "level": record.levelname, "logger": record.name,
+                   "event": getattr(record, "event", record.getMessage())}
+        payload.update(getattr(record, "fields", {}))
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level: int = logging.INFO, json_lines: bool = False, stream=None) -> Optional[logging.Handler]:
+    """Send game events to stderr (or `stream`), as plain text or one JSON object per line."""
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonEventFormatter() if json_lines else logging.Formatter("%(name)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
+    return handler
@@ -0,0 +1,143 @@
+# %%
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import chess
+
+START_FEN = chess.STARTING_FEN
+CHECKPOINT_INTERVAL = 16
+
+# 6 bits from-square, 6 bits to-square, 3 bits promotion piece: every move fits in one uint16.
+_PROMOTION_CODES = {None: 0, chess.KNIGHT: 1, chess.BISHOP: 2, chess.ROOK: 3, chess.QUEEN: 4}
+_PROMOTION_PIECES = {code: piece for piece, code in _PROMOTION_CODES.items()}
+
+
+def pack_move(move: chess.Move) -> int:
+    return move.from_square | (move.to_square << 6) | (_PROMOTION_CODES[move.promotion] << 12)
+
+
+def unpack_move(code: int) -> chess.Move:
+    return chess.Move(code & 0x3F, (code >> 6) & 0x3F, _PROMOTION_PIECES[(code >> 12) & 0x7])
+
+
+class GameRecord:
+    """A game stored as its start FEN plus two bytes per move.
+
+    Positions are rebuilt on demand: `iter_fens`/`iter_boards` replay the moves lazily, and `board_at`
+    jumps to any ply from the closest checkpoint (a FEN remembered every CHECKPOINT_INTERVAL plies).
+    Boards rebuilt from a checkpoint carry no move stack, so repetition claims are not tracked.
+    """
+
+    def __init__(self, start_fen: str = START_FEN, moves: Optional[array] = None):
+        self.start_fen = start_fen
+        self.moves = moves if moves is not None else array("H")
+        self._checkpoints: Dict[int, str] = {0: start_fen}
+
+    @classmethod
+    def from_moves(cls, moves: Iterable, start_fen: str = START_FEN) -> "GameRecord":
+        record = cls(start_fen)
+        for move in moves:
+            record.append(chess.Move.from_uci(move) if isinstance(move, str) else move)
+        return record
+
+    @classmethod
+    def from_board(cls, board: chess.Board) -> "GameRecord":
+        return cls.from_moves(board.move_stack, start_fen=board.root().fen())
+
+    @classmethod
+    def from_fens(cls, fens: List[str]) -> "GameRecord":
+        """Rebuild the moves of a legacy FEN-per-ply history (repeated entries are skipped)."""
+        if not fens:
+            return cls()
+        board = chess.Board(fens[0])
+        record = cls(board.fen())
+        for fen in fens[1:]:
+            if fen == board.fen():
+                continue
+            target = chess.Board(fen)
+            for move in board.legal_moves:
+                board.push(move)
+                if board.board_fen() == target.board_fen() and board.turn == target.turn:
+                    break
+                board.pop()
+            else:
+                raise ValueError(f"No legal move leads from {board.fen()} to {fen}")
+            record.append(board.peek())
+        return record
+
+    @classmethod
+    def from_bytes(cls, data: bytes, start_fen: str = START_FEN) -> "GameRecord":
+        """Inverse of `to_bytes`."""
+        moves = array("H")
+        moves.frombytes(data)
+        if sys.byteorder != "little":
+            moves.byteswap()
+        return cls(start_fen, moves)
+
+    def to_bytes(self) -> bytes:
+        """The packed moves as little-endian uint16s, whatever the host's byte order."""
+        if sys.byteorder == "little":
+            return self.moves.tobytes()
+        moves = array("H", self.moves)
+        moves.byteswap()
+        return moves.tobytes()
+
+    def append(self, move: chess.Move):
+        self.moves.append(pack_move(move))
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, GameRecord) and self.start_fen == other.start_fen and self.moves == other.moves
+
+    def __repr__(self) -> str:
+        return f"GameRecord({len(self)} plies from {self.start_fen!r})"
+
+    def __getstate__(self):
+        return {"start_fen": self.start_fen, "moves": self.to_bytes()}
+
+    def __setstate__(self, state):
+        self.__init__(state["start_fen"], GameRecord.from_bytes(state["moves"]).moves)
+
+    def move_at(self, ply: int) -> chess.Move:
+        """The move played at ply `ply` (0-based)."""
+        return unpack_move(self.moves[ply])
+
+    def ucis(self) -> List[str]:
+        return [unpack_move(code).uci() for code in self.moves]
+
+    def iter_boards(self, start: int = 0) -> Iterator[chess.Board]:
+        """Yield the position before the first move, then after every move, from ply `start` on.
+
+        The same board object is advanced in place; copy it if you keep it.
+        """
+        board = self.board_at(start)
+        yield board
+        for ply in range(start, len(self.moves)):
+            board.push(unpack_move(self.moves[ply]))
+            if (ply + 1) % CHECKPOINT_INTERVAL == 0:
+                self._checkpoints.setdefault(ply + 1, board.fen())
+            yield board
+
+    def iter_fens(self, start: int = 0) -> Iterator[str]:
+        for board in self.iter_boards(start):
+            yield board.fen()
+
+    def board_at(self, ply: int) -> chess.Board:
+        """Position after `ply` moves, replayed from the nearest checkpoint."""
+        if ply < 0:
+            ply += len(self.moves) + 1
+        if not 0 <= ply <= len(self.moves):
+            raise IndexError(f"ply {ply} out of range for a game of {len(self.moves)} plies")
+        base = max(p for p in self._checkpoints if p <= ply)
+        board = chess.Board(self._checkpoints[base])
+        for index in range(base, ply):
+            board.push(unpack_move(self.moves[index]))
+            if (index + 1) % CHECKPOINT_INTERVAL == 0:
+                self._checkpoints.setdefault(index + 1, board.fen())
+        return board
+
+    def fen_at(self, ply: int) -> str:
+        return self.board_at(ply).fen()
@@ -0,0 +1,170 @@
+# %%
+import json
+import time
+from typing import Dict, Iterable, List, Optional
+
+PROMETHEUS_PREFIX = "llm_vs_stockfish"
+
+# Ollama reports durations in nanoseconds.
+_OLLAMA_METADATA = {"prompt_eval_count": ("prompt_tokens", 1),
+                    "prompt_eval_duration": ("prompt_eval_seconds", 1e-9),
+                    "eval_count": ("eval_tokens", 1),
+                    "eval_duration": ("eval_seconds", 1e-9),
+                    "load_duration": ("load_seconds", 1e-9)}
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "attrs", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> dict:
+        self.start = time.perf_counter()
+        return self.attrs
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(self.name, time.perf_counter() - self.start, **self.attrs)
+        return False
+
+
+class Tracer:
+    """Collects timing spans for one game: `with tracer.span("stockfish_search"): ...`.
+
+    Spans carry the current ply and any attributes added to the dict the context manager returns
+    (token counts from Ollama's metadata, attempt numbers...).
+    """
+
+    enabled = True
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.ply = 0
+        self.spans: List[dict] = []
+
+    def span(self, name: str, **attrs) -> _Span:
+        return _Span(self, name, attrs)
+
+    def record(self, name: str, seconds: float, **attrs):
+        self.spans.append({"name": name, "ply": self.ply, "seconds": seconds, **attrs})
+
+    def summary(self) -> Dict[str, dict]:
+        return aggregate(self.spans)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> dict:
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullTracer:
+    """Tracing switched off: spans are a shared no-op object and nothing is recorded."""
+
+    enabled = False
+    labels: dict = {}
+    ply = 0
+    spans: List[dict] = []
+    _span = _NullSpan()
+
+    def span(self, name: str, **attrs) -> _NullSpan:
+        return self._span
+
+    def record(self, name: str, seconds: float, **attrs):
+        pass
+
+    def summary(self) -> Dict[str, dict]:
+        return {}
+
+
+NULL_TRACER = NullTracer()
+
+
+def add_ollama_metadata(attrs: dict, result):
+    """Copy Ollama's token counts and durations from a LangChain response onto a span."""
+    metadata = getattr(result, "response_metadata", None) or {}
+    for key, (name, scale) in _OLLAMA_METADATA.items():
+        if key in metadata:
+            attrs[name] = metadata[key] * scale
+
+
+def aggregate(spans: Iterable[dict]) -> Dict[str, dict]:
+    """Per span name: count, total and max seconds, plus the sum of every numeric attribute."""
+    summary: Dict[str, dict] = {}
+    for span in spans:
+        stats = summary.setdefault(span["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+        stats["count"] += 1
+        stats["seconds"] += span["seconds"]
+        stats["max_seconds"] = max(stats["max_seconds"], span["seconds"])
+        for key, value in span.items():
+            if key not in ("name", "ply", "seconds") and isinstance(value, (int, float)) and not isinstance(value, bool):
+                stats[key] = stats.get(key, 0) + value
+    return summary
+
+
+def merge(summaries: Iterable[Dict[str, dict]]) -> Dict[str, dict]:
+    merged: Dict[str, dict] = {}
+    for summary in summaries:
+        for name, stats in summary.items():
+            totals = merged.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            for key, value in stats.items():
+                totals[key] = max(totals[key], value) if key == "max_seconds" else totals.get(key, 0) + value
+    return merged
+
+
+def token_rates(summary: Dict[str, dict]) -> Dict[str, Optional[float]]:
+    inference = summary.get("llm_inference", {})
+    prompt_seconds, eval_seconds = inference.get("prompt_eval_seconds"), inference.get("eval_seconds")
+    return {"prompt_tokens_per_second": inference.get("prompt_tokens", 0) / prompt_seconds if prompt_seconds else None,
+            "eval_tokens_per_second": inference.get("eval_tokens", 0) / eval_seconds if eval_seconds else None}
+
+
+def format_summary(summary: Dict[str, dict]) -> str:
+    lines = []
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["seconds"]):
+        lines.append(f"{name:<20} {stats['count']:>7} spans {stats['seconds']:>10.3f}s total"
+                     f" {stats['seconds'] / stats['count']:>9.4f}s mean {stats['max_seconds']:>9.4f}s max")
+    rates = token_rates(summary)
+    if rates["prompt_tokens_per_second"] is not None:
+        lines.append(f"prompt eval {rates['prompt_tokens_per_second']:.1f} tokens/s")
+    if rates["eval_tokens_per_second"] is not None:
+        lines.append(f"generation {rates['eval_tokens_per_second']:.1f} tokens/s")
+    return "\n".join(lines)
+
+
+def write_jsonl(spans: Iterable[dict], path: str, **labels):
+    with open(path, "a") as f:
+        for span in spans:
+            f.write(json.dumps({**labels, **span}, default=str) + "\n")
+
+
+def _label_text(labels: dict) -> str:
+    escaped = {key: str(value).replace("\\", "\\\\").replace('"', '\\"') for key, value in labels.items()}
+    return ",".join(f'{key}="{value}"' for key, value in escaped.items())
+
+
+def to_prometheus(summary: Dict[str, dict], **labels) -> str:
+    """Prometheus text exposition of an aggregated summary (counters per span name)."""
+    metrics = {"span_count_total": ("counter", "count"),
+               "span_seconds_total": ("counter", "seconds"),
+               "span_seconds_max": ("gauge", "max_seconds")}
+    lines = []
+    for metric, (kind, key) in metrics.items():
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} {kind}")
+        for name, stats in sorted(summary.items()):
+            lines.append(f"{PROMETHEUS_PREFIX}_{metric}{{{_label_text({**labels, 'span': name})}}} {stats[key]}")
+    extra = sorted({key for stats in summary.values() for key in stats} - {"count", "seconds", "max_seconds"})
+    for key in extra:
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{key}_total counter")
+        for name, stats in sorted(summary.items()):
+            if key in stats:
+                lines.append(f"{PROMETHEUS_PREFIX}_{key}_total{{{_label_text({**labels, 'span': name})}}} {stats[key]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,370 @@
+# %%
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import List, NamedTuple, Optional
+
+from game_events import configure_logging, emit, get_logger
+from game_record import GameRecord
+
+logger = get_logger("queue")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT UNIQUE NOT NULL,
+    spec TEXT NOT NULL,
+    game_index INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    resumes INTEGER NOT NULL DEFAULT 0,
+    start_fen TEXT,
+    moves BLOB,
+    plies INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    submitted_at REAL NOT NULL,
+    finished_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, lease_expires);
+
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    plies INTEGER NOT NULL DEFAULT 0,
+    resumed INTEGER NOT NULL DEFAULT 0,
+    expired INTEGER NOT NULL DEFAULT 0,
+    busy_seconds REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+STATUSES = ("queued", "leased", "done", "failed")
+WORKER_COUNTERS = ("leases", "completed", "failed", "plies", "resumed", "expired", "busy_seconds")
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Job(NamedTuple):
+    shard: int
+    id: int
+    uid: str
+    spec: str
+    game_index: int
+    attempts: int
+    record: Optional[GameRecord]
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker took it over; this worker must drop the game."""
+
+
+class _Shard:
+    """One SQLite file of the queue. Every state change is a short BEGIN IMMEDIATE transaction."""
+
+    def __init__(self, path: str, wal: bool):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        # WAL needs shared memory, which network filesystems don't provide; the rollback journal is
+        # the safe default when hosts share the queue directory.
+        self._db.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        self._db.executescript(SCHEMA)
+
+    def transaction(self):
+        return _Transaction(self._db)
+
+    def execute(self, sql: str, params=()):
+        return self._db.execute(sql, params)
+
+    def touch_worker(self, worker: str, now: float, **counters):
+        self._db.execute("INSERT OR IGNORE INTO workers (worker, started_at, heartbeat_at) VALUES (?, ?, ?)",
+                         (worker, now, now))
+        updates = "".join(f", {name} = {name} + ?" for name in counters)
+        self._db.execute(f"UPDATE workers SET heartbeat_at = ?{updates} WHERE worker = ?",
+                         (now, *counters.values(), worker))
+
+    def close(self):
+        self._db.close()
+
+
+class _Transaction:
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._db.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        return False
+
+
+class JobQueue:
+    """Crash-safe queue of games shared by worker processes, on one host or several sharing a directory.
+
+    Jobs are single games (a GameSpec JSON and a game index) spread over `shards` SQLite files so
+    that per-ply checkpoints from many workers don't all contend for one lock. A worker leases a job
+    for `lease_seconds`, starting with its home shard and stealing from the others when it is empty.
+    Every checkpoint saves the game so far and renews the lease. A job whose lease expires (its
+    worker was killed, OOMed or stalled) is leased again and resumed from its last checkpoint; after
+    `max_attempts` leases it is marked failed. Lease expiry compares wall clocks, so hosts need
+    synchronised time.
+    """
+
+    def __init__(self, directory: str, shards: int = 4, lease_seconds: float = 600.0, max_attempts: int = 3,
+                 wal: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # A queue keeps the shard count it was created with.
+        existing = sorted(name for name in os.listdir(directory) if name.startswith("shard-") and name.endswith(".sqlite"))
+        count = len(existing) or shards
+        self.shards = [_Shard(os.path.join(directory, f"shard-{i}.sqlite"), wal) for i in range(count)]
+
+    def _home(self, worker: str) -> int:
+        return sum(worker.encode()) % len(self.shards)
+
+    def submit(self, spec_json: str, num_games: int) -> int:
+        """Queue `num_games` games of one spec, spread round-robin over the shards."""
+        now = time.time()
+        offset = min(range(len(self.shards)), key=lambda i: self._count(i, "queued"))
+        for game_index in range(num_games):
+            shard = self.shards[(offset + game_index) % len(self.shards)]
+            with shard.transaction():
+                shard.execute("INSERT INTO jobs (uid, spec, game_index, submitted_at) VALUES (?, ?, ?, ?)",
+                              (uuid.uuid4().hex, spec_json, game_index, now))
+        emit(logger, logging.INFO, "jobs_submitted", games=num_games, shards=len(self.shards))
+        return num_games
+
+    def _count(self, index: int, status: str) -> int:
+        return self.shards[index].execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def _lease_from(self, index: int, worker: str) -> Optional[Job]:
+        shard = self.shards[index]
+        while True:
+            now = time.time()
+            with shard.transaction():
+                row = shard.execute(
+                    """SELECT id, uid, spec, game_index, status, worker, attempts, start_fen, moves, plies FROM jobs
+                       WHERE status = 'queued' OR (status = 'leased' AND lease_expires < ?)
+                       ORDER BY id LIMIT 1""", (now,)).fetchone()
+                if row is None:
+                    return None
+                job_id, uid, spec, game_index, status, previous, attempts, start_fen, moves, plies = row
+                if status == "leased":
+                    shard.touch_worker(previous, now, expired=1)
+                    emit(logger, logging.WARNING, "lease_expired", job=uid, worker=previous, plies=plies)
+                if attempts >= self.max_attempts:
+                    shard.execute("UPDATE jobs SET status = 'failed', worker = NULL, finished_at = ?, "
+                                  "error = COALESCE(error, 'lease expired') WHERE id = ?", (now, job_id))
+                    continue
+                resumed = int(plies > 0)
+                shard.execute("""UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?,
+                                 attempts = attempts + 1, resumes = resumes + ? WHERE id = ?""",
+                              (worker, now + self.lease_seconds, resumed, job_id))
+                shard.touch_worker(worker, now, leases=1, resumed=resumed)
+            record = GameRecord.from_bytes(moves, start_fen) if plies else None
+            return Job(index, job_id, uid, spec, game_index, attempts + 1, record)
+
+    def lease(self, worker: str) -> Optional[Job]:
+        home = self._home(worker)
+        for offset in range(len(self.shards)):
+            job = self._lease_from((home + offset) % len(self.shards), worker)
+            if job is not None:
+                emit(logger, logging.INFO, "job_leased", job=job.uid, worker=worker, attempt=job.attempts,
+                     resumed_plies=len(job.record) if job.record is not None else 0)
+                return job
+        return None
+
+    def checkpoint(self, job: Job, worker: str, record: GameRecord) -> bool:
+        """Save the game so far and renew the lease; False when the lease now belongs to another worker."""
+        shard = self.shards[job.shard]
+        now = time.time()
+        with shard.transaction():
+            cursor = shard.execute("""UPDATE jobs SET start_fen = ?, moves = ?, plies = ?, lease_expires = ?
+                                      WHERE id = ? AND worker = ? AND status = 'leased'""",
+                                   (record.start_fen, record.to_bytes(), len(record), now + self.lease_seconds,
+                                    job.id, worker))
+            if cursor.rowcount:
+                shard.touch_worker(worker, now, plies=1)
+        return bool(cursor.rowcount)
+
+    def _finish(self, job: Job, worker: str, status: str, error: Optional[str], seconds: float, **counters) -> bool:
+        shard = self.shards[job.shard]
+        now = time.time()
+        with shard.transaction():
+            cursor = shard.execute("""UPDATE jobs SET status = ?, error = ?, finished_at = ?, worker = NULL
+                                      WHERE id = ? AND worker = ? AND status = 'leased'""",
+                                   (status, error, now if status != "queued" else None, job.id, worker))
+            if cursor.rowcount:
+                shard.touch_worker(worker, now, busy_seconds=seconds, **counters)
+        return bool(cursor.rowcount)
+
+    def complete(self, job: Job, worker: str, seconds: float = 0.0) -> bool:
+        return self._finish(job, worker, "done", None, seconds, completed=1)
+
+    def fail(self, job: Job, worker: str, error: str, seconds: float = 0.0) -> bool:
+        """Requeue the job (it resumes from its checkpoint) until it has used `max_attempts` leases."""
+        status = "failed" if job.attempts >= self.max_attempts else "queued"
+        return self._finish(job, worker, status, error, seconds, failed=1)
+
+    def outstanding(self) -> int:
+        """Jobs not finished yet, leased ones included."""
+        return sum(self._count(i, "queued") + self._count(i, "leased") for i in range(len(self.shards)))
+
+    def job_counts(self) -> dict:
+        counts = {status: 0 for status in STATUSES}
+        for shard in self.shards:
+            for status, count in shard.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+                counts[status] += count
+        return counts
+
+    def worker_stats(self) -> List[dict]:
+        """Per-worker counters summed over the shards, with games/hour over the worker's lifetime."""
+        workers = {}
+        for shard in self.shards:
+            for row in shard.execute(f"SELECT worker, started_at, heartbeat_at, {', '.join(WORKER_COUNTERS)} FROM workers"):
+                worker, started_at, heartbeat_at, *counters = row
+                stats = workers.setdefault(worker, {"worker": worker, "started_at": started_at, "heartbeat_at": heartbeat_at,
+                                                    **{name: 0 for name in WORKER_COUNTERS}})
+                stats["started_at"] = min(stats["started_at"], started_at)
+                stats["heartbeat_at"] = max(stats["heartbeat_at"], heartbeat_at)
+                for name, value in zip(WORKER_COUNTERS, counters):
+                    stats[name] += value
+        for stats in workers.values():
+            hours = (stats["heartbeat_at"] - stats["started_at"]) / 3600
+            stats["games_per_hour"] = stats["completed"] / hours if hours > 0 else 0.0
+        return sorted(workers.values(), key=lambda stats: stats["worker"])
+
+    def summary(self) -> str:
+        counts = self.job_counts()
+        lines = [", ".join(f"{count} {status}" for status, count in counts.items()) + f" in {len(self.shards)} shards",
+                 f"{'worker':<28} {'done':>5} {'failed':>6} {'plies':>6} {'games/h':>8} {'leases':>6} "
+                 f"{'resumed':>7} {'expired':>7} {'last seen':>10}"]
+        now = time.time()
+        for stats in self.worker_stats():
+            lines.append(f"{stats['worker']:<28} {stats['completed']:>5} {stats['failed']:>6} {stats['plies']:>6} "
+                         f"{stats['games_per_hour']:>8.1f} {stats['leases']:>6} {stats['resumed']:>7} "
+                         f"{stats['expired']:>7} {now - stats['heartbeat_at']:>9.0f}s")
+        return "\n".join(lines)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def run_worker(directory: str, store_path: str = "ChessGameExperiment.sqlite", worker: Optional[str] = None,
+               lease_seconds: float = 600.0, max_attempts: int = 3, max_jobs: Optional[int] = None,
+               poll_seconds: float = 5.0, exit_when_empty: bool = True) -> int:
+    """Lease and play games until the queue is drained (or `max_jobs` are played); returns games completed."""
+    from experiment_store import ExperimentStore
+    from tournament import GameSpec, play_single_game
+
+    queue = JobQueue(directory, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    store = ExperimentStore(store_path)
+    worker = worker or default_worker_id()
+    completed = played = 0
+    while max_jobs is None or played < max_jobs:
+        job = queue.lease(worker)
+        if job is None:
+            # Leased jobs may still expire and need resuming, so only an empty queue ends the worker.
+            if exit_when_empty and queue.outstanding() == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        def checkpoint(record: GameRecord, job=job):
+            if not queue.checkpoint(job, worker, record):
+                raise LeaseLost(f"job {job.uid} was taken over by another worker")
+
+        played += 1
+        result = play_single_game(GameSpec.model_validate_json(job.spec), job.game_index, resume=job.record,
+                                  checkpoint=checkpoint)
+        if result.error is not None:
+            queue.fail(job, worker, result.error, result.wall_time)
+            emit(logger, logging.WARNING, "job_failed", job=job.uid, worker=worker, error=result.error)
+            continue
+        # The uid makes the insert idempotent if a slow worker and its successor both finish the game.
+        store.record_game(result.row, source=f"job:{job.uid}")
+        if queue.complete(job, worker, result.wall_time):
+            completed += 1
+        emit(logger, logging.INFO, "job_done", job=job.uid, worker=worker, plies=len(result.row["Game_record"]),
+             seconds=result.wall_time)
+    queue.close()
+    store.close()
+    return completed
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Resumable game queue shared by workers on one or several hosts.")
+    parser.add_argument("--queue", default="game_queue", help="Queue directory (shared between hosts).")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue games of one configuration.")
+    submit.add_argument("--model", required=True)
+    submit.add_argument("--temperature", type=float, default=0.1)
+    submit.add_argument("--stockfish-path", required=True, help="Path of the binary on the worker hosts.")
+    submit.add_argument("--elo", type=int, default=1000)
+    submit.add_argument("--depth", type=int, default=15)
+    submit.add_argument("--games", type=int, default=1)
+    submit.add_argument("--moves", type=int, default=50)
+    submit.add_argument("--set", action="append", default=[], metavar="FIELD=VALUE",
+                        help="Any other GameSpec field, e.g. --set ollama_base_url=http://gpu1:11434")
+    submit.add_argument("--shards", type=int, default=4, help="Shard files of a new queue.")
+
+    work = commands.add_parser("work", help="Run worker processes until the queue is drained.")
+    work.add_argument("--processes", type=int, default=1)
+    work.add_argument("--store", default="ChessGameExperiment.sqlite")
+    work.add_argument("--lease", type=float, default=600.0, help="Seconds a job stays leased without a checkpoint.")
+    work.add_argument("--max-attempts", type=int, default=3)
+    work.add_argument("--max-jobs", type=int, default=None, help="Games per worker process before it exits.")
+    work.add_argument("--poll", type=float, default=5.0)
+    work.add_argument("--keep-running", action="store_true", help="Wait for new jobs instead of exiting when drained.")
+
+    commands.add_parser("status", help="Job counts and per-worker throughput and lease expiries.")
+    args = parser.parse_args(argv)
+    configure_logging(getattr(logging, args.log_level))
+
+    if args.command == "submit":
+        from tournament import GameSpec
+
+        fields = dict(item.split("=", 1) for item in args.set)
+        spec = GameSpec(model_name=args.model, temperature=args.temperature, stockfish_path=args.stockfish_path,
+                        stockfish_elo=args.elo, stockfish_depth=args.depth, num_games=1, num_moves=args.moves,
+                        **fields)
+        queue = JobQueue(args.queue, shards=args.shards)
+        print(f"> {queue.submit(spec.model_dump_json(), args.games)} games queued in {args.queue}")
+    elif args.command == "work":
+        kwargs = dict(store_path=args.store, lease_seconds=args.lease, max_attempts=args.max_attempts,
+                      max_jobs=args.max_jobs, poll_seconds=args.poll, exit_when_empty=not args.keep_running)
+        processes = [multiprocessing.Process(target=run_worker, args=(args.queue,), kwargs=kwargs)
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        queue = JobQueue(args.queue)
+    else:
+        queue = JobQueue(args.queue)
+    print(queue.summary())
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# %%
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class LLMMoveCache:
+    """Parsed LLM answers keyed by position: an in-memory LRU in front of a SQLite file.
+
+    Only deterministic decoding (temperature 0) should read from it, unless the player forces it.
+    `get` only finds an answer; it counts as a hit (and as tokens and seconds saved) once the caller
+    accepted it and called `confirm_hit`.
+    """
+
+    def __init__(self,
+                 path: str = "llm_move_cache.sqlite",
+                 max_memory_entries: int = 1024,
+                 max_disk_entries: int = 100_000,
+                 max_age_seconds: float = 30 * 24 * 3600,
+                 evict_every: int = 256):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+        # key -> (output, tokens, seconds, created)
+        self._memory: "OrderedDict[str, Tuple[str, int, float, float]]" = OrderedDict()
+        # key -> "memory" or "disk": answers returned by get() and not yet confirmed.
+        self._found: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS llm_moves (
+                                key TEXT PRIMARY KEY,
+                                output TEXT NOT NULL,
+                                tokens INTEGER NOT NULL,
+                                seconds REAL NOT NULL,
+                                created REAL NOT NULL,
+                                last_used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_moves_last_used ON llm_moves(last_used)")
+        self._db.commit()
+        self.stats = {"lookups": 0, "hits": 0, "memory_hits": 0, "disk_hits": 0,
+                      "stores": 0, "evicted": 0, "tokens_saved": 0, "seconds_saved": 0.0}
+        self.evict()
+
+    @staticmethod
+    def make_key(model_name: str, temperature: float, prompt: str, fen: str, legal_moves: Iterable[str]) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+        payload = json.dumps([model_name, temperature, prompt_hash, fen, sorted(legal_moves)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[3] > self.max_age_seconds:
+                del self._memory[key]
+                return None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._found[key] = "memory"
+            else:
+                row = self._db.execute("SELECT output, tokens, seconds, created FROM llm_moves WHERE key = ?",
+                                       (key,)).fetchone()
+                if row is None or now - row[3] > self.max_age_seconds:
+                    return None
+                entry = tuple(row)
+                self._db.execute("UPDATE llm_moves SET last_used = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self._remember(key, entry)
+                self._found[key] = "disk"
+            return entry[0]
+
+    def confirm_hit(self, key: str):
+        """The answer `get` returned for `key` was used instead of running the LLM."""
+        with self._lock:
+            tier = self._found.pop(key, None)
+            entry = self._memory.get(key)
+            if tier is None or entry is None:
+                return
+            self.stats["hits"] += 1
+            self.stats[f"{tier}_hits"] += 1
+            self.stats["tokens_saved"] += entry[1]
+            self.stats["seconds_saved"] += entry[2]
+
+    def put(self, key: str, output: str, tokens: int = 0, seconds: float = 0.0):
+        now = time.time()
+        with self._lock:
+            self._found.pop(key, None)
+            self._remember(key, (output, tokens, seconds, now))
+            self._db.execute("INSERT OR REPLACE INTO llm_moves VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, output, tokens, seconds, now, now))
+            self._db.commit()
+            self.stats["stores"] += 1
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def _remember(self, key: str, entry: Tuple[str, int, float, float]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def evict(self):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM llm_moves WHERE created < ?",
+                                      (time.time() - self.max_age_seconds,))
+            evicted = cursor.rowcount
+            cursor = self._db.execute("""DELETE FROM llm_moves WHERE key IN (
+                                             SELECT key FROM llm_moves ORDER BY last_used DESC
+                                             LIMIT -1 OFFSET ?)""", (self.max_disk_entries,))
+            evicted += cursor.rowcount
+            self._db.commit()
+            self.stats["evicted"] += evicted
+
+    @property
+    def hit_rate(self) -> float:
+        return self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, hit_rate=self.hit_rate)
+
+    def close(self):
+        self._db.close()
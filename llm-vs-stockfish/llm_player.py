@@ -1,13 +1,27 @@
-from langchain_ollama import ChatOllama
-from langchain_mistralai import ChatMistralAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 import re
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional, Tuple
+import asyncio
 import random
 import time
+import threading
 import os
+import logging
+from game_events import emit, get_logger
+from llm_streaming import BestMoveScanner, StreamStats
+import constrained_output
+import chess
+from move_normalizer import MoveNormalizer, new_repair_stats
+from prompt_compiler import PromptCompiler
+from instrumentation import NULL_TRACER, add_ollama_metadata
+from model_residency import new_load_stats, record_load
+
+if TYPE_CHECKING:
+    from langchain_ollama import ChatOllama
+
+logger = get_logger("llm")
 
 class ChessMove(BaseModel):
     move: str = Field(description="Coup d'échec au format case de départ case de fin.")
@@ -19,9 +33,13 @@ class ChessOutput(BaseModel):
     #move_evaluation: str = Field(description="Detailed evaluation of the chosen move, including its strategic impact and any anticipated responses from the opponent.")
     best_move: List[ChessMove] = Field(description="Coup à jouer au format uci")
 
+class InferenceCancelled(Exception):
+    """Raised inside a player whose cancel_event was set (e.g. a discarded speculative inference)."""
+
+
 class LLMPlayer:
     def __init__(self, color: str = "Black"):
-        self.llm: Optional[ChatOllama] = None
+        self.llm: Optional["ChatOllama"] = None
         self.model_name: Optional[str] = None
         self.current_chess_board: Optional[str] = None
         self.current_fen_board: Optional[str] = None
@@ -31,55 +49,349 @@ class LLMPlayer:
         self.move_number: int = 0
         self.history = []
         self.prompt_schema = self._create_chess_prompt()
-        self.parser = None
+        self.parser = PydanticOutputParser(pydantic_object=ChessOutput)
+        self.format_instructions = self.parser.get_format_instructions()
+        self.compiler: Optional[PromptCompiler] = None
+        self.move_stack: List[chess.Move] = []
+        self.prompt_stats = {"plies": 0, "measured": 0, "prompt_tokens": 0, "prompt_eval_seconds": 0.0}
+        self.load_stats = new_load_stats()
+        self.cancel_event: Optional[threading.Event] = None
+        self.tracer = NULL_TRACER
         self.temp = None
+        self.scheduler = None
+        self.game_id = None
+        self.cache = None
+        self.force_cache = False
+        self.stream_stats: Optional[StreamStats] = None
+        self.keep_explanation = False
+        self.measure_full_generation = False
+        self.constrained = False
+        self.retry_stats = {"moves": 0, "attempts": 0, "retries": 0, "random_fallbacks": 0, "constrained_moves": 0}
+        self.repair_stats = new_repair_stats()
+        self._normalizer: Optional[MoveNormalizer] = None
        
 
-    def init_llm_model(self, model_name: str, temperature: float):
+    def init_llm_model(self, model_name: str, temperature: float, base_url: Optional[str] = None,
+                       keep_alive: Optional[str] = None):
+        # Backends are imported when a model is set up, so processes that never play one skip them.
+        from langchain_ollama import ChatOllama
+
         self.model_name = model_name
         self.temp = temperature
-        self.llm = ChatOllama(model=self.model_name, temperature=temperature, format='json')
+        # base_url points the player at another Ollama server, e.g. ollama_replay's emulator.
+        # keep_alive (e.g. "30m") overrides how long Ollama keeps the model loaded after each answer.
+        self.llm = ChatOllama(model=self.model_name, temperature=temperature, format='json', base_url=base_url,
+                              keep_alive=keep_alive)
+        #from langchain_mistralai import ChatMistralAI
         #os.environ["MISTRAL_API_KEY"]="9m0UbfklcS177Zu642F5WVFONA0XeRN3"
         #self.llm = ChatMistralAI(model= self.model_name, temperature=self.temp).with_structured_output(method="json_mode", include_raw=True)
-        print(f"> New LLM model **{self.model_name}** enters competition as {self.color}")
+        emit(logger, logging.DEBUG, "llm_ready", model=self.model_name, color=self.color, temperature=temperature)
 
-    def get_llm_best_move(self) -> ChessOutput:
-        if self.llm is None:
-            raise ValueError("LLM model is not initialized. Call init_llm_model() first.")
+    def enable_cache(self, cache, force: bool = False):
+        # Cached answers are replayed only for deterministic decoding unless force=True.
+        self.cache = cache
+        self.force_cache = force
 
-        parser = PydanticOutputParser(pydantic_object=ChessOutput)
-        self.parser = parser
-        prompt = self._create_chess_prompt()
-        prompt = prompt.format(**self._get_prompt_variables())
-        #print(prompt)
+    def enable_recording(self, store):
+        # Every completed exchange is saved to a ReplayStore so OllamaEmulator can serve it later.
+        from ollama_replay import RecordingChatModel
+        self.llm = RecordingChatModel(self.llm, store)
+
+    def enable_streaming(self, stats: Optional[StreamStats] = None, keep_explanation: bool = False,
+                         measure_full_generation: bool = False):
+        # The answer is read while it streams and generation is cancelled once best_move is known.
+        # keep_explanation waits for best_move's explanation too; measure_full_generation reads the
+        # stream to its end (no saving) so the full-generation time can be compared.
+        self.stream_stats = stats if stats is not None else StreamStats()
+        self.keep_explanation = keep_explanation
+        self.measure_full_generation = measure_full_generation
+
+    def enable_prompt_compiler(self, token_budget: Optional[int] = None):
+        # Static-first prompt with an append-only history (see PromptCompiler); the board's move
+        # stack is read through self.move_stack, which the game manager points at its board.
+        self.compiler = PromptCompiler(self._get_static_prompt(), self._get_turn_prompt(), self.format_instructions,
+                                       token_budget=token_budget)
+        self.prompt_schema = self.compiler.template
+
+    def enable_constrained_output(self):
+        # Ollama decodes against a schema whose moves are an enum of the legal moves, so answers are
+        # legal by construction. Models or servers that refuse schemas fall back to the parser path.
+        self.constrained = True
+
+    def _invoke_kwargs(self) -> dict:
+        base_url = getattr(self.llm, "base_url", None)
+        if not self.constrained or not constrained_output.supports_schema(base_url, self.model_name):
+            return {}
+        return {"format": constrained_output.legal_move_schema(self.legal_moves.split())}
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise InferenceCancelled()
+
+    def _record_attempt(self, attempt: int, kwargs: dict):
+        if attempt == 0:
+            self.retry_stats["moves"] += 1
+            self.retry_stats["constrained_moves"] += int(bool(kwargs))
+        else:
+            self.retry_stats["retries"] += 1
+        self.retry_stats["attempts"] += 1
+
+    def _attempt_failed(self, attempt: int, kwargs: dict, error: Exception):
+        self.tracer.record("llm_retry", 0.0, error=type(error).__name__)
+        if kwargs and constrained_output.is_schema_rejection(error):
+            constrained_output.mark_unsupported(getattr(self.llm, "base_url", None), self.model_name)
+            emit(logger, logging.WARNING, "llm_schema_unsupported", model=self.model_name, error=str(error))
+        emit(logger, logging.WARNING, "llm_attempt_failed", model=self.model_name, attempt=attempt + 1,
+             constrained=bool(kwargs), error=str(error))
+
+    def _prepare_prompt(self):
+        with self.tracer.span("prompt_build"):
+            prompt = self._build_prompt()
+            cache_key = self._cache_key(prompt)
+        return prompt, cache_key
+
+    def _timed_invoke(self, prompt, kwargs):
+        # Non-streamed answers are parsed in the parse_validate span; streamed ones come parsed.
+        with self.tracer.span("llm_inference") as span:
+            if self.stream_stats is not None:
+                output, result = self._stream_llm_response(prompt, **kwargs)
+            else:
+                output, result = None, self.llm.invoke(prompt, **kwargs)
+            add_ollama_metadata(span, result)
+        return output, result
+
+    async def _atimed_invoke(self, prompt, kwargs):
+        with self.tracer.span("llm_inference") as span:
+            output, result = await self._ainvoke_llm(prompt, **kwargs)
+            add_ollama_metadata(span, result)
+        return output, result
+
+    def _validate(self, output, result) -> Tuple[str, ChessOutput]:
+        with self.tracer.span("parse_validate"):
+            if output is None:
+                output = self._parse_llm_response(result)
+            return self._accept_output(output), output
+
+    def get_llm_best_move(self) -> ChessOutput:
+        prompt, cache_key = self._prepare_prompt()
+        cached_move = self._lookup_cache(cache_key)
+        if cached_move is not None:
+            return cached_move
 
         max_attempts = 3
         for attempt in range(max_attempts):
+            self._check_cancelled()
+            kwargs = self._invoke_kwargs()
+            self._record_attempt(attempt, kwargs)
             try:
-                print(self.movement_history)
-                result = self.llm.invoke(prompt)
-                print(result)
-                result = result.content
-                print(">>>> Result\n",result)
-                result = parser.parse(result)
-                print(">>>> PARSER\n", result)
-                self._print_move_analysis(result)
-                self.history.append(result)
-                
-                if result.best_move[0].move.replace("-", "") not in self.legal_moves:
-                    raise ValueError(f"Selected move {result.best_move[0].move} is not in the legal moves list.")
+                start = time.perf_counter()
+                output, result = self._timed_invoke(prompt, kwargs)
+                move, output = self._validate(output, result)
+                self._record_prompt_eval(prompt, result)
+                self._store_cache(cache_key, output, result, time.perf_counter() - start)
+                return move
 
-                #self.movement_history.append(result.final_move)
-                return result.best_move[0].move.replace("-", "") 
+            except InferenceCancelled:
+                raise
+            except Exception as e:
+                self._attempt_failed(attempt, kwargs, e)
+                if attempt == max_attempts - 1:
+                    emit(logger, logging.WARNING, "llm_random_fallback", model=self.model_name)
+                    self.retry_stats["random_fallbacks"] += 1
+                    with self.tracer.span("llm_fallback_wait"):
+                        time.sleep(5)
+                    self.history.append("random")
+                    return self._select_random_move()
+
+    async def aget_llm_best_move(self) -> ChessOutput:
+        prompt, cache_key = self._prepare_prompt()
+        cached_move = self._lookup_cache(cache_key)
+        if cached_move is not None:
+            return cached_move
+
+        max_attempts = 3
+        for attempt in range(max_attempts):
+            self._check_cancelled()
+            kwargs = self._invoke_kwargs()
+            self._record_attempt(attempt, kwargs)
+            try:
+                start = time.perf_counter()
+                if self.scheduler is not None:
+                    async with self.scheduler.slot(self.model_name, self.game_id):
+                        self.tracer.record("llm_queue_wait", time.perf_counter() - start)
+                        start = time.perf_counter()
+                        output, result = await self._atimed_invoke(prompt, kwargs)
+                else:
+                    output, result = await self._atimed_invoke(prompt, kwargs)
+                move, output = self._validate(output, result)
+                self._record_prompt_eval(prompt, result)
+                self._store_cache(cache_key, output, result, time.perf_counter() - start)
+                return move
 
+            except InferenceCancelled:
+                raise
             except Exception as e:
-                print(f"Attempt {attempt + 1} failed: {str(e)}")
+                self._attempt_failed(attempt, kwargs, e)
                 if attempt == max_attempts - 1:
-                    print("Max attempts reached. Selecting a random legal move.")
-                    time.sleep(5)
+                    emit(logger, logging.WARNING, "llm_random_fallback", model=self.model_name)
+                    self.retry_stats["random_fallbacks"] += 1
+                    with self.tracer.span("llm_fallback_wait"):
+                        await asyncio.sleep(5)
                     self.history.append("random")
                     return self._select_random_move()
 
+    def _build_prompt(self):
+        if self.llm is None:
+            raise ValueError("LLM model is not initialized. Call init_llm_model() first.")
+
+        if self.compiler is not None:
+            variables = self._get_prompt_variables()
+            del variables["movement_history"], variables["format_instructions"]
+            return self.compiler.compile(self.move_stack, **variables)
+        prompt = self.prompt_schema.format(**self._get_prompt_variables())
+        #print(prompt)
+        return prompt
+
+    def _record_prompt_eval(self, prompt: str, result):
+        self.prompt_stats["plies"] += 1
+        metadata = getattr(result, "response_metadata", None) or {}
+        record_load(self.load_stats, metadata)
+        if "prompt_eval_count" not in metadata:
+            return
+        prompt_tokens = metadata["prompt_eval_count"]
+        seconds = metadata.get("prompt_eval_duration", 0) / 1e9
+        self.prompt_stats["measured"] += 1
+        self.prompt_stats["prompt_tokens"] += prompt_tokens
+        self.prompt_stats["prompt_eval_seconds"] += seconds
+        if self.compiler is not None:
+            self.compiler.calibrate(prompt, prompt_tokens)
+        emit(logger, logging.DEBUG, "llm_prompt_eval", model=self.model_name, ply=len(self.move_stack),
+             prompt_tokens=prompt_tokens, prompt_eval_seconds=seconds, prompt_chars=len(prompt))
+
+    async def _ainvoke_llm(self, prompt, **kwargs):
+        if self.stream_stats is not None:
+            return await self._astream_llm_response(prompt, **kwargs)
+        return None, await self.llm.ainvoke(prompt, **kwargs)
+
+    def _move_complete(self, scanner: BestMoveScanner) -> bool:
+        if scanner.best_move() is None:
+            return False
+        return not self.keep_explanation or scanner.explanation()[1]
+
+    def _stream_llm_response(self, prompt, **kwargs):
+        scanner = BestMoveScanner()
+        start = time.perf_counter()
+        time_to_move, chars_at_move, result = None, 0, None
+        stream = self.llm.stream(prompt, **kwargs)
+        try:
+            for chunk in stream:
+                self._check_cancelled()
+                result = chunk if result is None else result + chunk
+                scanner.feed(chunk.content)
+                if time_to_move is None and self._move_complete(scanner):
+                    time_to_move, chars_at_move = time.perf_counter() - start, len(scanner.text)
+                    if not self.measure_full_generation:
+                        break
+        finally:
+            # Closing the generator drops the HTTP stream, which makes Ollama stop generating.
+            stream.close()
+        return self._finish_stream(scanner, result, start, time_to_move, chars_at_move)
+
+    async def _astream_llm_response(self, prompt, **kwargs):
+        scanner = BestMoveScanner()
+        start = time.perf_counter()
+        time_to_move, chars_at_move, result = None, 0, None
+        stream = self.llm.astream(prompt, **kwargs)
+        try:
+            async for chunk in stream:
+                result = chunk if result is None else result + chunk
+                scanner.feed(chunk.content)
+                if time_to_move is None and self._move_complete(scanner):
+                    time_to_move, chars_at_move = time.perf_counter() - start, len(scanner.text)
+                    if not self.measure_full_generation:
+                        break
+        finally:
+            await stream.aclose()
+        return self._finish_stream(scanner, result, start, time_to_move, chars_at_move)
+
+    def _finish_stream(self, scanner: BestMoveScanner, result, start: float, time_to_move: Optional[float],
+                       chars_at_move: int):
+        early_stop = time_to_move is not None and not self.measure_full_generation
+        full_generation = None if early_stop else time.perf_counter() - start
+        self.stream_stats.record(self.model_name, time_to_move, full_generation, early_stop,
+                                 chars_at_move, len(scanner.text))
+        emit(logger, logging.DEBUG, "llm_stream", model=self.model_name, time_to_move=time_to_move,
+             full_generation=full_generation, early_stop=early_stop, content=scanner.text)
+        if scanner.best_move() is None:
+            raise ValueError("No best_move found in the streamed answer.")
+        if not early_stop:
+            try:
+                return self.parser.parse(scanner.text), result
+            except Exception:
+                pass
+        explanation, _ = scanner.explanation()
+        output = ChessOutput(candidate_moves=[ChessMove(move=move, explanation=text)
+                                              for move, text in scanner.candidates()],
+                             best_move=[ChessMove(move=scanner.best_move(), explanation=explanation)])
+        return output, result
+
+    def _parse_llm_response(self, result) -> ChessOutput:
+        emit(logger, logging.DEBUG, "llm_response", model=self.model_name, content=result.content)
+        return self.parser.parse(result.content)
+
+    def _move_normalizer(self) -> MoveNormalizer:
+        if self._normalizer is None or self._normalizer.board.fen() != self.current_fen_board:
+            self._normalizer = MoveNormalizer(chess.Board(self.current_fen_board))
+        return self._normalizer
+
+    def _accept_output(self, result: ChessOutput) -> str:
+        self._print_move_analysis(result)
+        self.history.append(result)
+
+        # Near-miss answers (SAN, "E7-E5", "O-O", "e7e8"...) are repaired instead of costing a new
+        # inference; if best_move can't be resolved the candidate moves are tried in order.
+        answers = [move.move for move in result.best_move[:1]] + [move.move for move in result.candidate_moves]
+        move, category = self._move_normalizer().resolve_any(answers)
+        if move is None:
+            raise ValueError(f"Selected move {answers[0] if answers else None} is not in the legal moves list.")
+        if category is not None:
+            self.repair_stats[category] += 1
+            emit(logger, logging.DEBUG, "llm_move_repaired", answer=answers[0] if answers else None, move=move,
+                 category=category)
+
+        #self.movement_history.append(result.final_move)
+        return move
+
+    def _cache_key(self, prompt: str) -> Optional[str]:
+        if self.cache is None or (self.temp != 0 and not self.force_cache):
+            return None
+        return self.cache.make_key(self.model_name, self.temp, prompt, self.current_fen_board, self.legal_moves.split())
+
+    def _lookup_cache(self, cache_key: Optional[str]) -> Optional[str]:
+        if cache_key is None:
+            return None
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None
+        try:
+            move = self._accept_output(ChessOutput.model_validate_json(cached))
+        except Exception as e:
+            emit(logger, logging.WARNING, "llm_cache_rejected", error=str(e))
+            return None
+        self.cache.confirm_hit(cache_key)
+        return move
+
+    def _store_cache(self, cache_key: Optional[str], output: ChessOutput, result, seconds: float):
+        if cache_key is None:
+            return
+        usage = getattr(result, "usage_metadata", None)
+        if usage:
+            tokens = usage.get("total_tokens", 0)
+        else:
+            metadata = getattr(result, "response_metadata", None) or {}
+            tokens = metadata.get("prompt_eval_count", 0) + metadata.get("eval_count", 0)
+        self.cache.put(cache_key, output.model_dump_json(), tokens, seconds)
+
     def _create_chess_prompt(self) -> ChatPromptTemplate:
         return ChatPromptTemplate.from_messages(
             [("system",
@@ -117,7 +429,18 @@ class LLMPlayer:
         2. An evaluation of your final chosen move, including its strategic impact and any anticipated responses from the opponent.
         3. Choose ONE best_move, in the format start square end square.
                 """
+    def _get_static_prompt(self) -> str:
+        return ("""Tu es un grand maitre d'echec et j'ai besoin d'un conseil pour mon coup à jouer, je joue les pieces noires.
+             """ + self._get_board_coordinates() + self._get_pgn_header())
+
+    def _get_turn_prompt(self) -> str:
+        return ("""{movement_history}
+        """ + self._get_board_viz_message() + """Voici une liste des coups que j'envisage de jouer [{legal_moves}]""")
+
     def _get_board_representation(self):
+        return self._get_board_coordinates() + self._get_board_viz_message()
+
+    def _get_board_coordinates(self):
         return """
         Pour te repèrer voici à les coordonnée d'un jeu d'échec.
           a b c d e f g h\n
@@ -129,7 +452,10 @@ class LLMPlayer:
         3 . . . . . . . .\n
         2 . . . . . . . .\n
         1 . . . . . . . .\n
-        """ + """
+        """
+
+    def _get_board_viz_message(self):
+        return """
         Le plateau de jeu ressemble actuellement à ça:
         \n{viz}\n
         Pour context, les lettres minuscule [k, q, b, n, r, p] représentent les noirs ; les lettres majuscules [K, Q, B, N, R, P] représentent les blancs. 
@@ -141,6 +467,10 @@ class LLMPlayer:
         # 
         # Sur la base de la séquence de mouvements ci-dessus, quel coup de la liste [{legal_moves}] est la meilleure option à jouer ?
 
+        return self._get_pgn_header() + """{movement_history}
+        """
+
+    def _get_pgn_header(self) -> str:
         return """
         \n{format_instructions}\n
         [Event "Chess Tournament"]
@@ -153,7 +483,6 @@ class LLMPlayer:
         [WhiteElo "2885"]
         [BlackElo "2812"]
 
-        {movement_history}
         """
 ## INPUT
 #Based on the current sequence of mouvement above, which move from this list [{legal_moves}] is the best option to play? **The objectif is to win the game by taking white king (K)**
@@ -174,22 +503,16 @@ class LLMPlayer:
             "legal_moves": self.legal_moves,
             "viz": self.current_chess_board,
             "movement_history": self.movement_history,
-            "format_instructions": self.parser.get_format_instructions(),
+            "format_instructions": self.format_instructions,
             "color": self.color
         }
 
     def _print_move_analysis(self, result: ChessOutput) -> None:
-        print(f"Move {self.move_number} analysis:")
-        #print(f"Position analysis: {result.position_analysis}")
-        #print("Candidate moves:")
-        #print(result.candidate_moves)
-        #for move in result.candidate_moves:
-        #    print(f"- {move.move}: {move.explanation}")
-        #print(f"Move evaluation: {result.move_evaluation}")
-        print(f"Final move: {result.best_move}")
+        emit(logger, logging.DEBUG, "llm_move_analysis", move_number=self.move_number,
+             candidates=[move.move for move in result.candidate_moves], best_move=result.best_move)
 
     def _select_random_move(self) -> ChessOutput:
-        random_move = random.choice(self.legal_moves)
+        random_move = random.choice(self.legal_moves.split())
         self.movement_history = random_move
         return random_move
     
@@ -0,0 +1,117 @@
+# %%
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Hashable, Optional, Union
+
+
+class _ModelQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        # game id -> that game's waiting requests; games are served round-robin.
+        self.waiters: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self.requests = 0
+        self.queued = 0
+        self.queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.inference = 0.0
+        self.max_inference = 0.0
+
+    def waiting(self) -> int:
+        return sum(len(futures) for futures in self.waiters.values())
+
+    def grant_next(self):
+        while self.in_flight < self.limit and self.waiters:
+            game_id, futures = next(iter(self.waiters.items()))
+            future = futures.popleft()
+            if futures:
+                self.waiters.move_to_end(game_id)
+            else:
+                del self.waiters[game_id]
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+
+class LLMScheduler:
+    """Caps in-flight LLM requests per model and shares the free slots fairly between games.
+
+    `max_concurrent` should match the server's parallel slots (OLLAMA_NUM_PARALLEL), either as one
+    value for every model or as a {model_name: limit} mapping.
+    """
+
+    def __init__(self, max_concurrent: Union[int, Dict[str, int]] = 4):
+        self.max_concurrent = max_concurrent
+        self._models: Dict[str, _ModelQueue] = {}
+
+    def _queue(self, model_name: str) -> _ModelQueue:
+        if model_name not in self._models:
+            if isinstance(self.max_concurrent, dict):
+                limit = self.max_concurrent.get(model_name, 1)
+            else:
+                limit = self.max_concurrent
+            self._models[model_name] = _ModelQueue(limit)
+        return self._models[model_name]
+
+    async def _acquire(self, queue: _ModelQueue, game_id: Hashable):
+        if queue.in_flight < queue.limit and not queue.waiters:
+            queue.in_flight += 1
+            return
+        queue.queued += 1
+        future = asyncio.get_running_loop().create_future()
+        queue.waiters.setdefault(game_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled: hand it on.
+                queue.in_flight -= 1
+                queue.grant_next()
+            else:
+                futures = queue.waiters.get(game_id)
+                if futures is not None and future in futures:
+                    futures.remove(future)
+                    if not futures:
+                        del queue.waiters[game_id]
+            raise
+
+    def _release(self, queue: _ModelQueue):
+        queue.in_flight -= 1
+        queue.grant_next()
+
+    @asynccontextmanager
+    async def slot(self, model_name: str, game_id: Optional[Hashable] = None):
+        queue = self._queue(model_name)
+        queue.requests += 1
+        start = time.perf_counter()
+        await self._acquire(queue, game_id)
+        granted = time.perf_counter()
+        wait = granted - start
+        queue.queue_wait += wait
+        queue.max_queue_wait = max(queue.max_queue_wait, wait)
+        try:
+            yield
+        finally:
+            inference = time.perf_counter() - granted
+            queue.inference += inference
+            queue.max_inference = max(queue.max_inference, inference)
+            self._release(queue)
+
+    def get_stats(self) -> Dict[str, dict]:
+        stats = {}
+        for model_name, queue in self._models.items():
+            requests = max(queue.requests, 1)
+            stats[model_name] = {"limit": queue.limit,
+                                 "requests": queue.requests,
+                                 "queued": queue.queued,
+                                 "in_flight": queue.in_flight,
+                                 "waiting": queue.waiting(),
+                                 "queue_wait_total": queue.queue_wait,
+                                 "queue_wait_mean": queue.queue_wait / requests,
+                                 "queue_wait_max": queue.max_queue_wait,
+                                 "inference_total": queue.inference,
+                                 "inference_mean": queue.inference / requests,
+                                 "inference_max": queue.max_inference}
+        return stats
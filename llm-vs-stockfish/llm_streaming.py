@@ -0,0 +1,122 @@
+# %%
+import json
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+_BEST_MOVE = re.compile(r'"best_move"\s*:')
+_MOVE = re.compile(r'"move"\s*:\s*"([^"\\]*)"')
+_EXPLANATION = re.compile(r'"explanation"\s*:\s*"((?:[^"\\]|\\.)*)(")?')
+_CANDIDATE = re.compile(r'\{\s*"move"\s*:\s*"([^"\\]*)"\s*,\s*"explanation"\s*:\s*"((?:[^"\\]|\\.)*)"\s*\}')
+
+
+def _unescape(text: str) -> str:
+    text = text[:-1] if text.endswith("\\") and not text.endswith("\\\\") else text
+    try:
+        return json.loads(f'"{text}"')
+    except ValueError:
+        return text
+
+
+class BestMoveScanner:
+    """Incremental reader of a streamed ChessOutput JSON document.
+
+    Chunks are appended as they arrive; `best_move()` returns the move as soon as the closing quote of
+    best_move's "move" string has been generated, well before the JSON document is complete.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._best_at: Optional[int] = None
+        self._move: Optional[str] = None
+
+    def feed(self, chunk: str):
+        self.text += chunk
+
+    def best_move(self) -> Optional[str]:
+        if self._move is not None:
+            return self._move
+        if self._best_at is None:
+            match = _BEST_MOVE.search(self.text)
+            if match is None:
+                return None
+            self._best_at = match.end()
+        match = _MOVE.search(self.text, self._best_at)
+        if match is None:
+            return None
+        self._move = match.group(1)
+        return self._move
+
+    def explanation(self) -> Tuple[str, bool]:
+        """The best move's explanation generated so far, and whether its string is complete."""
+        if self._best_at is None:
+            return "", False
+        match = _EXPLANATION.search(self.text, self._best_at)
+        if match is None:
+            return "", False
+        return _unescape(match.group(1)), match.group(2) is not None
+
+    def candidates(self) -> List[Tuple[str, str]]:
+        """The candidate moves completely generated before best_move."""
+        end = self._best_at if self._best_at is not None else len(self.text)
+        return [(move, _unescape(explanation)) for move, explanation in _CANDIDATE.findall(self.text, 0, end)]
+
+
+class StreamStats:
+    """Time-to-move against full-generation time, per model.
+
+    Full-generation time is only known when the stream runs to its end, i.e. when no move could be
+    read early or when the player drains the stream on purpose (measure_full_generation).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models: Dict[str, dict] = {}
+
+    def record(self, model_name: str, time_to_move: Optional[float], full_generation: Optional[float],
+               early_stop: bool, chars_at_move: int, chars_total: int):
+        with self._lock:
+            stats = self.models.setdefault(model_name, {"requests": 0, "early_stops": 0, "moves": 0,
+                                                        "time_to_move": 0.0, "full_generations": 0,
+                                                        "full_generation": 0.0, "chars_at_move": 0,
+                                                        "chars_total": 0})
+            stats["requests"] += 1
+            stats["early_stops"] += int(early_stop)
+            if time_to_move is not None:
+                stats["moves"] += 1
+                stats["time_to_move"] += time_to_move
+                stats["chars_at_move"] += chars_at_move
+            if full_generation is not None:
+                stats["full_generations"] += 1
+                stats["full_generation"] += full_generation
+                stats["chars_total"] += chars_total
+
+    def get_stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return summarize_stream_stats({model: dict(stats) for model, stats in self.models.items()})
+
+
+def summarize_stream_stats(models: Dict[str, dict]) -> Dict[str, dict]:
+    """Add mean times and the saved fraction to raw per-model counters (also used to merge games)."""
+    for stats in models.values():
+        stats["time_to_move_mean"] = stats["time_to_move"] / stats["moves"] if stats["moves"] else None
+        stats["full_generation_mean"] = (stats["full_generation"] / stats["full_generations"]
+                                         if stats["full_generations"] else None)
+        if stats["time_to_move_mean"] is not None and stats["full_generation_mean"]:
+            stats["time_saved"] = 1 - stats["time_to_move_mean"] / stats["full_generation_mean"]
+        else:
+            stats["time_saved"] = None
+    return models
+
+
+def merge_stream_stats(per_game: List[Dict[str, dict]]) -> Dict[str, dict]:
+    raw_keys = ("requests", "early_stops", "moves", "time_to_move", "full_generations", "full_generation",
+                "chars_at_move", "chars_total")
+    merged: Dict[str, dict] = {}
+    for models in per_game:
+        for model_name, stats in models.items():
+            totals = merged.setdefault(model_name, {key: 0 for key in raw_keys})
+            for key in raw_keys:
+                totals[key] += stats[key]
+    return summarize_stream_stats(merged)
+
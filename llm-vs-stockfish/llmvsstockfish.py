@@ -0,0 +1,188 @@
+# %%
+# Entry point of the `llmvsstockfish` command. Only the standard library is imported up front: every
+# command imports what it needs when it runs, so `replay` or `analyze` never load langchain and
+# short-lived workers don't pay for backends they don't use.
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List, Optional
+
+_START = time.perf_counter()
+
+# Packages worth naming in the --profile-startup report when a command loads them.
+HEAVY_PACKAGES = ("langchain_ollama", "langchain_mistralai", "langchain_core", "pydantic", "pandas", "numpy",
+                  "IPython", "chess", "stockfish")
+
+
+def _process_age() -> Optional[float]:
+    """Seconds since the interpreter process started (Linux only), None elsewhere."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def startup_report(command: str, modules_before: set, import_seconds: float) -> str:
+    loaded = set(sys.modules) - modules_before
+    heavy = [name for name in HEAVY_PACKAGES if name in sys.modules]
+    report = f"> startup {command}: ready after {time.perf_counter() - _START:.3f}s"
+    age = _process_age()
+    if age is not None:
+        report += f" ({age:.2f}s since the process started)"
+    report += (f", {import_seconds:.3f}s importing {len(loaded)} modules for the command;"
+               f" heavy packages loaded: {', '.join(heavy) or 'none'}")
+    return report
+
+
+def _tournament() -> Callable:
+    from tournament import main
+    return lambda args, rest: main(rest)
+
+
+def _models() -> Callable:
+    from model_residency import main
+    return lambda args, rest: main(rest)
+
+
+def _replay() -> Callable:
+    from ollama_replay import main
+    return lambda args, rest: main(rest)
+
+
+def _queue() -> Callable:
+    from job_queue import main
+    return lambda args, rest: main(rest)
+
+
+def _analytics() -> Callable:
+    from analytics import main
+    return lambda args, rest: main(rest)
+
+
+def _export() -> Callable:
+    from replay_export import main
+    return lambda args, rest: main(rest)
+
+
+def _play() -> Callable:
+    from tournament import GameSpec, play_single_game
+    # Imported here rather than in the game so --profile-startup counts the backends too.
+    import chess_game_manager, langchain_ollama, llm_player, stockfish_player  # noqa: F401
+
+    def run(args, rest):
+        spec = GameSpec(model_name=args.model, temperature=args.temperature, stockfish_path=args.stockfish_path,
+                        stockfish_elo=args.elo, stockfish_depth=args.depth, num_moves=args.moves,
+                        ollama_base_url=args.ollama_url, ollama_keep_alive=args.keep_alive)
+        result = play_single_game(spec, 0)
+        if result.error is not None:
+            print(f"> Game failed after {result.wall_time:.1f}s: {result.error}")
+            return 1
+        row = result.row
+        print(" ".join(row["Game_record"].ucis()))
+        print(f"> {row['Result']} in {len(row['Game_record'])} plies ({result.wall_time:.1f}s), "
+              f"winner: {row['Win']}, LLM played {row['LLM_color']}"
+              + (f", adjudicated: {row['Adjudication']}" if row["Adjudication"] else ""))
+        if args.store is not None:
+            from experiment_store import ExperimentStore
+            ExperimentStore(args.store).record_game(row)
+        return 0
+
+    return run
+
+
+def _analyze() -> Callable:
+    from experiment_store import ExperimentStore
+
+    def run(args, rest):
+        store = ExperimentStore(args.store)
+        rows = store.results_by_config(model_name=args.model, stockfish_elo=args.elo)
+        print(f"{'model':<24} {'temp':>5} {'sf elo':>7} {'games':>6} {'W':>4} {'D':>4} {'L':>4} {'score':>6} {'plies':>6}")
+        for row in rows:
+            temp = f"{row['llm_temp']:.2f}" if row["llm_temp"] is not None else "-"
+            print(f"{row['model_name'] or '-':<24} {temp:>5} {row['stockfish_elo'] or '-':>7} {row['games']:>6} "
+                  f"{row['wins']:>4} {row['draws']:>4} {row['losses']:>4} {row['score']:>6.2f} {row['mean_plies']:>6.1f}")
+        print(f"> {sum(row['games'] for row in rows)} games in {args.store}")
+        if args.stockfish_path is None:
+            return 0
+        # Engine analysis is the only part of `analyze` that needs chess.engine and a process pool.
+        from game_analysis import AnalysisStore, analyze_store, format_quality
+        stats = analyze_store(args.store, args.stockfish_path, depth=args.depth, workers=args.workers,
+                              model_name=args.model, stockfish_elo=args.elo)
+        print(f"> {stats['games']} new games analyzed at depth {args.depth} ({stats['evaluated']} positions searched,"
+              f" {stats['cached']} already evaluated)")
+        analysis = AnalysisStore(args.store)
+        print(format_quality(analysis.quality_by_config()))
+        analysis.close()
+        return 0
+
+    return run
+
+
+# name -> (help, loader); commands forwarding their own arguments to an existing main() are `delegated`.
+COMMANDS = {
+    "play": ("Play one game and print its moves.", _play),
+    "tournament": ("Play many games in parallel (see tournament.py --help).", _tournament),
+    "models": ("Play games for several models, one model loaded at a time (see model_residency.py --help).",
+               _models),
+    "replay": ("Serve recorded LLM exchanges like Ollama (see ollama_replay.py --help).", _replay),
+    "queue": ("Submit games to a resumable job queue and run its workers (see job_queue.py --help).", _queue),
+    "analyze": ("Results per model, temperature and Stockfish Elo, and with --stockfish-path the LLM's move "
+                "quality from engine analysis (see game_analysis.py).", _analyze),
+    "analytics": ("Win rates, game lengths, failed-answer/fallback rates and material curves per configuration, "
+                  "cached until new games arrive (see analytics.py --help).", _analytics),
+    "export": ("Write stored games as self-contained HTML or animated SVG replays (see replay_export.py --help).",
+               _export),
+}
+DELEGATED = ("tournament", "models", "replay", "queue", "analytics", "export")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="llmvsstockfish", description="LLM vs Stockfish experiments.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print how long the command took to become ready and which heavy packages it loaded.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    subparsers = {name: commands.add_parser(name, help=help, add_help=name not in DELEGATED)
+                  for name, (help, _) in COMMANDS.items()}
+
+    play = subparsers["play"]
+    play.add_argument("--model", required=True)
+    play.add_argument("--temperature", type=float, default=0.1)
+    play.add_argument("--stockfish-path", required=True)
+    play.add_argument("--elo", type=int, default=1000)
+    play.add_argument("--depth", type=int, default=15)
+    play.add_argument("--moves", type=int, default=50)
+    play.add_argument("--ollama-url", default=None)
+    play.add_argument("--keep-alive", default=None)
+    play.add_argument("--store", default=None, help="Also append the game to this experiment store.")
+
+    analyze = subparsers["analyze"]
+    analyze.add_argument("--store", default="ChessGameExperiment.sqlite")
+    analyze.add_argument("--model", default=None)
+    analyze.add_argument("--elo", type=int, default=None)
+    analyze.add_argument("--stockfish-path", default=None,
+                         help="Also run the engine analysis of new games and print LLM move quality.")
+    analyze.add_argument("--depth", type=int, default=12)
+    analyze.add_argument("--workers", type=int, default=4)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if rest and args.command not in DELEGATED:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+
+    modules_before = set(sys.modules)
+    start = time.perf_counter()
+    run = COMMANDS[args.command][1]()
+    if args.profile_startup:
+        print(startup_report(args.command, modules_before, time.perf_counter() - start), file=sys.stderr)
+    result = run(args, rest)
+    return result if isinstance(result, int) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# %%
+import argparse
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional
+
+from game_events import configure_logging, emit, get_logger
+
+logger = get_logger("residency")
+
+DEFAULT_BASE_URL = "http://127.0.0.1:11434"
+# Ollama reports a load_duration of a few milliseconds for a resident model and seconds for a load.
+COLD_LOAD_SECONDS = 0.5
+
+
+def new_load_stats() -> Dict[str, float]:
+    return {"calls": 0, "cold_calls": 0, "cold_first_token": 0.0, "warm_first_token": 0.0, "load_seconds": 0.0}
+
+
+def record_load(stats: Dict[str, float], metadata: dict):
+    """Classify one answer as cold or warm from Ollama's metadata and add its time to first token."""
+    if "load_duration" not in metadata:
+        return
+    load = metadata["load_duration"] / 1e9
+    first_token = load + metadata.get("prompt_eval_duration", 0) / 1e9
+    stats["calls"] += 1
+    stats["load_seconds"] += load
+    if load >= COLD_LOAD_SECONDS:
+        stats["cold_calls"] += 1
+        stats["cold_first_token"] += first_token
+    else:
+        stats["warm_first_token"] += first_token
+
+
+def summarize_load_stats(stats: Dict[str, float]) -> dict:
+    warm_calls = stats["calls"] - stats["cold_calls"]
+    return {"calls": stats["calls"], "cold_calls": stats["cold_calls"], "warm_calls": warm_calls,
+            "cold_first_token_mean": stats["cold_first_token"] / stats["cold_calls"] if stats["cold_calls"] else None,
+            "warm_first_token_mean": stats["warm_first_token"] / warm_calls if warm_calls else None,
+            "load_seconds": stats["load_seconds"]}
+
+
+def group_by_model(items: Iterable, key: Callable = lambda item: item.model_name) -> "OrderedDict[str, list]":
+    """Items grouped by model, models in order of first appearance."""
+    groups: "OrderedDict[str, list]" = OrderedDict()
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return groups
+
+
+class ModelResidency:
+    """Decides which models Ollama keeps in memory instead of letting requests evict each other.
+
+    `activate(model)` loads a model before its games start (an empty /api/generate request with our
+    `keep_alive`), so the first move doesn't pay the load. At most `max_loaded` models stay resident:
+    older ones are unloaded explicitly (keep_alive 0) before the next one loads. With room for two,
+    `prewarm_async` loads the next model while the last games of the current one finish.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, keep_alive: str = "30m", max_loaded: int = 1,
+                 timeout: float = 600.0):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.keep_alive = keep_alive
+        self.max_loaded = max_loaded
+        self.timeout = timeout
+        self.active: Optional[str] = None
+        self.resident: "OrderedDict[str, None]" = OrderedDict()
+        self._warming: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"switches": 0, "prewarms": 0, "prewarm_seconds": 0.0, "prewarm_failures": 0, "unloads": 0}
+
+    @property
+    def can_overlap(self) -> bool:
+        return self.max_loaded > 1
+
+    def _generate(self, model: str, keep_alive) -> dict:
+        import httpx
+
+        response = httpx.post(f"{self.base_url}/api/generate",
+                              json={"model": model, "prompt": "", "keep_alive": keep_alive, "stream": False},
+                              timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def loaded(self) -> List[str]:
+        import httpx
+
+        response = httpx.get(f"{self.base_url}/api/ps", timeout=self.timeout)
+        response.raise_for_status()
+        return [model["name"] for model in response.json().get("models", [])]
+
+    def unload(self, model: str):
+        self._generate(model, 0)
+        with self._lock:
+            self.resident.pop(model, None)
+            self.stats["unloads"] += 1
+        emit(logger, logging.INFO, "model_unloaded", model=model)
+
+    def _make_room(self, keep: str):
+        with self._lock:
+            evict = [model for model in self.resident if model not in (keep, self.active)]
+            evict = evict[:max(len(self.resident) + 1 - self.max_loaded, 0)]
+        for model in evict:
+            self.unload(model)
+
+    def prewarm(self, model: str) -> float:
+        if model not in self.resident:
+            self._make_room(model)
+        start = time.perf_counter()
+        metadata = self._generate(model, self.keep_alive)
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.resident[model] = None
+            self.resident.move_to_end(model)
+            self.stats["prewarms"] += 1
+            self.stats["prewarm_seconds"] += seconds
+        emit(logger, logging.INFO, "model_prewarmed", model=model, seconds=seconds,
+             load_seconds=metadata.get("load_duration", 0) / 1e9)
+        return seconds
+
+    def _prewarm_into(self, future: Future, model: str):
+        try:
+            future.set_result(self.prewarm(model))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def prewarm_async(self, model: str):
+        if model in self._warming or model == self.active:
+            return
+        future = Future()
+        self._warming[model] = future
+        threading.Thread(target=self._prewarm_into, args=(future, model), name=f"prewarm-{model}",
+                         daemon=True).start()
+
+    def activate(self, model: str):
+        """Make `model` the one games are played with, loading it first if needed.
+
+        A failed background prewarm is retried here; if loading still fails the error is raised and
+        no model is active.
+        """
+        if model == self.active:
+            return
+        previous, self.active = self.active, None
+        warming = self._warming.pop(model, None)
+        warmed = False
+        if warming is not None:
+            try:
+                warming.result()
+                warmed = True
+            except Exception as e:
+                with self._lock:
+                    self.stats["prewarm_failures"] += 1
+                emit(logger, logging.WARNING, "model_prewarm_failed", model=model, error=repr(e))
+        if not warmed:
+            if previous is not None and not self.can_overlap:
+                # Free the memory first so the load doesn't compete with the old weights.
+                self.unload(previous)
+            self.prewarm(model)
+        self.active = model
+        if previous is not None:
+            self.stats["switches"] += 1
+            emit(logger, logging.INFO, "model_switch", previous=previous, model=model)
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, resident=list(self.resident))
+
+
+def run_model_groups(specs: List, workers: Optional[int] = None, store_path: str = "ChessGameExperiment.sqlite",
+                     residency: Optional[ModelResidency] = None) -> List:
+    """Play every spec's games, one model at a time, and return one TournamentReport per spec.
+
+    All games of a model run before the next model is activated; when two models fit in memory, the
+    next one is prewarmed as soon as the last wave of the current model's games is running.
+    """
+    from experiment_store import ExperimentStore
+    from tournament import TournamentReport, play_single_game, record_result
+
+    store = ExperimentStore(store_path)
+    groups = group_by_model(specs)
+    workers = workers or max(1, *(spec.num_games for spec in specs))
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        models = list(groups)
+        for position, model in enumerate(models):
+            if residency is not None:
+                residency.activate(model)
+            next_model = models[position + 1] if position + 1 < len(models) else None
+            futures = {}
+            for spec in groups[model]:
+                report = TournamentReport(spec=spec, workers=workers, wall_time=0.0)
+                reports.append(report)
+                for i in range(spec.num_games):
+                    futures[pool.submit(play_single_game, spec, i)] = report
+            overlap = residency is not None and residency.can_overlap and next_model is not None
+            start = time.perf_counter()
+            remaining = len(futures)
+            if overlap and remaining <= workers:
+                residency.prewarm_async(next_model)
+            for future in as_completed(futures):
+                report = futures[future]
+                record_result(report, store, future.result())
+                remaining -= 1
+                if overlap and remaining <= workers:
+                    residency.prewarm_async(next_model)
+            for report in {id(r): r for r in futures.values()}.values():
+                report.wall_time = time.perf_counter() - start
+    for report in reports:
+        print(report.summary())
+    if residency is not None:
+        print(f"> Model residency: {residency.get_stats()}")
+    return reports
+
+
+def main(argv: Optional[List[str]] = None):
+    from tournament import GameSpec
+
+    parser = argparse.ArgumentParser(description="Play games for several models, grouped so each model loads once.")
+    parser.add_argument("--model", action="append", required=True, help="Repeat for every model to play.")
+    parser.add_argument("--temperature", type=float, default=0.1)
+    parser.add_argument("--stockfish-path", required=True)
+    parser.add_argument("--elo", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=15)
+    parser.add_argument("--games", type=int, default=1, help="Games per model.")
+    parser.add_argument("--moves", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--store", default="ChessGameExperiment.sqlite")
+    parser.add_argument("--ollama-url", default=None)
+    parser.add_argument("--keep-alive", default="30m", help="How long Ollama keeps an idle model loaded.")
+    parser.add_argument("--max-loaded", type=int, default=1,
+                        help="Models that fit in memory together; with 2 the next model loads during the last games.")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args(argv)
+    configure_logging(getattr(logging, args.log_level))
+
+    specs = [GameSpec(model_name=model, temperature=args.temperature, stockfish_path=args.stockfish_path,
+                      stockfish_elo=args.elo, stockfish_depth=args.depth, num_games=args.games, num_moves=args.moves,
+                      ollama_base_url=args.ollama_url, ollama_keep_alive=args.keep_alive)
+             for model in args.model]
+    residency = ModelResidency(args.ollama_url, keep_alive=args.keep_alive, max_loaded=args.max_loaded)
+    return run_model_groups(specs, workers=args.workers, store_path=args.store, residency=residency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# %%
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+import chess
+
+REPAIR_CATEGORIES = ("case", "hyphen", "san", "lan", "castling", "promotion", "candidate")
+
+_ANNOTATIONS = re.compile(r"[+#!?]+$")
+_FOLDED_OUT = str.maketrans("", "", "-x=:() ")
+
+
+def _fold(text: str) -> str:
+    return text.lower().translate(_FOLDED_OUT)
+
+
+def new_repair_stats() -> Dict[str, int]:
+    return {category: 0 for category in REPAIR_CATEGORIES}
+
+
+class MoveNormalizer:
+    """Maps the many ways an LLM writes a move onto the UCI string of one of the board's legal moves.
+
+    Exact UCI answers are a set lookup. The other notations (SAN, LAN, hyphenated, uppercase,
+    O-O/0-0, king-takes-rook castling, promotion without a piece) are indexed the first time an
+    answer needs repairing, so each further answer costs one or two dict lookups. Notations that
+    would match several legal moves are left unresolved rather than guessed.
+    """
+
+    def __init__(self, board: chess.Board):
+        self.board = board
+        self.ucis = {move.uci() for move in board.legal_moves}
+        self._forms: Optional[Dict[str, Optional[Tuple[str, str]]]] = None
+        self._folded: Optional[Dict[str, Optional[Tuple[str, str]]]] = None
+
+    @staticmethod
+    def _add(table: dict, key: str, uci: str, category: str):
+        if key not in table:
+            table[key] = (uci, category)
+        elif table[key] is not None and table[key][0] != uci:
+            table[key] = None
+
+    def _index(self):
+        forms: Dict[str, Optional[Tuple[str, str]]] = {}
+        folded: Dict[str, Optional[Tuple[str, str]]] = {}
+        for uci in self.ucis:
+            folded[uci] = (uci, "case")
+        for move in self.board.legal_moves:
+            uci = move.uci()
+            san = _ANNOTATIONS.sub("", self.board.san(move))
+            piece = self.board.piece_at(move.from_square)
+            letter = piece.symbol().upper() if piece.piece_type != chess.PAWN else ""
+            promotion = "=" + chess.piece_symbol(move.promotion).upper() if move.promotion else ""
+            from_square, to_square = chess.square_name(move.from_square), chess.square_name(move.to_square)
+            capture = "x" if self.board.is_capture(move) else "-"
+            if self.board.is_castling(move):
+                long = self.board.is_queenside_castling(move)
+                for notation in (("O-O-O", "0-0-0", "OOO", "000") if long else ("O-O", "0-0", "OO", "00")):
+                    self._add(forms, notation, uci, "castling")
+                # Chess960-style castling: the king "captures" its own rook.
+                king_takes_rook = self._king_takes_rook(move)
+                if king_takes_rook is not None:
+                    self._add(forms, king_takes_rook, uci, "castling")
+            self._add(forms, san, uci, "san")
+            for separator in {"", "-", capture}:
+                self._add(forms, f"{letter}{from_square}{separator}{to_square}{promotion}", uci, "lan")
+            if move.promotion == chess.QUEEN:
+                # "e7e8" without a piece: promote to a queen.
+                self._add(forms, uci[:4], uci, "promotion")
+                self._add(forms, f"{from_square}-{to_square}", uci, "promotion")
+                if not self.board.is_capture(move):
+                    self._add(forms, to_square, uci, "promotion")
+        for key, value in list(forms.items()):
+            if value is not None:
+                self._add(folded, _fold(key), value[0], value[1])
+        self._forms, self._folded = forms, folded
+
+    def _king_takes_rook(self, move: chess.Move) -> Optional[str]:
+        rank = chess.square_rank(move.from_square)
+        rook_file = 0 if self.board.is_queenside_castling(move) else 7
+        rook_square = chess.square(rook_file, rank)
+        if self.board.piece_type_at(rook_square) != chess.ROOK:
+            return None
+        return chess.square_name(move.from_square) + chess.square_name(rook_square)
+
+    def resolve(self, answer: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """Return (uci, repair category), with category None for an exact UCI answer and uci None if unresolved."""
+        if not answer:
+            return None, None
+        text = answer.strip()
+        if text in self.ucis:
+            return text, None
+        if self._forms is None:
+            self._index()
+        text = _ANNOTATIONS.sub("", text.strip(" .\"'"))
+        unhyphenated = text.replace("-", "")
+        if unhyphenated in self.ucis:
+            return unhyphenated, "hyphen" if "-" in text else "lan"
+        hit = self._forms.get(text)
+        if hit is None and unhyphenated.lower() in self.ucis:
+            # Separators go before the case fold, so "E7-E5" is a hyphen repair like "e7-e5".
+            return unhyphenated.lower(), "hyphen" if "-" in text else "case"
+        if hit is None:
+            hit = self._folded.get(_fold(text))
+        if hit is None:
+            return None, None
+        return hit
+
+    def resolve_any(self, answers: Iterable[Optional[str]]) -> Tuple[Optional[str], Optional[str]]:
+        """Resolve the first answer that maps onto a legal move; later answers count as 'candidate' repairs."""
+        for index, answer in enumerate(answers):
+            uci, category = self.resolve(answer)
+            if uci is not None:
+                return uci, ("candidate" if index else category)
+        return None, None
@@ -0,0 +1,509 @@
+# %%
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from game_events import configure_logging, emit, get_logger
+
+logger = get_logger("ollama_replay")
+
+# /api/version answer: new enough for constrained_output's JSON-schema formats.
+EMULATED_VERSION = "0.5.7"
+
+_ROLES = {"human": "user", "ai": "assistant", "system": "system", "tool": "tool"}
+_LEGAL_MOVES = re.compile(r"envisage de jouer \[([^\]]*)\]")
+
+
+def prompt_messages(prompt) -> List[Tuple[str, str]]:
+    """(role, content) pairs of a LangChain prompt, the way ChatOllama sends them to /api/chat."""
+    if isinstance(prompt, str):
+        return [("user", prompt)]
+    messages = prompt.to_messages() if hasattr(prompt, "to_messages") else prompt
+    return [(_ROLES.get(message.type, message.type), message.content) for message in messages]
+
+
+def request_key(messages: Sequence[Tuple[str, str]], format=None) -> str:
+    payload = json.dumps([[[role, content] for role, content in messages], format], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ReplayStore:
+    """Recorded LLM exchanges in SQLite: request key -> answer, Ollama metadata and wall time.
+
+    A key can hold several answers (sampling at temperature > 0); replay cycles through them.
+    """
+
+    def __init__(self, path: str = "ollama_replay.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS exchanges (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                key TEXT NOT NULL,
+                                model TEXT,
+                                content TEXT NOT NULL,
+                                metadata TEXT NOT NULL,
+                                seconds REAL NOT NULL,
+                                created REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS exchanges_key ON exchanges(key)")
+        self._db.commit()
+
+    def put(self, key: str, model: Optional[str], content: str, metadata: dict, seconds: float):
+        with self._lock:
+            self._db.execute("INSERT INTO exchanges (key, model, content, metadata, seconds, created) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, model, content, json.dumps(metadata, default=str), seconds, time.time()))
+            self._db.commit()
+
+    def load(self) -> Dict[str, List[dict]]:
+        with self._lock:
+            rows = self._db.execute("SELECT key, model, content, metadata, seconds FROM exchanges ORDER BY id").fetchall()
+        exchanges: Dict[str, List[dict]] = {}
+        for key, model, content, metadata, seconds in rows:
+            exchanges.setdefault(key, []).append({"model": model, "content": content,
+                                                  "metadata": json.loads(metadata), "seconds": seconds})
+        return exchanges
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM exchanges").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class RecordingChatModel:
+    """Wraps a ChatOllama and records every completed exchange into a ReplayStore.
+
+    Streams are recorded only when read to the end: a stream closed once best_move was read holds
+    a partial answer. Record with measure_full_generation when streaming.
+    """
+
+    def __init__(self, llm, store: ReplayStore):
+        self.llm = llm
+        self.store = store
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def _record(self, prompt, kwargs: dict, result, seconds: float):
+        key = request_key(prompt_messages(prompt), kwargs.get("format", getattr(self.llm, "format", None)) or None)
+        self.store.put(key, getattr(self.llm, "model", None), result.content,
+                       dict(getattr(result, "response_metadata", None) or {}), seconds)
+
+    def invoke(self, prompt, **kwargs):
+        start = time.perf_counter()
+        result = self.llm.invoke(prompt, **kwargs)
+        self._record(prompt, kwargs, result, time.perf_counter() - start)
+        return result
+
+    async def ainvoke(self, prompt, **kwargs):
+        start = time.perf_counter()
+        result = await self.llm.ainvoke(prompt, **kwargs)
+        self._record(prompt, kwargs, result, time.perf_counter() - start)
+        return result
+
+    def stream(self, prompt, **kwargs):
+        start, result = time.perf_counter(), None
+        stream = self.llm.stream(prompt, **kwargs)
+        try:
+            for chunk in stream:
+                result = chunk if result is None else result + chunk
+                yield chunk
+        finally:
+            stream.close()
+        if result is not None:
+            self._record(prompt, kwargs, result, time.perf_counter() - start)
+
+    async def astream(self, prompt, **kwargs):
+        start, result = time.perf_counter(), None
+        stream = self.llm.astream(prompt, **kwargs)
+        try:
+            async for chunk in stream:
+                result = chunk if result is None else result + chunk
+                yield chunk
+        finally:
+            await stream.aclose()
+        if result is not None:
+            self._record(prompt, kwargs, result, time.perf_counter() - start)
+
+
+class LatencyModel:
+    """Time the emulator spends per request.
+
+    "recorded[:scale]"         the recorded wall time of the exchange, scaled
+    "empirical[:scale]"        a random recorded wall time from any exchange, scaled
+    "fixed:S"                  S seconds
+    "lognormal:MEDIAN,SIGMA"   a log-normal draw, for heavy tails
+
+    Misses (no recorded exchange) under "recorded" fall back to "empirical".
+    """
+
+    KINDS = ("recorded", "empirical", "fixed", "lognormal")
+
+    def __init__(self, kind: str = "recorded", scale: float = 1.0, seconds: float = 0.0,
+                 median: float = 1.0, sigma: float = 0.5, seed: Optional[int] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency model {kind!r}, expected one of {self.KINDS}")
+        self.kind = kind
+        self.scale = scale
+        self.seconds = seconds
+        self.median = median
+        self.sigma = sigma
+        self._random = random.Random(seed)
+
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "LatencyModel":
+        kind, _, args = spec.partition(":")
+        values = [float(value) for value in args.split(",") if value]
+        if kind in ("recorded", "empirical"):
+            return cls(kind, scale=values[0] if values else 1.0, seed=seed)
+        if kind == "fixed":
+            return cls(kind, seconds=values[0], seed=seed)
+        if kind == "lognormal":
+            return cls(kind, median=values[0], sigma=values[1] if len(values) > 1 else 0.5, seed=seed)
+        raise ValueError(f"Unknown latency model {spec!r}, expected one of {cls.KINDS}")
+
+    def sample(self, recorded: Optional[float], population: Sequence[float]) -> float:
+        if self.kind == "fixed":
+            return self.seconds
+        if self.kind == "lognormal":
+            return self.median * math.exp(self.sigma * self._random.gauss(0.0, 1.0))
+        if self.kind == "recorded" and recorded is not None:
+            return recorded * self.scale
+        return self._random.choice(population) * self.scale if population else 0.0
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _ClientGone(Exception):
+    pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ollama-replay"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_line(self, body: dict):
+        data = json.dumps(body).encode() + b"\n"
+        try:
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            raise _ClientGone()
+
+    def end_stream(self):
+        try:
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        emulator = self.server.emulator
+        if self.path == "/api/tags":
+            models = [{"name": name, "model": name, "modified_at": _now(), "size": 0, "digest": ""}
+                      for name in emulator.models]
+            self._send_json(200, {"models": models})
+        elif self.path == "/api/version":
+            self._send_json(200, {"version": EMULATED_VERSION})
+        elif self.path == "/api/ps":
+            models = [{"name": name, "model": name, "size": 0, "digest": "", "expires_at": _now()}
+                      for name in emulator.resident_models()]
+            self._send_json(200, {"models": models})
+        elif self.path == "/api/stats":
+            self._send_json(200, emulator.get_stats())
+        elif self.path == "/":
+            self._send_json(200, {"status": "Ollama is running"})
+        else:
+            self._send_json(404, {"error": f"{self.path} not found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/api/chat":
+            self.server.emulator.chat(self, body)
+        elif self.path == "/api/generate":
+            self.server.emulator.generate(self, body)
+        else:
+            self._send_json(404, {"error": f"{self.path} not found"})
+
+
+class OllamaEmulator:
+    """A local HTTP server answering /api/chat like Ollama from recorded exchanges.
+
+    Requests are keyed like the recordings (messages + format). A hit replays the recorded answer,
+    a miss gets a synthetic answer built from the legal moves in the request (or a 404 when
+    `synthesize_misses` is off). Each request holds one of `slots` parallel slots (OLLAMA_NUM_PARALLEL)
+    for its whole simulated latency, so queueing and tail latency behave like a busy server.
+    Streamed answers are cut short when the client disconnects, which frees the slot early.
+
+    At most `max_loaded` models are resident (OLLAMA_MAX_LOADED_MODELS); a request for another model
+    evicts the least recently used one and first waits `load_seconds`, reported as load_duration.
+    /api/generate with an empty prompt loads a model, or unloads it with keep_alive 0, as in Ollama.
+    """
+
+    def __init__(self, store_path: Optional[str] = None, latency: Optional[LatencyModel] = None, slots: int = 1,
+                 models: Optional[List[str]] = None, synthesize_misses: bool = True,
+                 host: str = "127.0.0.1", port: int = 0, chunk_chars: int = 8, seed: Optional[int] = None,
+                 load_seconds: float = 0.0, max_loaded: int = 1):
+        store = ReplayStore(store_path) if store_path else None
+        self.exchanges = store.load() if store is not None else {}
+        if store is not None:
+            store.close()
+        self.population = [entry["seconds"] for entries in self.exchanges.values() for entry in entries]
+        recorded_models = {entry["model"] for entries in self.exchanges.values() for entry in entries if entry["model"]}
+        self.models = models or sorted(recorded_models) or ["replay"]
+        self.latency = latency or LatencyModel()
+        self.slots = slots
+        self.synthesize_misses = synthesize_misses
+        self.chunk_chars = chunk_chars
+        self._random = random.Random(seed)
+        self._slots = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, int] = {}
+        self.load_seconds = load_seconds
+        self.max_loaded = max_loaded
+        self._resident: "OrderedDict[str, None]" = OrderedDict()
+        self._load_lock = threading.Lock()
+        self._in_flight = 0
+        self.latencies: List[float] = []
+        self.queue_waits: List[float] = []
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "not_found": 0, "cancelled": 0, "max_in_flight": 0,
+                      "loads": 0, "unloads": 0}
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.emulator = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.server.serve_forever, name="ollama-emulator", daemon=True)
+        self._thread.start()
+        emit(logger, logging.INFO, "emulator_started", url=self.base_url, exchanges=len(self.population),
+             slots=self.slots, latency=self.latency.kind)
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "OllamaEmulator":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def resident_models(self) -> List[str]:
+        with self._lock:
+            return list(self._resident)
+
+    def _ensure_loaded(self, model: str) -> float:
+        """Seconds spent loading `model` (0 when it was resident)."""
+        with self._lock:
+            if model in self._resident:
+                self._resident.move_to_end(model)
+                return 0.0
+        with self._load_lock:
+            with self._lock:
+                if model in self._resident:
+                    return 0.0
+            time.sleep(self.load_seconds)
+            with self._lock:
+                self._resident[model] = None
+                while len(self._resident) > self.max_loaded:
+                    self._resident.popitem(last=False)
+                self.stats["loads"] += 1
+        return self.load_seconds
+
+    def generate(self, handler: _Handler, body: dict):
+        model = body.get("model") or self.models[0]
+        if body.get("prompt"):
+            handler._send_json(400, {"error": "the emulator only serves load and unload requests on /api/generate"})
+            return
+        answer = {"model": model, "created_at": _now(), "response": "", "done": True}
+        if body.get("keep_alive") in (0, "0", "0s"):
+            with self._lock:
+                if model in self._resident:
+                    del self._resident[model]
+                    self.stats["unloads"] += 1
+            handler._send_json(200, dict(answer, done_reason="unload"))
+            return
+        load = self._ensure_loaded(model)
+        handler._send_json(200, dict(answer, done_reason="load", total_duration=int(load * 1e9),
+                                     load_duration=int(load * 1e9)))
+
+    def _synthetic_answer(self, messages: List[Tuple[str, str]], format) -> Optional[str]:
+        try:
+            moves = format["properties"]["best_move"]["items"]["properties"]["move"]["enum"]
+        except (KeyError, TypeError):
+            match = _LEGAL_MOVES.search("\n".join(content for _, content in messages))
+            moves = match.group(1).split() if match else []
+        if not moves:
+            return None
+        candidates = self._random.sample(moves, min(3, len(moves)))
+        return json.dumps({"candidate_moves": [{"move": move, "explanation": "Synthetic answer."} for move in candidates],
+                           "best_move": [{"move": candidates[0], "explanation": "Synthetic answer."}]})
+
+    def _lookup(self, body: dict) -> Tuple[Optional[dict], bool]:
+        messages = [(message.get("role"), message.get("content", "")) for message in body.get("messages", [])]
+        format = body.get("format") or None
+        key = request_key(messages, format)
+        with self._lock:
+            self.stats["requests"] += 1
+            entries = self.exchanges.get(key)
+            if entries:
+                cursor = self._cursors.get(key, 0)
+                self._cursors[key] = cursor + 1
+                self.stats["hits"] += 1
+                return entries[cursor % len(entries)], True
+            self.stats["misses"] += 1
+        content = self._synthetic_answer(messages, format) if self.synthesize_misses else None
+        if content is None:
+            return None, False
+        return {"content": content, "metadata": {}, "seconds": None}, False
+
+    def chat(self, handler: _Handler, body: dict):
+        entry, hit = self._lookup(body)
+        if entry is None:
+            with self._lock:
+                self.stats["not_found"] += 1
+            handler._send_json(404, {"error": "no recorded exchange for this request"})
+            return
+        start = time.perf_counter()
+        with self._slots:
+            queue_wait = time.perf_counter() - start
+            with self._lock:
+                self._in_flight += 1
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+            try:
+                load = self._ensure_loaded(body.get("model") or self.models[0])
+                with self._lock:
+                    latency = self.latency.sample(entry["seconds"], self.population)
+                self._respond(handler, body, entry, latency, load)
+            except _ClientGone:
+                with self._lock:
+                    self.stats["cancelled"] += 1
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+        with self._lock:
+            self.queue_waits.append(queue_wait)
+            self.latencies.append(time.perf_counter() - start)
+
+    def _respond(self, handler: _Handler, body: dict, entry: dict, latency: float, load: float = 0.0):
+        content, metadata = entry["content"], entry["metadata"]
+        model = body.get("model") or entry.get("model") or self.models[0]
+        # Keep the recorded split between prompt evaluation and generation.
+        prompt_ns, eval_ns = metadata.get("prompt_eval_duration", 0), metadata.get("eval_duration", 0)
+        prompt_share = prompt_ns / (prompt_ns + eval_ns) if prompt_ns + eval_ns else 0.3
+        prompt_chars = sum(len(message.get("content", "")) for message in body.get("messages", []))
+        final = {"model": model, "created_at": _now(), "done": True, "done_reason": "stop",
+                 "total_duration": int((load + latency) * 1e9), "load_duration": int(load * 1e9),
+                 "prompt_eval_count": metadata.get("prompt_eval_count", prompt_chars // 4),
+                 "prompt_eval_duration": int(latency * prompt_share * 1e9),
+                 "eval_count": metadata.get("eval_count", len(content) // 4),
+                 "eval_duration": int(latency * (1 - prompt_share) * 1e9)}
+        if not body.get("stream", True):
+            time.sleep(latency)
+            handler._send_json(200, {**final, "message": {"role": "assistant", "content": content}})
+            return
+        pieces = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)] or [""]
+        handler.start_stream()
+        time.sleep(latency * prompt_share)
+        per_piece = latency * (1 - prompt_share) / len(pieces)
+        for piece in pieces:
+            time.sleep(per_piece)
+            handler.send_line({"model": model, "created_at": _now(),
+                               "message": {"role": "assistant", "content": piece}, "done": False})
+        handler.send_line({**final, "message": {"role": "assistant", "content": ""}})
+        handler.end_stream()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            latencies, waits = list(self.latencies), list(self.queue_waits)
+            stats = dict(self.stats)
+        stats.update({"slots": self.slots, "resident": self.resident_models(), "hit_rate": stats["hits"] / stats["requests"] if stats["requests"] else 0.0,
+                      "latency_p50": _percentile(latencies, 0.50), "latency_p95": _percentile(latencies, 0.95),
+                      "latency_p99": _percentile(latencies, 0.99), "latency_max": max(latencies, default=0.0),
+                      "queue_wait_mean": sum(waits) / len(waits) if waits else 0.0,
+                      "queue_wait_p95": _percentile(waits, 0.95)})
+        return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Serve recorded LLM exchanges over Ollama's HTTP API.")
+    parser.add_argument("--store", default=None, help="ReplayStore SQLite file recorded with --record-llm.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", default="recorded",
+                        help="recorded[:scale], empirical[:scale], fixed:S or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--slots", type=int, default=1, help="Parallel requests served (OLLAMA_NUM_PARALLEL).")
+    parser.add_argument("--model", action="append", default=None, help="Model names listed by /api/tags.")
+    parser.add_argument("--load-seconds", type=float, default=0.0,
+                        help="Simulated time to load a model that is not resident.")
+    parser.add_argument("--max-loaded", type=int, default=1, help="Models resident at once (OLLAMA_MAX_LOADED_MODELS).")
+    parser.add_argument("--no-synthesize", action="store_true", help="Answer 404 instead of synthesizing misses.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    configure_logging(logging.INFO)
+
+    emulator = OllamaEmulator(args.store, latency=LatencyModel.parse(args.latency, seed=args.seed), slots=args.slots,
+                              models=args.model, synthesize_misses=not args.no_synthesize,
+                              host=args.host, port=args.port, seed=args.seed, load_seconds=args.load_seconds,
+                              max_loaded=args.max_loaded)
+    print(f"> Ollama emulator on {emulator.base_url} ({len(emulator.population)} recorded exchanges)")
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.server.server_close()
+        print(json.dumps(emulator.get_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
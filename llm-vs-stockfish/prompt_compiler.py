@@ -0,0 +1,74 @@
+# %%
+from typing import List, Optional
+
+import chess
+from langchain_core.prompts import ChatPromptTemplate
+
+
+class PromptCompiler:
+    """Builds the per-ply prompt so that consecutive prompts share the longest possible prefix.
+
+    The template and the parser's format instructions are compiled once. Everything that never
+    changes during a game comes first (system message, board guide, format instructions, PGN
+    header); then the move history, which only grows; the board and the legal moves come last.
+    Ollama can therefore reuse its KV cache for everything up to the newest move.
+
+    The history is rendered incrementally from the board's move stack. When the estimated prompt
+    size exceeds `token_budget`, the oldest moves are cut in steps of a quarter of the budget, so
+    the truncated history stays a stable prefix for several plies instead of shifting every move.
+    """
+
+    def __init__(self, system_text: str, turn_text: str, format_instructions: str,
+                 token_budget: Optional[int] = None, chars_per_token: float = 4.0):
+        self.template = ChatPromptTemplate.from_messages([("system", system_text), ("human", turn_text)])
+        self.template = self.template.partial(format_instructions=format_instructions)
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.truncations = 0
+        self._rendered: List[str] = []
+        self._start = 0
+        self._history = ""
+
+    def estimate_tokens(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token)
+
+    def calibrate(self, prompt: str, prompt_tokens: int):
+        # The server's prompt_eval_count is the real token count; keep a running chars/token ratio.
+        if prompt_tokens > 0:
+            self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * (len(prompt) / prompt_tokens)
+
+    def _render_history(self, move_stack: List[chess.Move]) -> str:
+        if len(move_stack) < len(self._rendered):
+            # A new game: start over.
+            self._rendered, self._start, self._history = [], 0, ""
+        for ply in range(len(self._rendered), len(move_stack)):
+            number = f"{ply // 2 + 1}. " if ply % 2 == 0 else ""
+            self._rendered.append(f"{number}{move_stack[ply].uci()} ")
+            if ply >= self._start:
+                self._history += self._rendered[-1]
+        return self._history
+
+    def _truncate(self, fixed_tokens: int):
+        history_budget = self.token_budget - fixed_tokens
+        step = max(self.token_budget // 4, 1)
+        while self._start < len(self._rendered) and self.estimate_tokens(self._history) > history_budget:
+            freed = 0
+            while self._start < len(self._rendered) and freed < step:
+                freed += self.estimate_tokens(self._rendered[self._start]) or 1
+                self._start += 1
+            # Always cut on a white move so the move numbers stay readable.
+            if self._start % 2 and self._start < len(self._rendered):
+                self._start += 1
+            self._history = "".join(self._rendered[self._start:])
+            self.truncations += 1
+
+    def _history_text(self) -> str:
+        return ("[...] " if self._start else "") + self._history
+
+    def compile(self, move_stack: List[chess.Move], **variables) -> str:
+        history = self._render_history(move_stack)
+        prompt = self.template.format(movement_history=self._history_text(), **variables)
+        if self.token_budget is not None and self.estimate_tokens(prompt) > self.token_budget:
+            self._truncate(self.estimate_tokens(prompt) - self.estimate_tokens(history))
+            prompt = self.template.format(movement_history=self._history_text(), **variables)
+        return prompt
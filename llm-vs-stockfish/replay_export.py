@@ -0,0 +1,375 @@
+# %%
+# Export stored games as self-contained replay files: an HTML page with a small player, or an SVG that
+# animates itself (SMIL) in any browser or image viewer that supports it. Each file holds the board
+# and piece graphics once; frames only list the squares a move changed.
+import html
+import json
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import chess
+import chess.svg
+
+from game_record import GameRecord, unpack_move
+
+SQUARE_SIZE = 45
+MARGIN = 15
+BOARD_SIZE = 2 * MARGIN + 8 * SQUARE_SIZE
+LASTMOVE_FILL = "#cdd16a"
+HOLD_FRAMES = 4  # the final position stays up this many frames before an animated SVG loops
+FORMATS = ("html", "svg")
+
+# Square changes of one ply: (square, piece symbol before, piece symbol after), "" for an empty square.
+Change = Tuple[int, str, str]
+
+
+class Frames(NamedTuple):
+    start: Dict[int, str]
+    changes: List[List[Change]]
+    moves: List[Tuple[int, int]]
+    sans: List[str]
+
+
+class ReplayAssets:
+    """Board background and piece definitions for one orientation, rendered once and reused."""
+
+    def __init__(self, flipped: bool = False):
+        self.flipped = flipped
+        svg = chess.svg.board(chess.BaseBoard.empty(), flipped=flipped)
+        # Keep what chess.svg draws after its (empty) defs: border, coordinates and the 64 squares.
+        match = re.search(r"<defs\s*/>(.*)</svg>\s*$", svg, re.S)
+        if match is None:
+            raise ValueError("Unexpected chess.svg board layout")
+        self.board = match.group(1)
+        self.defs = "".join(chess.svg.PIECES[symbol] for symbol in chess.svg.PIECES) + '<g id="empty" />'
+
+    def square_xy(self, square: int) -> Tuple[int, int]:
+        file, rank = chess.square_file(square), chess.square_rank(square)
+        if self.flipped:
+            return MARGIN + (7 - file) * SQUARE_SIZE, MARGIN + rank * SQUARE_SIZE
+        return MARGIN + file * SQUARE_SIZE, MARGIN + (7 - rank) * SQUARE_SIZE
+
+
+# One set of assets per orientation and worker process.
+_assets: Dict[bool, ReplayAssets] = {}
+
+
+def get_assets(flipped: bool = False) -> ReplayAssets:
+    if flipped not in _assets:
+        _assets[flipped] = ReplayAssets(flipped)
+    return _assets[flipped]
+
+
+def piece_href(symbol: str) -> str:
+    if not symbol:
+        return "#empty"
+    return f"#{chess.COLOR_NAMES[symbol.isupper()]}-{chess.PIECE_NAMES[chess.PIECE_SYMBOLS.index(symbol.lower())]}"
+
+
+def game_frames(record: GameRecord, with_san: bool = True) -> Frames:
+    """The start position and, for every ply, only the squares its move changed."""
+    board = chess.Board(record.start_fen)
+    start = {square: piece.symbol() for square, piece in board.piece_map().items()}
+    changes, moves, sans = [], [], []
+    for code in record.moves:
+        move = unpack_move(code)
+        touched = {move.from_square, move.to_square}
+        if board.is_castling(move):
+            touched.update(chess.SquareSet(chess.BB_RANKS[chess.square_rank(move.from_square)]))
+        elif board.is_en_passant(move):
+            touched.add(chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)))
+        before = {square: board.piece_at(square) for square in touched}
+        if with_san:
+            sans.append(board.san(move))
+        board.push(move)
+        ply_changes = []
+        for square in sorted(touched):
+            old, new = before[square], board.piece_at(square)
+            if old != new:
+                ply_changes.append((square, old.symbol() if old else "", new.symbol() if new else ""))
+        changes.append(ply_changes)
+        moves.append((move.from_square, move.to_square))
+    return Frames(start, changes, moves, sans)
+
+
+def _caption(meta: dict) -> str:
+    parts = [f"game {meta['id']}" if meta.get("id") is not None else None,
+             f"{meta['model_name']} ({meta['llm_color']})" if meta.get("model_name") else None,
+             f"temp {meta['llm_temp']:g}" if meta.get("llm_temp") is not None else None,
+             f"Stockfish {meta['stockfish_elo']}" if meta.get("stockfish_elo") is not None else None,
+             meta.get("result"),
+             f"adjudicated: {meta['adjudication']}" if meta.get("adjudication") else None]
+    return " · ".join(part for part in parts if part)
+
+
+def _svg_open() -> str:
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+            f'viewBox="0 0 {BOARD_SIZE} {BOARD_SIZE}">')
+
+
+def _key_times(times: List[int], total: int) -> str:
+    return ";".join(f"{time / total:.6g}" for time in times)
+
+
+def render_svg(record: GameRecord, meta: Optional[dict] = None, frame_seconds: float = 0.5,
+               flipped: bool = False) -> str:
+    """A looping SMIL animation of the game: one <use> per square that ever holds a piece, each with a
+    discrete animation listing only the frames at which that square changes."""
+    assets = get_assets(flipped)
+    frames = game_frames(record, with_san=False)
+    total = len(frames.changes) + 1 + HOLD_FRAMES
+    duration = f"{total * frame_seconds:.3f}s"
+
+    timelines: Dict[int, List[Tuple[int, str]]] = {square: [(0, symbol)] for square, symbol in frames.start.items()}
+    for ply, ply_changes in enumerate(frames.changes, start=1):
+        for square, old, new in ply_changes:
+            timelines.setdefault(square, [(0, "")]).append((ply, new))
+
+    parts = [_svg_open(), f"<title>{html.escape(_caption(meta or {}))}</title>",
+             f"<defs>{assets.defs}</defs>", assets.board]
+    if frames.moves:
+        for end in (0, 1):
+            xs, ys = zip(*(assets.square_xy(move[end]) for move in frames.moves))
+            times = _key_times([0] + list(range(1, len(frames.moves) + 1)), total)
+            parts.append(
+                f'<rect width="{SQUARE_SIZE}" height="{SQUARE_SIZE}" fill="{LASTMOVE_FILL}" fill-opacity="0.8" '
+                f'visibility="hidden">'
+                f'<animate attributeName="x" calcMode="discrete" values="0;{";".join(map(str, xs))}" '
+                f'keyTimes="{times}" dur="{duration}" repeatCount="indefinite" />'
+                f'<animate attributeName="y" calcMode="discrete" values="0;{";".join(map(str, ys))}" '
+                f'keyTimes="{times}" dur="{duration}" repeatCount="indefinite" />'
+                f'<animate attributeName="visibility" calcMode="discrete" values="hidden;visible" '
+                f'keyTimes="0;{1 / total:.6g}" dur="{duration}" repeatCount="indefinite" /></rect>')
+    for square in sorted(timelines):
+        timeline = timelines[square]
+        x, y = assets.square_xy(square)
+        use = f'<use xlink:href="{piece_href(timeline[0][1])}" transform="translate({x}, {y})"'
+        if len(timeline) == 1:
+            parts.append(use + " />")
+            continue
+        parts.append(f'{use}><animate attributeName="xlink:href" calcMode="discrete" '
+                     f'values="{";".join(piece_href(symbol) for _, symbol in timeline)}" '
+                     f'keyTimes="{_key_times([ply for ply, _ in timeline], total)}" dur="{duration}" '
+                     f'repeatCount="indefinite" /></use>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+_PLAYER_JS = """
+(function () {
+  var root = document.getElementById(%(uid)s), data = %(data)s;
+  var uses = {}, ply = 0, timer = null;
+  root.querySelectorAll("use[data-sq]").forEach(function (use) { uses[use.getAttribute("data-sq")] = use; });
+  var slider = root.querySelector("input"), label = root.querySelector(".ply");
+  var marks = root.querySelectorAll("rect.lastmove"), moves = root.querySelectorAll(".moves span");
+  function href(symbol) { return symbol ? "#" + data.names[symbol] : "#empty"; }
+  function apply(changes, forward) {
+    changes.forEach(function (change) {
+      var use = uses[change[0]], target = href(forward ? change[2] : change[1]);
+      use.setAttribute("href", target);
+      use.setAttributeNS("http://www.w3.org/1999/xlink", "xlink:href", target);
+    });
+  }
+  function show(target) {
+    target = Math.max(0, Math.min(data.changes.length, target));
+    while (ply < target) { apply(data.changes[ply], true); ply++; }
+    while (ply > target) { ply--; apply(data.changes[ply], false); }
+    marks.forEach(function (mark, end) {
+      var xy = ply ? data.xy[data.moves[ply - 1][end]] : null;
+      mark.setAttribute("visibility", xy ? "visible" : "hidden");
+      if (xy) { mark.setAttribute("x", xy[0]); mark.setAttribute("y", xy[1]); }
+    });
+    moves.forEach(function (move, i) { move.className = i === ply - 1 ? "current" : ""; });
+    slider.value = ply;
+    label.textContent = ply + " / " + data.changes.length;
+  }
+  function stop() { clearInterval(timer); timer = null; }
+  function play() {
+    if (timer) { stop(); return; }
+    if (ply === data.changes.length) show(0);
+    timer = setInterval(function () { if (ply === data.changes.length) stop(); else show(ply + 1); },
+                        data.frame_ms);
+  }
+  root.querySelector(".play").onclick = play;
+  root.querySelector(".prev").onclick = function () { stop(); show(ply - 1); };
+  root.querySelector(".next").onclick = function () { stop(); show(ply + 1); };
+  slider.oninput = function () { stop(); show(parseInt(slider.value, 10)); };
+  moves.forEach(function (move, i) { move.onclick = function () { stop(); show(i + 1); }; });
+  root.tabIndex = 0;
+  root.onkeydown = function (event) {
+    if (event.key === "ArrowLeft") { stop(); show(ply - 1); }
+    else if (event.key === "ArrowRight") { stop(); show(ply + 1); }
+    else if (event.key === " ") { event.preventDefault(); play(); }
+  };
+  show(0);
+})();
+"""
+
+_PLAYER_CSS = """
+.replay { font-family: sans-serif; max-width: 420px; outline: none; }
+.replay svg { width: 100%%; }
+.replay .controls { display: flex; gap: 4px; align-items: center; }
+.replay .controls input { flex: 1; }
+.replay .moves { font-size: 13px; line-height: 1.6; }
+.replay .moves span { cursor: pointer; padding: 0 2px; }
+.replay .moves span.current { background: %s; }
+""" % LASTMOVE_FILL
+
+
+def replay_html(record: GameRecord, meta: Optional[dict] = None, frame_seconds: float = 0.5,
+                flipped: bool = False) -> str:
+    """An HTML fragment (board, controls, move list and player script) replaying one game."""
+    assets = get_assets(flipped)
+    frames = game_frames(record)
+    uid = f"replay-{uuid.uuid4().hex[:12]}"
+    uses = "".join(f'<use data-sq="{square}" href="{piece_href(frames.start.get(square, ""))}" '
+                   f'xlink:href="{piece_href(frames.start.get(square, ""))}" transform="translate({x}, {y})" />'
+                   for square in chess.SQUARES for x, y in [assets.square_xy(square)])
+    marks = "".join(f'<rect class="lastmove" width="{SQUARE_SIZE}" height="{SQUARE_SIZE}" fill="{LASTMOVE_FILL}" '
+                    f'fill-opacity="0.8" visibility="hidden" />' for _ in range(2))
+    board_color = chess.Board(record.start_fen).turn
+    move_list = []
+    for ply, san in enumerate(frames.sans):
+        mover = board_color if ply % 2 == 0 else not board_color
+        number = (ply + (0 if board_color == chess.WHITE else 1)) // 2 + 1
+        prefix = f"{number}. " if mover == chess.WHITE else (f"{number}... " if ply == 0 else "")
+        move_list.append(f"<span>{prefix}{html.escape(san)}</span>")
+    data = {"changes": frames.changes, "moves": frames.moves, "frame_ms": int(frame_seconds * 1000),
+            "xy": [assets.square_xy(square) for square in chess.SQUARES],
+            "names": {symbol: piece_href(symbol)[1:] for symbol in chess.svg.PIECES}}
+    script = _PLAYER_JS % {"uid": json.dumps(uid), "data": json.dumps(data, separators=(",", ":"))}
+    return (f'<div class="replay" id="{uid}"><style>{_PLAYER_CSS}</style>'
+            f'<div class="caption">{html.escape(_caption(meta or {}))}</div>'
+            f'{_svg_open()}<defs>{assets.defs}</defs>{assets.board}{marks}{uses}</svg>'
+            f'<div class="controls"><button class="prev">&#9664;</button><button class="play">&#9654;/&#10074;&#10074;'
+            f'</button><button class="next">&#9654;</button><input type="range" min="0" max="{len(frames.changes)}" '
+            f'value="0" /><span class="ply"></span></div>'
+            f'<div class="moves">{" ".join(move_list)}</div><script>{script}</script></div>')
+
+
+def render_html(record: GameRecord, meta: Optional[dict] = None, frame_seconds: float = 0.5,
+                flipped: bool = False) -> str:
+    title = html.escape(_caption(meta or {}) or "Replay")
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title></head><body>'
+            f'{replay_html(record, meta, frame_seconds, flipped)}</body></html>\n')
+
+
+def game_meta(row: dict) -> dict:
+    return {"id": row.get("id"), "model_name": row.get("LLM_model_name"), "llm_color": row.get("LLM_color"),
+            "llm_temp": row.get("LLM_temp"), "stockfish_elo": row.get("Stockfish_elo"), "winner": row.get("Win"),
+            "result": row.get("Result"), "adjudication": row.get("Adjudication"),
+            "plies": len(row["Game_record"])}
+
+
+def export_game(job: Tuple[GameRecord, dict, str, str, float, bool]) -> Tuple[int, str, int]:
+    """Render one game and write it to `path` (through a temporary file); returns (id, path, bytes)."""
+    record, meta, path, fmt, frame_seconds, flipped = job
+    render = render_svg if fmt == "svg" else render_html
+    body = render(record, meta, frame_seconds, flipped).encode()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    return meta["id"], path, len(body)
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_index(out_dir: str, entries: List[Tuple[dict, str]]):
+    """index.html linking every exported game with its configuration and result."""
+    rows = []
+    for meta, filename in entries:
+        outcome = "draw" if meta["winner"] is None else ("win" if meta["winner"] == meta["llm_color"] else "loss")
+        cells = [meta["model_name"], meta["llm_color"], meta["llm_temp"], meta["stockfish_elo"], outcome,
+                 meta["result"], meta["adjudication"], meta["plies"]]
+        rows.append(f'<tr><td><a href="{html.escape(filename)}">{meta["id"]}</a></td>'
+                    + "".join(f"<td>{html.escape('' if cell is None else str(cell))}</td>" for cell in cells) + "</tr>")
+    header = "".join(f"<th>{name}</th>" for name in ("game", "model", "LLM color", "temp", "Stockfish Elo", "LLM",
+                                                     "result", "adjudication", "plies"))
+    with open(os.path.join(out_dir, "index.html"), "w") as f:
+        f.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Replays</title></head><body>'
+                f'<table><tr>{header}</tr>{"".join(rows)}</table></body></html>\n')
+
+
+def export_store(store_path: str, out_dir: str, fmt: str = "html", workers: int = 4, frame_seconds: float = 0.5,
+                 orientation: str = "white", overwrite: bool = False, batch_games: int = 256, **filters) -> dict:
+    """Export the stored games matching `filters` into `out_dir`, one file per game plus index.html.
+
+    Games already exported are skipped unless `overwrite` is set. With more than one worker games are
+    rendered in a process pool; workers write their files themselves.
+    """
+    from experiment_store import ExperimentStore
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    os.makedirs(out_dir, exist_ok=True)
+    store = ExperimentStore(store_path)
+    stats = {"games": 0, "exported": 0, "skipped": 0, "bytes": 0}
+    entries = []
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for chunk in _chunks(store.iter_games(**filters), batch_games):
+            jobs = []
+            for row in chunk:
+                meta = game_meta(row)
+                filename = f"game_{meta['id']:06d}.{fmt}"
+                entries.append((meta, filename))
+                path = os.path.join(out_dir, filename)
+                if not overwrite and os.path.exists(path):
+                    stats["skipped"] += 1
+                    continue
+                flipped = orientation == "black" or (orientation == "llm" and meta["llm_color"] == "Black")
+                jobs.append((row["Game_record"], meta, path, fmt, frame_seconds, flipped))
+            results = (executor.map(export_game, jobs, chunksize=max(1, len(jobs) // (4 * workers)))
+                       if executor is not None else map(export_game, jobs))
+            for _, _, size in results:
+                stats["exported"] += 1
+                stats["bytes"] += size
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        store.close()
+    stats["games"] = len(entries)
+    write_index(out_dir, entries)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Export stored games as self-contained HTML or animated SVG replays.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--store", default="ChessGameExperiment.sqlite")
+    parser.add_argument("--format", choices=FORMATS, default="html")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--frame-seconds", type=float, default=0.5)
+    parser.add_argument("--orientation", choices=("white", "black", "llm"), default="white",
+                        help="Side shown at the bottom; `llm` puts the LLM's pieces there.")
+    parser.add_argument("--overwrite", action="store_true", help="Re-export games already in the output directory.")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--elo", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stats = export_store(args.store, args.out_dir, fmt=args.format, workers=args.workers,
+                         frame_seconds=args.frame_seconds, orientation=args.orientation, overwrite=args.overwrite,
+                         model_name=args.model, stockfish_elo=args.elo)
+    print(f"> {stats['exported']} games exported ({stats['bytes'] / 1e6:.1f} MB), {stats['skipped']} already there, "
+          f"in {time.perf_counter() - start:.1f}s -> {os.path.join(args.out_dir, 'index.html')}")
+
+
+if __name__ == "__main__":
+    main()
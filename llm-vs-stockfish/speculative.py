@@ -0,0 +1,231 @@
+# %%
+import asyncio
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import chess
+from stockfish import Stockfish
+
+from engine_pool import EngineKey, EnginePool
+from game_events import emit, get_logger
+from instrumentation import Tracer
+from model_residency import new_load_stats
+from move_normalizer import new_repair_stats
+
+logger = get_logger("speculative")
+
+STAT_KEYS = ("turns", "speculated_turns", "launched", "hits", "misses", "wasted", "cancelled",
+             "predict_time", "time_ahead")
+
+
+class _DeferredHits:
+    """The player's LLM cache as seen by a speculative clone.
+
+    Lookups and stores go to the shared cache, but `confirm_hit` is only recorded: the hit counts
+    (with its tokens and seconds saved) when `_merge` replays it for the kept turn, not for the
+    discarded ones.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.confirmed: List[str] = []
+
+    def confirm_hit(self, key: str):
+        self.confirmed.append(key)
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+
+class SpeculativeLLM:
+    """Starts the LLM's answers to Stockfish's most likely moves while the real search is running.
+
+    A shallow, full-strength predictor engine lists White's top `k` moves (MultiPV). For each one the
+    LLM answers the resulting position on a copy of the player, in a thread (`launch`) or a task
+    (`alaunch`). When the real move lands, `take` keeps the matching answer and cancels the others:
+    queued inferences never start, async and streaming ones are aborted, blocking ones finish and are
+    discarded. Every discarded inference that did start counts as wasted; once `max_wasted` have been
+    wasted in a game, speculation stops until the next game.
+
+    With a `pool`, the predictor is checked out of it under its own EngineKey (full strength, MultiPV
+    `k`) and stays warm for the next game after `close`.
+    """
+
+    def __init__(self, predictor_path: str, k: int = 2, depth: int = 8, max_wasted: Optional[int] = None,
+                 pool: Optional[EnginePool] = None):
+        self.k = k
+        self.depth = depth
+        self.max_wasted = max_wasted
+        self.pool = pool
+        self.engine_key = EngineKey(predictor_path, elo=None, depth=depth, multipv=k)
+        if pool is not None:
+            self.predictor = pool.checkout(self.engine_key)
+        else:
+            self.predictor = Stockfish(path=predictor_path, depth=depth, parameters={"MultiPV": k})
+        self.executor = ThreadPoolExecutor(max_workers=k, thread_name_prefix="speculative-llm")
+        self.stats = {key: 0 for key in STAT_KEYS}
+        self.stats["predict_time"] = self.stats["time_ahead"] = 0.0
+        self._pending: Dict[str, tuple] = {}
+        self._wasted_in_game = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.max_wasted is not None and self._wasted_in_game >= self.max_wasted
+
+    def predict(self, board: chess.Board) -> List[str]:
+        start = time.perf_counter()
+        self.predictor.set_fen_position(board.fen(), send_ucinewgame_token=False)
+        moves = [line["Move"] for line in self.predictor.get_top_moves(self.k) if line.get("Move")]
+        self.stats["predict_time"] += time.perf_counter() - start
+        return moves
+
+    def _fork(self, manager, move: str):
+        """A copy of the LLM player set up for the position after White plays `move`."""
+        player = manager.llm_player
+        board = manager.board.copy()
+        board.push_uci(move)
+        if board.is_game_over():
+            return None
+        clone = copy.copy(player)
+        clone.history = []
+        clone.retry_stats = {key: 0 for key in player.retry_stats}
+        clone.repair_stats = new_repair_stats()
+        clone.prompt_stats = {key: 0 for key in player.prompt_stats}
+        clone.load_stats = new_load_stats()
+        clone._normalizer = None
+        clone.cancel_event = threading.Event()
+        if player.cache is not None:
+            clone.cache = _DeferredHits(player.cache)
+        # Spans of a discarded inference are dropped with it; the kept one's are merged in _merge.
+        if player.tracer.enabled:
+            clone.tracer = Tracer(**player.tracer.labels)
+            clone.tracer.ply = len(board.move_stack)
+        if player.compiler is not None:
+            clone.compiler = copy.copy(player.compiler)
+            clone.compiler._rendered = list(player.compiler._rendered)
+        manager.set_llm_position(clone, board, manager.move_history + [f"{manager.turn}. {move}"])
+        return clone
+
+    def _predicted_clones(self, manager, moves: List[str]) -> list:
+        clones = [(move, clone) for move, clone in ((move, self._fork(manager, move)) for move in moves)
+                  if clone is not None]
+        if clones:
+            self.stats["speculated_turns"] += 1
+            self.stats["launched"] += len(clones)
+        return clones
+
+    def launch(self, manager):
+        self.discard()
+        self.stats["turns"] += 1
+        if self.exhausted:
+            return
+        for move, clone in self._predicted_clones(manager, self.predict(manager.board)):
+            self._pending[move] = (self.executor.submit(clone.get_llm_best_move), clone, time.perf_counter())
+
+    async def alaunch(self, manager):
+        self.discard()
+        self.stats["turns"] += 1
+        if self.exhausted:
+            return
+        moves = await asyncio.to_thread(self.predict, manager.board.copy())
+        for move, clone in self._predicted_clones(manager, moves):
+            self._pending[move] = (asyncio.ensure_future(clone.aget_llm_best_move()), clone, time.perf_counter())
+
+    def _cancel(self, entries):
+        for future, clone, _ in entries:
+            clone.cancel_event.set()
+            if future.cancel() and not isinstance(future, asyncio.Future):
+                # Still queued in the thread pool: it never ran.
+                self.stats["cancelled"] += 1
+            else:
+                self.stats["wasted"] += 1
+                self._wasted_in_game += 1
+
+    def _split(self, manager):
+        played = manager.board.peek().uci() if manager.board.move_stack else None
+        hit = self._pending.pop(played, None)
+        others = list(self._pending.values())
+        self._pending.clear()
+        self._cancel(others)
+        if not others and hit is None:
+            return None
+        if hit is None:
+            self.stats["misses"] += 1
+            emit(logger, logging.DEBUG, "speculation_miss", played=played)
+            return None
+        self.stats["hits"] += 1
+        # How long the kept inference had already been running when the real move landed.
+        self.stats["time_ahead"] += time.perf_counter() - hit[2]
+        emit(logger, logging.DEBUG, "speculation_hit", played=played)
+        return hit
+
+    def take(self, manager) -> Optional[str]:
+        """The speculative answer for the position on the board, or None when the move wasn't predicted."""
+        hit = self._split(manager)
+        if hit is None:
+            return None
+        future, clone, _ = hit
+        try:
+            move = future.result()
+        except Exception as e:
+            emit(logger, logging.WARNING, "speculation_failed", error=repr(e))
+            return None
+        self._merge(manager.llm_player, clone)
+        return move
+
+    async def atake(self, manager) -> Optional[str]:
+        hit = self._split(manager)
+        if hit is None:
+            return None
+        task, clone, _ = hit
+        try:
+            move = await task
+        except Exception as e:
+            emit(logger, logging.WARNING, "speculation_failed", error=repr(e))
+            return None
+        self._merge(manager.llm_player, clone)
+        return move
+
+    @staticmethod
+    def _merge(player, clone):
+        player.history.extend(clone.history)
+        if player.tracer.enabled:
+            player.tracer.spans.extend(dict(span, speculative=True) for span in clone.tracer.spans)
+        for name in ("retry_stats", "repair_stats", "prompt_stats", "load_stats"):
+            totals = getattr(player, name)
+            for key, value in getattr(clone, name).items():
+                totals[key] += value
+        # The kept turn built its prompt on a copy of the compiler: adopt it, so the rendered history,
+        # truncation point, calibrated chars/token and truncation count carry on from that turn.
+        if clone.compiler is not None:
+            player.compiler = clone.compiler
+        if clone.cache is not None:
+            for key in clone.cache.confirmed:
+                player.cache.confirm_hit(key)
+
+    def discard(self):
+        """Cancel whatever is still pending (end of game, or a turn that never reached the LLM)."""
+        entries = list(self._pending.values())
+        self._pending.clear()
+        self._cancel(entries)
+
+    def reset(self):
+        self.discard()
+        self._wasted_in_game = 0
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["hit_rate"] = stats["hits"] / stats["speculated_turns"] if stats["speculated_turns"] else 0.0
+        return stats
+
+    def close(self):
+        self.discard()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.pool is not None:
+            self.pool.release(self.engine_key, self.predictor)
+        else:
+            EnginePool._quit(self.predictor)
@@ -0,0 +1,96 @@
+# %%
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+_binary_hashes: Dict[Tuple[str, float, int], str] = {}
+
+
+def engine_binary_hash(path: str) -> str:
+    # Hash the executable itself so a Stockfish upgrade never replays moves from the old build.
+    stat = os.stat(path)
+    memo_key = (os.path.realpath(path), stat.st_mtime, stat.st_size)
+    if memo_key not in _binary_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _binary_hashes[memo_key] = digest.hexdigest()
+    return _binary_hashes[memo_key]
+
+
+def position_key(fen: str) -> str:
+    # Placement, side to move, castling and en passant: the halfmove/fullmove clocks don't change the search.
+    return " ".join(fen.split()[:4])
+
+
+class StockfishMoveCache:
+    """Best moves already searched, keyed by (engine binary, Elo, depth, position).
+
+    Elo-limited Stockfish picks moves randomly, so every observed move is counted. In "replay" mode the
+    most frequent move is returned straight away. In "resample" mode a position is searched until it has
+    `min_samples` observations, then moves are drawn from that empirical distribution.
+    """
+
+    MODES = ("replay", "resample")
+
+    def __init__(self, path: str = "stockfish_move_cache.sqlite", mode: str = "replay", min_samples: int = 8):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {self.MODES}.")
+        self.path = path
+        self.mode = mode
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS stockfish_moves (
+                                key BLOB NOT NULL,
+                                move TEXT NOT NULL,
+                                count INTEGER NOT NULL,
+                                PRIMARY KEY (key, move)) WITHOUT ROWID""")
+        self._db.commit()
+        self.stats = {"lookups": 0, "hits": 0, "searches": 0}
+
+    @staticmethod
+    def make_key(binary_hash: str, elo: int, depth: int, fen: str) -> bytes:
+        payload = f"{binary_hash}|{elo}|{depth}|{position_key(fen)}"
+        return hashlib.blake2b(payload.encode(), digest_size=16).digest()
+
+    def lookup(self, key: bytes) -> Optional[str]:
+        with self._lock:
+            self.stats["lookups"] += 1
+            rows = self._db.execute("SELECT move, count FROM stockfish_moves WHERE key = ? ORDER BY count DESC",
+                                    (key,)).fetchall()
+            if not rows:
+                return None
+            if self.mode == "replay":
+                move = rows[0][0]
+            elif sum(count for _, count in rows) >= self.min_samples:
+                move = random.choices([m for m, _ in rows], weights=[c for _, c in rows])[0]
+            else:
+                return None
+            self.stats["hits"] += 1
+            return move
+
+    def record(self, key: bytes, move: Optional[str]):
+        if move is None:
+            return
+        with self._lock:
+            self.stats["searches"] += 1
+            self._db.execute("""INSERT INTO stockfish_moves VALUES (?, ?, 1)
+                                ON CONFLICT (key, move) DO UPDATE SET count = count + 1""", (key, move))
+            self._db.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, hit_rate=self.hit_rate)
+
+    def close(self):
+        self._db.close()
@@ -1,43 +1,183 @@
 # %%
-from stockfish import Stockfish
-from pydantic import BaseModel, Field
+import asyncio
+import chess
+from stockfish import Stockfish, StockfishException
 import re
-from typing import List
+from typing import List, Optional
+from engine_pool import EngineKey, EnginePool, START_FEN
+from stockfish_cache import StockfishMoveCache, engine_binary_hash
+import logging
+from game_events import emit, get_logger
 
+logger = get_logger("stockfish")
+
+BACKENDS = ("stockfish", "async_uci")
+
+# Mate scores are folded into centipawns: mate in n is MATE_SCORE - n.
+MATE_SCORE = 100_000
+_INFO_SCORE = re.compile(r"score (cp|mate) (-?\d+)")
+
+
+def parse_info_score(info: str) -> Optional[int]:
+    match = _INFO_SCORE.search(info or "")
+    if match is None:
+        return None
+    kind, value = match.group(1), int(match.group(2))
+    if kind == "cp":
+        return value
+    return MATE_SCORE - value if value > 0 else -MATE_SCORE - value
 
 
 class StockfishPlayer:
-    def __init__(self, stockfish_path: str):
+    def __init__(self, stockfish_path: str, pool: Optional[EnginePool] = None, backend: str = "stockfish"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}.")
+        if backend == "async_uci" and pool is not None:
+            raise ValueError("The engine pool only manages the synchronous 'stockfish' backend.")
         self.stockfish_path = stockfish_path
         self.stockfish = None
         self.elo = None
-  
+        self.depth = None
+        self.pool = pool
+        self.backend = backend
+        self.engine_key: Optional[EngineKey] = None
+        self.current_fen = START_FEN
+        self.move_cache: Optional[StockfishMoveCache] = None
+        self._binary_hash: Optional[str] = None
+        # Centipawns for the side Stockfish moved for, from its last search (None after a cache hit).
+        self.last_score: Optional[int] = None
+
+    @property
+    def is_async(self) -> bool:
+        return self.backend == "async_uci"
+
     def init_stockfish(self,
                        set_elo_rating: int = 1000,
-                       set_depth: int = 15,):
-        self.stockfish = Stockfish(path=self.stockfish_path)
+                       set_depth: int = 15,
+                       hash_mb: int = 16,
+                       threads: int = 1):
         self.elo = set_elo_rating
-        self.stockfish.set_elo_rating(set_elo_rating)
-        self.stockfish.set_depth(set_depth)
-        print("> Stockfish is well initialized and have ELO of ", set_elo_rating)
-    
+        self.depth = set_depth
+        if self.is_async:
+            # The process is started lazily by the event loop that runs the first search. chess.engine
+            # is only imported by the async backend.
+            from uci_backend import AsyncUCIEngine
+            self.stockfish = AsyncUCIEngine(self.stockfish_path, set_elo_rating, set_depth, hash_mb, threads)
+        elif self.pool is not None:
+            self.engine_key = EngineKey(self.stockfish_path, set_elo_rating, set_depth, hash_mb, threads)
+            self.stockfish = self.pool.checkout(self.engine_key)
+        else:
+            self.stockfish = Stockfish(path=self.stockfish_path,
+                                       parameters={"Hash": hash_mb, "Threads": threads})
+            self.stockfish.set_elo_rating(set_elo_rating)
+            self.stockfish.set_depth(set_depth)
+        emit(logger, logging.DEBUG, "stockfish_ready", elo=set_elo_rating, depth=set_depth, backend=self.backend)
+
+    async def ainit_stockfish(self,
+                              set_elo_rating: int = 1000,
+                              set_depth: int = 15,
+                              hash_mb: int = 16,
+                              threads: int = 1):
+        if not self.is_async:
+            await asyncio.to_thread(self.init_stockfish, set_elo_rating, set_depth, hash_mb, threads)
+            return
+        self.init_stockfish(set_elo_rating, set_depth, hash_mb, threads)
+        await self.stockfish.start()
+
+    def enable_move_cache(self, cache: StockfishMoveCache):
+        self.move_cache = cache
+        self._binary_hash = engine_binary_hash(self.stockfish_path)
+
+    def _cache_key(self) -> Optional[bytes]:
+        if self.move_cache is None:
+            return None
+        return self.move_cache.make_key(self._binary_hash, self.elo, self.depth, self.current_fen)
+
     def set_position_with_fen(self, fen_position: str):
-        self.stockfish.set_fen_position(fen_position)
+        self.current_fen = fen_position
+        if not self.is_async:
+            self.stockfish.set_fen_position(fen_position, send_ucinewgame_token=False)
 
     def get_stockfish_best_move(self):
          self.color_turn = "white"
-         return self.stockfish.get_best_move()
-    
+         if self.is_async:
+             raise RuntimeError("The async_uci backend searches inside an event loop, use aget_stockfish_best_move().")
+         self.last_score = None
+         cache_key = self._cache_key()
+         if cache_key is not None:
+             move = self.move_cache.lookup(cache_key)
+             if move is not None:
+                 return move
+         try:
+             move = self.stockfish.get_best_move()
+         except StockfishException:
+             if self.pool is None:
+                 raise
+             # The pooled process crashed mid-game: swap in a fresh one and search again.
+             emit(logger, logging.WARNING, "stockfish_restart", fen=self.current_fen)
+             # If no new engine starts, the pool has freed the slot: don't release the dead one later.
+             dead, self.stockfish = self.stockfish, None
+             self.stockfish = self.pool.restart(self.engine_key, dead)
+             self.stockfish.set_fen_position(self.current_fen)
+             move = self.stockfish.get_best_move()
+         self.last_score = parse_info_score(self.stockfish.info)
+         if cache_key is not None:
+             self.move_cache.record(cache_key, move)
+         return move
+
+    async def aget_stockfish_best_move(self):
+        if not self.is_async:
+            return await asyncio.to_thread(self.get_stockfish_best_move)
+        self.color_turn = "white"
+        self.last_score = None
+        cache_key = self._cache_key()
+        if cache_key is not None:
+            move = self.move_cache.lookup(cache_key)
+            if move is not None:
+                return move
+        move = await self.stockfish.best_move(chess.Board(self.current_fen))
+        score = self.stockfish.last_info.get("score")
+        if score is not None:
+            self.last_score = score.relative.score(mate_score=MATE_SCORE)
+        if cache_key is not None:
+            self.move_cache.record(cache_key, move)
+        return move
+
     def get_params(self):
         return self.stockfish.get_parameters()
-    
+
     def get_board_visual(self, Boolean=True):
+        if self.is_async:
+            return str(chess.Board(self.current_fen))
         return self.stockfish.get_board_visual(Boolean)
-    
+
     def get_fen_position(self):
+         if self.is_async:
+             return self.current_fen
          return self.stockfish.get_fen_position()
-    
-        
+
+
     def reset_game(self):
-        self.stockfish.set_position()
-        print("--- GAME IS RESET ---")
\ No newline at end of file
+        self.current_fen = START_FEN
+        if self.is_async:
+            self.stockfish.new_game()
+        else:
+            self.stockfish.set_fen_position(START_FEN, send_ucinewgame_token=True)
+        emit(logger, logging.DEBUG, "stockfish_reset")
+
+    def release(self):
+        if self.stockfish is None:
+            return
+        if self.is_async:
+            raise RuntimeError("The async_uci backend must be closed from its event loop, use arelease().")
+        if self.pool is not None:
+            self.pool.release(self.engine_key, self.stockfish)
+        self.stockfish = None
+
+    async def arelease(self):
+        if not self.is_async:
+            self.release()
+            return
+        if self.stockfish is not None:
+            await self.stockfish.quit()
+            self.stockfish = None
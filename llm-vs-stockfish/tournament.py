@@ -0,0 +1,674 @@
+# %%
+import argparse
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from adjudication import REASONS, Adjudicator
+from game_events import configure_logging
+from instrumentation import NULL_TRACER, Tracer, format_summary, merge, to_prometheus, write_jsonl
+from model_residency import ModelResidency, summarize_load_stats
+
+
+class GameSpec(BaseModel):
+    model_name: str = Field(description="Ollama model played by the LLM, e.g. llama3.1:8b")
+    temperature: float = 0.1
+    stockfish_path: str = Field(description="Path to the Stockfish binary")
+    stockfish_elo: int = 1000
+    stockfish_depth: int = 15
+    stockfish_hash_mb: int = 16
+    stockfish_threads: int = 1
+    num_games: int = 1
+    num_moves: int = 50
+    llm_cache_path: Optional[str] = Field(default=None, description="SQLite file of cached LLM answers, off when None")
+    force_llm_cache: bool = Field(default=False, description="Use the LLM cache even when temperature > 0")
+    stockfish_cache_path: Optional[str] = Field(default=None, description="SQLite file of searched Stockfish moves, off when None")
+    stockfish_cache_mode: str = Field(default="replay", description="'replay' the most played cached move or 'resample' it")
+    stream_llm: bool = Field(default=False, description="Stream LLM answers and stop generating once best_move is read")
+    measure_full_generation: bool = Field(default=False, description="Read streams to the end to time full generations")
+    constrained_output: bool = Field(default=False, description="Restrict LLM answers to the legal moves with a JSON schema")
+    prompt_compiler: bool = Field(default=False, description="Build prefix-stable prompts with an append-only history")
+    prompt_token_budget: Optional[int] = Field(default=None, description="Truncate old history above this many prompt tokens")
+    speculative_k: int = Field(default=0, description="Predicted Stockfish moves answered speculatively by the LLM, off when 0")
+    speculative_depth: int = Field(default=8, description="Search depth of the engine predicting Stockfish's moves")
+    speculative_max_wasted: Optional[int] = Field(default=None, description="Stop speculating after this many wasted inferences in a game")
+    trace: bool = Field(default=False, description="Record per-ply timing spans")
+    ollama_base_url: Optional[str] = Field(default=None, description="Ollama server to use instead of the default one")
+    record_llm_path: Optional[str] = Field(default=None, description="ReplayStore file every LLM exchange is recorded to")
+    adjudicate_resign_cp: Optional[int] = Field(default=None, description="Resign when Stockfish's eval stays beyond this many centipawns, off when None")
+    adjudicate_resign_moves: int = Field(default=5, description="Consecutive Stockfish searches beyond the resign threshold")
+    adjudicate_draw_cp: Optional[int] = Field(default=None, description="Draw when the eval stays within this many centipawns, off when None")
+    adjudicate_draw_moves: int = Field(default=10, description="Consecutive Stockfish searches within the draw threshold")
+    adjudicate_draw_halfmoves: int = Field(default=20, description="Plies without a capture or pawn move required for a draw")
+    syzygy_path: Optional[str] = Field(default=None, description="Directory of Syzygy tablebases used to adjudicate endgames")
+    ollama_keep_alive: Optional[str] = Field(default=None, description="How long Ollama keeps the model loaded between requests, e.g. 30m")
+    prewarm_model: bool = Field(default=False, description="Load the model into Ollama before the first game starts")
+
+
+class GameResult(BaseModel):
+    game_index: int
+    wall_time: float
+    row: Optional[dict] = None
+    error: Optional[str] = None
+    engine_stats: Optional[dict] = None
+    llm_cache_stats: Optional[dict] = None
+    stockfish_cache_stats: Optional[dict] = None
+    llm_stream_stats: Optional[dict] = None
+    llm_retry_stats: Optional[dict] = None
+    llm_repair_stats: Optional[dict] = None
+    llm_prompt_stats: Optional[dict] = None
+    speculative_stats: Optional[dict] = None
+    trace_summary: Optional[dict] = None
+    trace_spans: Optional[List[dict]] = None
+    adjudication: Optional[dict] = None
+    llm_load_stats: Optional[dict] = None
+
+
+class TournamentReport(BaseModel):
+    spec: GameSpec
+    workers: int
+    wall_time: float
+    results: List[GameResult] = []
+    llm_stats: Optional[dict] = None
+    # Set when games share one cache concurrently and per-game deltas would overlap.
+    llm_cache_totals: Optional[dict] = None
+    stockfish_cache_totals: Optional[dict] = None
+    # Spans recorded by the tournament process itself (persistence).
+    tournament_trace: Optional[dict] = None
+
+    @property
+    def games_played(self) -> int:
+        return sum(1 for r in self.results if r.error is None)
+
+    @property
+    def games_per_hour(self) -> float:
+        return 3600 * self.games_played / self.wall_time if self.wall_time else 0.0
+
+    @property
+    def game_wall_times(self) -> List[float]:
+        return [r.wall_time for r in self.results if r.error is None]
+
+    def _cache_totals(self, name: str) -> Optional[dict]:
+        totals = getattr(self, f"{name}_totals")
+        if totals is None:
+            per_game = [getattr(r, f"{name}_stats") for r in self.results if getattr(r, f"{name}_stats")]
+            if not per_game:
+                return None
+            totals = {key: sum(stats[key] for stats in per_game) for key in per_game[0]}
+        totals = dict(totals)
+        totals["hit_rate"] = totals["hits"] / totals["lookups"] if totals["lookups"] else 0.0
+        return totals
+
+    @property
+    def llm_cache_stats(self) -> Optional[dict]:
+        return self._cache_totals("llm_cache")
+
+    @property
+    def stockfish_cache_stats(self) -> Optional[dict]:
+        return self._cache_totals("stockfish_cache")
+
+    @property
+    def engine_stats(self) -> Optional[dict]:
+        totals = self._summed_stats("engine_stats")
+        return {key: value for key, value in totals.items() if key not in POOL_GAUGES} if totals else None
+
+    @property
+    def llm_stream_stats(self) -> Optional[dict]:
+        from llm_streaming import merge_stream_stats
+        per_game = [r.llm_stream_stats for r in self.results if r.llm_stream_stats]
+        return merge_stream_stats(per_game) if per_game else None
+
+    def _summed_stats(self, name: str) -> Optional[dict]:
+        per_game = [getattr(r, name) for r in self.results if getattr(r, name)]
+        if not per_game:
+            return None
+        return {key: sum(stats[key] for stats in per_game) for key in per_game[0]}
+
+    @property
+    def llm_retry_stats(self) -> Optional[dict]:
+        return self._summed_stats("llm_retry_stats")
+
+    @property
+    def llm_repair_stats(self) -> Optional[dict]:
+        return self._summed_stats("llm_repair_stats")
+
+    @property
+    def llm_prompt_stats(self) -> Optional[dict]:
+        return self._summed_stats("llm_prompt_stats")
+
+    @property
+    def llm_load_stats(self) -> Optional[dict]:
+        totals = self._summed_stats("llm_load_stats")
+        return summarize_load_stats(totals) if totals and totals["calls"] else None
+
+    @property
+    def speculative_stats(self) -> Optional[dict]:
+        totals = self._summed_stats("speculative_stats")
+        if totals is not None:
+            totals["hit_rate"] = totals["hits"] / totals["speculated_turns"] if totals["speculated_turns"] else 0.0
+        return totals
+
+    @property
+    def adjudication_stats(self) -> Optional[dict]:
+        if not adjudication_enabled(self.spec):
+            return None
+        adjudicated = [r.adjudication for r in self.results if r.adjudication is not None]
+        stats = {"games": self.games_played, "adjudicated": len(adjudicated),
+                 "llm_moves_saved": sum(a["llm_moves_saved"] for a in adjudicated)}
+        for reason in REASONS:
+            stats[reason] = sum(a["reason"] == reason for a in adjudicated)
+        # Every LLM move costs attempts/moves inference calls on average (retries included).
+        retries = self.llm_retry_stats
+        per_move = retries["attempts"] / retries["moves"] if retries and retries["moves"] else 1.0
+        stats["inference_calls_saved"] = stats["llm_moves_saved"] * per_move
+        return stats
+
+    @property
+    def trace_summary(self) -> Optional[dict]:
+        summaries = [r.trace_summary for r in self.results if r.trace_summary]
+        if self.tournament_trace:
+            summaries.append(self.tournament_trace)
+        return merge(summaries) if summaries else None
+
+    def summary(self) -> str:
+        times = sorted(self.game_wall_times)
+        if times:
+            mean = sum(times) / len(times)
+            per_game = f"mean {mean:.1f}s, min {times[0]:.1f}s, max {times[-1]:.1f}s"
+        else:
+            per_game = "n/a"
+        failed = len(self.results) - self.games_played
+        summary = (f"{self.games_played} games ({failed} failed) with {self.workers} workers in {self.wall_time:.1f}s"
+                   f" -> {self.games_per_hour:.1f} games/hour, per-game wall time {per_game}")
+        cache = self.llm_cache_stats
+        if cache:
+            summary += (f"\nLLM cache: {cache['hits']}/{cache['lookups']} hits ({cache['hit_rate']:.0%}),"
+                        f" saved {cache['tokens_saved']} tokens and {cache['seconds_saved']:.1f}s of inference")
+        pool = self.engine_stats
+        if pool:
+            summary += (f"\nEngine pool: {pool['checkouts']} checkouts, {pool['created']} engines started,"
+                        f" {pool['reused']} reused, {pool['waits']} waits ({pool['wait_time']:.1f}s),"
+                        f" {pool['restarts']} restarts, {pool.get('inherited', 0)} inherited engines left alone")
+        cache = self.stockfish_cache_stats
+        if cache:
+            summary += f"\nStockfish cache: {cache['hits']}/{cache['lookups']} searches skipped ({cache['hit_rate']:.0%})"
+        retries = self.llm_retry_stats
+        if retries:
+            summary += (f"\nLLM retries: {retries['retries']} over {retries['moves']} moves"
+                        f" ({retries['retries'] / retries['moves'] if retries['moves'] else 0:.2f} per move),"
+                        f" {retries['random_fallbacks']} random fallbacks,"
+                        f" {retries['constrained_moves']} moves with constrained decoding")
+        repairs = self.llm_repair_stats
+        if repairs and any(repairs.values()):
+            summary += "\nLLM answers repaired: " + ", ".join(f"{count} {category}"
+                                                            for category, count in repairs.items() if count)
+        prompts = self.llm_prompt_stats
+        if prompts and prompts["measured"]:
+            summary += (f"\nLLM prompts: mean {prompts['prompt_tokens'] / prompts['measured']:.0f} tokens and"
+                        f" {prompts['prompt_eval_seconds'] / prompts['measured']:.2f}s of prompt evaluation per ply,"
+                        f" {prompts['truncations']} history truncations")
+        loads = self.llm_load_stats
+        if loads:
+            summary += f"\nModel loads: {loads['cold_calls']}/{loads['calls']} LLM calls hit a cold model"
+            if loads["cold_first_token_mean"] is not None:
+                summary += f" (first token mean {loads['cold_first_token_mean']:.2f}s, {loads['load_seconds']:.1f}s loading)"
+            if loads["warm_first_token_mean"] is not None:
+                summary += f", warm first token mean {loads['warm_first_token_mean']:.2f}s"
+        speculation = self.speculative_stats
+        if speculation:
+            summary += (f"\nSpeculation: {speculation['hits']}/{speculation['speculated_turns']} predicted turns hit"
+                        f" ({speculation['hit_rate']:.0%}), {speculation['launched']} inferences launched,"
+                        f" {speculation['wasted']} wasted, {speculation['cancelled']} cancelled before starting")
+        for model_name, stats in (self.llm_stream_stats or {}).items():
+            summary += f"\nLLM streaming {model_name}: {stats['early_stops']}/{stats['requests']} generations stopped early"
+            if stats["time_to_move_mean"] is not None:
+                summary += f", time to move mean {stats['time_to_move_mean']:.2f}s"
+            if stats["full_generation_mean"] is not None:
+                summary += f", full generation mean {stats['full_generation_mean']:.2f}s"
+            if stats["time_saved"] is not None:
+                summary += f" ({stats['time_saved']:.0%} saved)"
+        stats = self.adjudication_stats
+        if stats:
+            summary += (f"\nAdjudication: {stats['adjudicated']}/{stats['games']} games ended early "
+                        f"({', '.join(f'{reason} {stats[reason]}' for reason in REASONS)}), "
+                        f"{stats['llm_moves_saved']} LLM moves and ~{stats['inference_calls_saved']:.0f} "
+                        f"inference calls saved")
+        trace = self.trace_summary
+        if trace:
+            summary += "\nTiming spans:\n" + format_summary(trace)
+        return summary
+
+
+def game_row(game_manager) -> dict:
+    parser = game_manager.llm_player.parser
+    retry_stats = game_manager.llm_player.retry_stats
+    return {"Game_record": game_manager.game_record(),
+            "LLM_color": game_manager.llm_player.color,
+            "LLM_model_name": game_manager.llm_player.model_name,
+            "Win": game_manager.color_winner,
+            "Stockfish_elo": game_manager.stockfish_player.elo,
+            "Prompt_schema": str(game_manager.llm_player.prompt_schema),
+            "LLM_temp": game_manager.llm_player.temp,
+            "Parser_schema": parser.get_format_instructions() if parser is not None else None,
+            "Result": game_manager.result(),
+            "Adjudication": game_manager.adjudication.reason if game_manager.adjudication is not None else None,
+            "LLM_moves": retry_stats["moves"],
+            "LLM_attempts": retry_stats["attempts"],
+            "LLM_retries": retry_stats["retries"],
+            "LLM_random_fallbacks": retry_stats["random_fallbacks"],
+            }
+
+
+# One pool and one LLM cache per worker process: both stay warm between the games that worker plays.
+_engine_pool = None
+_llm_caches = {}
+_stockfish_caches = {}
+_replay_stores = {}
+
+
+def get_engine_pool():
+    global _engine_pool
+    if _engine_pool is None:
+        from engine_pool import EnginePool
+        _engine_pool = EnginePool(max_engines_per_key=1)
+    return _engine_pool
+
+
+def get_llm_cache(path: Optional[str]):
+    if path is None:
+        return None
+    if path not in _llm_caches:
+        from llm_cache import LLMMoveCache
+        _llm_caches[path] = LLMMoveCache(path)
+    return _llm_caches[path]
+
+
+def get_stockfish_cache(path: Optional[str], mode: str):
+    if path is None:
+        return None
+    if (path, mode) not in _stockfish_caches:
+        from stockfish_cache import StockfishMoveCache
+        _stockfish_caches[(path, mode)] = StockfishMoveCache(path, mode=mode)
+    return _stockfish_caches[(path, mode)]
+
+
+def get_replay_store(path: Optional[str]):
+    if path is None:
+        return None
+    if path not in _replay_stores:
+        from ollama_replay import ReplayStore
+        _replay_stores[path] = ReplayStore(path)
+    return _replay_stores[path]
+
+
+def cache_stats_delta(cache, before: Optional[dict]) -> Optional[dict]:
+    if cache is None:
+        return None
+    after = cache.get_stats()
+    return {key: value - before[key] for key, value in after.items() if key != "hit_rate"}
+
+
+# Engine pool figures that are levels rather than counters: reported as they stand after the game.
+POOL_GAUGES = ("engines", "idle")
+
+
+def engine_stats_delta(pool, before: dict) -> dict:
+    after = pool.get_stats()
+    return {key: value if key in POOL_GAUGES else value - before[key] for key, value in after.items()}
+
+
+def stream_stats(llm_player) -> Optional[dict]:
+    return llm_player.stream_stats.get_stats() if llm_player.stream_stats is not None else None
+
+
+def prompt_stats(llm_player) -> dict:
+    truncations = llm_player.compiler.truncations if llm_player.compiler is not None else 0
+    return dict(llm_player.prompt_stats, truncations=truncations)
+
+
+def configure_llm_player(llm_player, spec: GameSpec, cache):
+    if cache is not None:
+        llm_player.enable_cache(cache, force=spec.force_llm_cache)
+    if spec.stream_llm:
+        llm_player.enable_streaming(measure_full_generation=spec.measure_full_generation)
+    if spec.constrained_output:
+        llm_player.enable_constrained_output()
+    if spec.prompt_compiler:
+        llm_player.enable_prompt_compiler(token_budget=spec.prompt_token_budget)
+    if spec.record_llm_path is not None:
+        llm_player.enable_recording(get_replay_store(spec.record_llm_path))
+
+
+def make_tracer(spec: GameSpec, game_index: int):
+    return Tracer(game=game_index, model=spec.model_name) if spec.trace else None
+
+
+def record_result(report: TournamentReport, store, result: GameResult, tracer=NULL_TRACER,
+                  trace_jsonl: Optional[str] = None):
+    report.results.append(result)
+    if result.error is None:
+        with tracer.span("persistence"):
+            store.record_game(result.row)
+        print(f"> Game {result.game_index} finished in {result.wall_time:.1f}s, winner: {result.row['Win']}")
+    else:
+        print(f"> Game {result.game_index} failed after {result.wall_time:.1f}s: {result.error}")
+    if trace_jsonl and result.trace_spans:
+        write_jsonl(result.trace_spans, trace_jsonl, game=result.game_index, model=report.spec.model_name)
+
+
+def adjudication_enabled(spec: GameSpec) -> bool:
+    return spec.adjudicate_resign_cp is not None or spec.adjudicate_draw_cp is not None or spec.syzygy_path is not None
+
+
+def make_adjudicator(spec: GameSpec):
+    if not adjudication_enabled(spec):
+        return None
+    return Adjudicator(resign_cp=spec.adjudicate_resign_cp, resign_moves=spec.adjudicate_resign_moves,
+                       draw_cp=spec.adjudicate_draw_cp, draw_moves=spec.adjudicate_draw_moves,
+                       draw_halfmoves=spec.adjudicate_draw_halfmoves, syzygy_path=spec.syzygy_path)
+
+
+def adjudication_summary(game_manager, spec: GameSpec) -> Optional[dict]:
+    decision = game_manager.adjudication
+    if decision is None:
+        return None
+    # Stockfish moves first, so every ply pair is one LLM move; the rest of the move cap is saved.
+    return {"reason": decision.reason, "result": decision.result, "ply": decision.ply,
+            "llm_moves_saved": max(spec.num_moves - len(game_manager.board.move_stack) // 2, 0)}
+
+
+def prewarm_model(spec: GameSpec):
+    # Pays the model load once, before the games start, instead of inside every game's first move.
+    if spec.prewarm_model:
+        ModelResidency(spec.ollama_base_url, keep_alive=spec.ollama_keep_alive or "5m").activate(spec.model_name)
+
+
+def make_speculator(spec: GameSpec, pool=None):
+    if spec.speculative_k <= 0:
+        return None
+    from speculative import SpeculativeLLM
+    return SpeculativeLLM(spec.stockfish_path, k=spec.speculative_k, depth=spec.speculative_depth,
+                          max_wasted=spec.speculative_max_wasted, pool=pool)
+
+
+def play_single_game(spec: GameSpec, game_index: int, resume=None, checkpoint=None) -> GameResult:
+    # Imported here so every worker process builds its own board, engine and LLM client.
+    # `resume` is a GameRecord to continue and `checkpoint` is called with one after every ply (job_queue.py).
+    from chess_game_manager import ChessGameManager
+    from llm_player import LLMPlayer
+    from stockfish_player import StockfishPlayer
+
+    start = time.perf_counter()
+    pool = get_engine_pool()
+    cache = get_llm_cache(spec.llm_cache_path)
+    cache_before = cache.get_stats() if cache is not None else None
+    sf_cache = get_stockfish_cache(spec.stockfish_cache_path, spec.stockfish_cache_mode)
+    sf_cache_before = sf_cache.get_stats() if sf_cache is not None else None
+    pool_before = pool.get_stats()
+    stockfish_player = StockfishPlayer(spec.stockfish_path, pool=pool)
+    if sf_cache is not None:
+        stockfish_player.enable_move_cache(sf_cache)
+    speculator = adjudicator = None
+    try:
+        llm_player = LLMPlayer()
+        llm_player.init_llm_model(spec.model_name, temperature=spec.temperature, base_url=spec.ollama_base_url,
+                                  keep_alive=spec.ollama_keep_alive)
+        configure_llm_player(llm_player, spec, cache)
+
+        stockfish_player.init_stockfish(set_elo_rating=spec.stockfish_elo, set_depth=spec.stockfish_depth,
+                                        hash_mb=spec.stockfish_hash_mb, threads=spec.stockfish_threads)
+
+        game_manager = ChessGameManager(llm_player, stockfish_player)
+        if resume is not None:
+            game_manager.resume(resume)
+        if checkpoint is not None:
+            game_manager.enable_checkpoints(checkpoint)
+        tracer = make_tracer(spec, game_index)
+        if tracer is not None:
+            game_manager.enable_tracing(tracer)
+        # Adjudication streaks aren't checkpointed: a resumed game counts them again from the resumed
+        # position, so its resignation or draw can come later than in an uninterrupted game.
+        adjudicator = make_adjudicator(spec)
+        if adjudicator is not None:
+            game_manager.enable_adjudication(adjudicator)
+        speculator = make_speculator(spec, pool)
+        if speculator is not None:
+            game_manager.enable_speculation(speculator)
+        game_manager.play_game(num_moves=spec.num_moves)
+
+        row = game_row(game_manager)
+        return GameResult(game_index=game_index, wall_time=time.perf_counter() - start, row=row,
+                          engine_stats=engine_stats_delta(pool, pool_before), llm_cache_stats=cache_stats_delta(cache, cache_before),
+                          stockfish_cache_stats=cache_stats_delta(sf_cache, sf_cache_before),
+                          llm_stream_stats=stream_stats(llm_player), llm_retry_stats=dict(llm_player.retry_stats),
+                          llm_repair_stats=dict(llm_player.repair_stats), llm_prompt_stats=prompt_stats(llm_player),
+                          llm_load_stats=dict(llm_player.load_stats),
+                          speculative_stats=speculator.get_stats() if speculator is not None else None,
+                          trace_summary=tracer.summary() if tracer is not None else None,
+                          trace_spans=tracer.spans if tracer is not None else None,
+                          adjudication=adjudication_summary(game_manager, spec))
+    except Exception as e:
+        return GameResult(game_index=game_index, wall_time=time.perf_counter() - start, error=repr(e),
+                          engine_stats=engine_stats_delta(pool, pool_before), llm_cache_stats=cache_stats_delta(cache, cache_before),
+                          stockfish_cache_stats=cache_stats_delta(sf_cache, sf_cache_before))
+    finally:
+        if speculator is not None:
+            speculator.close()
+        if adjudicator is not None:
+            adjudicator.close()
+        stockfish_player.release()
+
+
+def run_tournament(spec: GameSpec, workers: Optional[int] = None,
+                   store_path: str = "ChessGameExperiment.sqlite", trace_jsonl: Optional[str] = None) -> TournamentReport:
+    from experiment_store import ExperimentStore
+
+    store = ExperimentStore(store_path)
+    workers = workers or max(1, min(spec.num_games, os.cpu_count() or 1))
+    report = TournamentReport(spec=spec, workers=workers, wall_time=0.0)
+    tracer = Tracer() if spec.trace else NULL_TRACER
+    start = time.perf_counter()
+    prewarm_model(spec)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_single_game, spec, i) for i in range(spec.num_games)]
+        for future in as_completed(futures):
+            record_result(report, store, future.result(), tracer, trace_jsonl)
+
+    report.wall_time = time.perf_counter() - start
+    report.tournament_trace = tracer.summary() or None
+    print(report.summary())
+    return report
+
+
+async def aplay_single_game(spec: GameSpec, game_index: int, scheduler) -> GameResult:
+    from chess_game_manager import ChessGameManager
+    from llm_player import LLMPlayer
+    from stockfish_player import StockfishPlayer
+
+    start = time.perf_counter()
+    cache = get_llm_cache(spec.llm_cache_path)
+    stockfish_player = StockfishPlayer(spec.stockfish_path, backend="async_uci")
+    sf_cache = get_stockfish_cache(spec.stockfish_cache_path, spec.stockfish_cache_mode)
+    if sf_cache is not None:
+        stockfish_player.enable_move_cache(sf_cache)
+    speculator = adjudicator = None
+    try:
+        llm_player = LLMPlayer()
+        llm_player.init_llm_model(spec.model_name, temperature=spec.temperature, base_url=spec.ollama_base_url,
+                                  keep_alive=spec.ollama_keep_alive)
+        llm_player.scheduler = scheduler
+        llm_player.game_id = game_index
+        configure_llm_player(llm_player, spec, cache)
+
+        await stockfish_player.ainit_stockfish(set_elo_rating=spec.stockfish_elo, set_depth=spec.stockfish_depth,
+                                               hash_mb=spec.stockfish_hash_mb, threads=spec.stockfish_threads)
+
+        game_manager = ChessGameManager(llm_player, stockfish_player)
+        tracer = make_tracer(spec, game_index)
+        if tracer is not None:
+            game_manager.enable_tracing(tracer)
+        adjudicator = make_adjudicator(spec)
+        if adjudicator is not None:
+            game_manager.enable_adjudication(adjudicator)
+        # Concurrent games each hold a predictor for the whole game, more than the pool's one engine
+        # per key, so they start their own.
+        speculator = await asyncio.to_thread(make_speculator, spec)
+        if speculator is not None:
+            game_manager.enable_speculation(speculator)
+        await game_manager.aplay_game(num_moves=spec.num_moves)
+        return GameResult(game_index=game_index, wall_time=time.perf_counter() - start, row=game_row(game_manager),
+                          llm_stream_stats=stream_stats(llm_player), llm_retry_stats=dict(llm_player.retry_stats),
+                          llm_repair_stats=dict(llm_player.repair_stats), llm_prompt_stats=prompt_stats(llm_player),
+                          llm_load_stats=dict(llm_player.load_stats),
+                          speculative_stats=speculator.get_stats() if speculator is not None else None,
+                          trace_summary=tracer.summary() if tracer is not None else None,
+                          trace_spans=tracer.spans if tracer is not None else None,
+                          adjudication=adjudication_summary(game_manager, spec))
+    except Exception as e:
+        return GameResult(game_index=game_index, wall_time=time.perf_counter() - start, error=repr(e))
+    finally:
+        if speculator is not None:
+            speculator.close()
+        if adjudicator is not None:
+            adjudicator.close()
+        await stockfish_player.arelease()
+
+
+async def arun_tournament(spec: GameSpec, max_llm_requests: int = 4,
+                          store_path: str = "ChessGameExperiment.sqlite",
+                          trace_jsonl: Optional[str] = None) -> TournamentReport:
+    # Every game runs in this process's event loop; the scheduler keeps at most
+    # max_llm_requests generations in flight and queues the other games fairly.
+    from experiment_store import ExperimentStore
+    from llm_scheduler import LLMScheduler
+
+    store = ExperimentStore(store_path)
+    scheduler = LLMScheduler(max_concurrent=max_llm_requests)
+    cache = get_llm_cache(spec.llm_cache_path)
+    cache_before = cache.get_stats() if cache is not None else None
+    sf_cache = get_stockfish_cache(spec.stockfish_cache_path, spec.stockfish_cache_mode)
+    sf_cache_before = sf_cache.get_stats() if sf_cache is not None else None
+    report = TournamentReport(spec=spec, workers=spec.num_games, wall_time=0.0)
+    tracer = Tracer() if spec.trace else NULL_TRACER
+    start = time.perf_counter()
+    await asyncio.to_thread(prewarm_model, spec)
+
+    games = [aplay_single_game(spec, i, scheduler) for i in range(spec.num_games)]
+    for game in asyncio.as_completed(games):
+        record_result(report, store, await game, tracer, trace_jsonl)
+
+    report.wall_time = time.perf_counter() - start
+    report.tournament_trace = tracer.summary() or None
+    report.llm_stats = scheduler.get_stats()
+    report.llm_cache_totals = cache_stats_delta(cache, cache_before)
+    report.stockfish_cache_totals = cache_stats_delta(sf_cache, sf_cache_before)
+    print(report.summary())
+    for model_name, stats in report.llm_stats.items():
+        print(f"> {model_name}: {stats['requests']} requests, queue wait mean {stats['queue_wait_mean']:.2f}s,"
+              f" inference mean {stats['inference_mean']:.2f}s")
+    return report
+
+
+def run_async_tournament(spec: GameSpec, max_llm_requests: int = 4,
+                         store_path: str = "ChessGameExperiment.sqlite",
+                         trace_jsonl: Optional[str] = None) -> TournamentReport:
+    return asyncio.run(arun_tournament(spec, max_llm_requests=max_llm_requests, store_path=store_path,
+                                       trace_jsonl=trace_jsonl))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Play many LLM vs Stockfish games in parallel.")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--temperature", type=float, default=0.1)
+    parser.add_argument("--stockfish-path", required=True)
+    parser.add_argument("--elo", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=15)
+    parser.add_argument("--hash", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--games", type=int, default=1)
+    parser.add_argument("--moves", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--store", default="ChessGameExperiment.sqlite", help="Experiment store the games are appended to.")
+    parser.add_argument("--llm-cache", default=None, help="SQLite file caching LLM answers (temperature 0 only).")
+    parser.add_argument("--force-llm-cache", action="store_true")
+    parser.add_argument("--stockfish-cache", default=None, help="SQLite file caching Stockfish best moves.")
+    parser.add_argument("--stockfish-cache-mode", choices=["replay", "resample"], default="replay")
+    parser.add_argument("--async-games", action="store_true",
+                        help="Play every game in one event loop instead of a process pool.")
+    parser.add_argument("--max-llm-requests", type=int, default=4,
+                        help="Concurrent LLM requests per model in --async-games mode.")
+    parser.add_argument("--stream-llm", action="store_true",
+                        help="Stream LLM answers and cancel the generation as soon as best_move is read.")
+    parser.add_argument("--measure-full-generation", action="store_true",
+                        help="With --stream-llm, read every stream to its end to report the time saved.")
+    parser.add_argument("--constrained-output", action="store_true",
+                        help="Send Ollama a JSON schema restricting moves to the legal ones (falls back per model).")
+    parser.add_argument("--prompt-compiler", action="store_true",
+                        help="Build prefix-stable prompts so Ollama can reuse its KV cache between plies.")
+    parser.add_argument("--prompt-token-budget", type=int, default=None,
+                        help="With --prompt-compiler, truncate the oldest moves above this many prompt tokens.")
+    parser.add_argument("--speculative-k", type=int, default=0,
+                        help="Start the LLM on Stockfish's top-k predicted moves while it searches (0 = off).")
+    parser.add_argument("--speculative-depth", type=int, default=8)
+    parser.add_argument("--speculative-max-wasted", type=int, default=None,
+                        help="Stop speculating in a game after this many wasted LLM inferences.")
+    parser.add_argument("--ollama-url", default=None,
+                        help="Ollama server to play against, e.g. an ollama_replay.py emulator.")
+    parser.add_argument("--keep-alive", default=None,
+                        help="How long Ollama keeps the model loaded between requests, e.g. 30m or -1 for ever.")
+    parser.add_argument("--prewarm", action="store_true",
+                        help="Load the model into Ollama before the games start so no game pays the cold load.")
+    parser.add_argument("--record-llm", default=None,
+                        help="Record every LLM exchange to this SQLite file for ollama_replay.py.")
+    parser.add_argument("--resign-cp", type=int, default=None,
+                        help="Adjudicate a resignation once Stockfish's eval stays beyond this many centipawns.")
+    parser.add_argument("--resign-moves", type=int, default=5)
+    parser.add_argument("--draw-cp", type=int, default=None,
+                        help="Adjudicate a draw once the eval stays within this many centipawns while pieces shuffle.")
+    parser.add_argument("--draw-moves", type=int, default=10)
+    parser.add_argument("--draw-halfmoves", type=int, default=20)
+    parser.add_argument("--syzygy-path", default=None, help="Syzygy tablebase directory for endgame adjudication.")
+    parser.add_argument("--trace", action="store_true", help="Record per-ply timing spans and print their summary.")
+    parser.add_argument("--trace-jsonl", default=None, help="Append every timing span to this JSONL file (implies --trace).")
+    parser.add_argument("--trace-prometheus", default=None,
+                        help="Write the aggregated spans in Prometheus text format to this file (implies --trace).")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Level of the per-move game events (INFO logs every move).")
+    parser.add_argument("--json-logs", action="store_true", help="Write game events as JSON lines.")
+    args = parser.parse_args(argv)
+    configure_logging(getattr(logging, args.log_level), json_lines=args.json_logs)
+
+    spec = GameSpec(model_name=args.model, temperature=args.temperature, stockfish_path=args.stockfish_path,
+                    stockfish_elo=args.elo, stockfish_depth=args.depth, stockfish_hash_mb=args.hash,
+                    stockfish_threads=args.threads, num_games=args.games,
+                    num_moves=args.moves, llm_cache_path=args.llm_cache, force_llm_cache=args.force_llm_cache,
+                    stockfish_cache_path=args.stockfish_cache, stockfish_cache_mode=args.stockfish_cache_mode,
+                    stream_llm=args.stream_llm, measure_full_generation=args.measure_full_generation,
+                    constrained_output=args.constrained_output, prompt_compiler=args.prompt_compiler,
+                    prompt_token_budget=args.prompt_token_budget, speculative_k=args.speculative_k,
+                    speculative_depth=args.speculative_depth, speculative_max_wasted=args.speculative_max_wasted,
+                    trace=args.trace or bool(args.trace_jsonl or args.trace_prometheus),
+                    ollama_base_url=args.ollama_url, record_llm_path=args.record_llm,
+                    ollama_keep_alive=args.keep_alive, prewarm_model=args.prewarm,
+                    adjudicate_resign_cp=args.resign_cp, adjudicate_resign_moves=args.resign_moves,
+                    adjudicate_draw_cp=args.draw_cp, adjudicate_draw_moves=args.draw_moves,
+                    adjudicate_draw_halfmoves=args.draw_halfmoves, syzygy_path=args.syzygy_path)
+    if args.async_games:
+        report = run_async_tournament(spec, max_llm_requests=args.max_llm_requests, store_path=args.store,
+                                      trace_jsonl=args.trace_jsonl)
+    else:
+        report = run_tournament(spec, workers=args.workers, store_path=args.store, trace_jsonl=args.trace_jsonl)
+    if args.trace_prometheus and report.trace_summary:
+        with open(args.trace_prometheus, "w") as f:
+            f.write(to_prometheus(report.trace_summary, model=spec.model_name))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# %%
+import asyncio
+import itertools
+from typing import Optional
+
+import chess
+import chess.engine
+
+_game_ids = itertools.count()
+
+
+class AsyncUCIEngine:
+    """Stockfish driven through python-chess' asyncio UCI protocol instead of blocking pipe reads."""
+
+    def __init__(self, path: str, elo: int = 1000, depth: int = 15, hash_mb: int = 16, threads: int = 1):
+        self.path = path
+        self.elo = elo
+        self.depth = depth
+        self.hash_mb = hash_mb
+        self.threads = threads
+        self.transport: Optional[asyncio.SubprocessTransport] = None
+        self.protocol: Optional[chess.engine.UciProtocol] = None
+        self.last_info: chess.engine.InfoDict = {}
+        self._game = next(_game_ids)
+
+    @property
+    def started(self) -> bool:
+        return self.protocol is not None
+
+    async def start(self):
+        self.transport, self.protocol = await chess.engine.popen_uci(self.path)
+        await self.protocol.configure({"Hash": self.hash_mb,
+                                       "Threads": self.threads,
+                                       "UCI_LimitStrength": True,
+                                       "UCI_Elo": self.elo})
+
+    def new_game(self):
+        # python-chess sends ucinewgame whenever the game token passed to play() changes.
+        self._game = next(_game_ids)
+
+    async def best_move(self, board: chess.Board) -> Optional[str]:
+        if not self.started:
+            await self.start()
+        result = await self.protocol.play(board, chess.engine.Limit(depth=self.depth),
+                                          game=self._game, info=chess.engine.INFO_SCORE)
+        self.last_info = result.info
+        return result.move.uci() if result.move is not None else None
+
+    def get_parameters(self) -> dict:
+        params = {"Hash": self.hash_mb, "Threads": self.threads, "UCI_LimitStrength": "true", "UCI_Elo": self.elo}
+        if self.protocol is not None:
+            params.update(self.protocol.config)
+        return params
+
+    async def quit(self):
+        if self.protocol is not None:
+            await self.protocol.quit()
+            self.transport = None
+            self.protocol = None
@@ -0,0 +1,44 @@
+from elo_planner import Cell, EloPlanner, game_score
+
+CELL = Cell("m", 0.1, 1000)
+UNFINISHED = {"Win": None, "Result": "*", "LLM_color": "White"}
+
+
+def test_ignored_unfinished_games_do_not_fail_the_cell():
+    planner = EloPlanner([CELL], max_failures=3, max_games_per_cell=40)
+    for _ in range(5):
+        planner.start(CELL)
+        planner.record(CELL, game_score(UNFINISHED, unfinished=None))
+    stats = planner.cells[CELL]
+    assert stats.status == "open"
+    assert (stats.games, stats.failures, stats.ignored, stats.pending) == (0, 0, 5, 0)
+    assert planner.next_cells(1) == [CELL]
+
+
+def test_ignored_games_count_towards_the_cap():
+    planner = EloPlanner([CELL], max_games_per_cell=4)
+    for _ in range(4):
+        planner.start(CELL)
+        planner.record(CELL, None)
+    assert planner.cells[CELL].status == "capped"
+    assert planner.next_cells(1) == []
+
+
+def test_crashed_games_fail_the_cell():
+    planner = EloPlanner([CELL], max_failures=3)
+    for _ in range(3):
+        planner.start(CELL)
+        planner.record_error(CELL)
+    stats = planner.cells[CELL]
+    assert stats.status == "failed"
+    assert (stats.games, stats.ignored, stats.pending) == (0, 0, 0)
+
+
+def test_sprt_accepts_weaker_after_losses():
+    planner = EloPlanner([CELL])
+    for _ in range(40):
+        planner.record(CELL, 0.0)
+        if planner.cells[CELL].status != "open":
+            break
+    assert planner.cells[CELL].status == "weaker"
+    assert planner.cells[CELL].games < 40
@@ -0,0 +1,72 @@
+import pytest
+
+from engine_pool import EngineKey, EnginePool
+
+KEY = EngineKey("stockfish", elo=1000, depth=5)
+
+
+class FakeEngine:
+    alive = True
+
+    def set_fen_position(self, fen, send_ucinewgame_token=True):
+        self.fen = fen
+
+
+class FakePool(EnginePool):
+    """Spawns FakeEngines without a Stockfish binary; `fail` makes the next spawns raise."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.fail = 0
+
+    def _spawn(self, key):
+        if self.fail:
+            self.fail -= 1
+            raise FileNotFoundError(key.path)
+        return FakeEngine()
+
+    @staticmethod
+    def is_alive(engine):
+        return engine.alive
+
+    @staticmethod
+    def _quit(engine):
+        engine.alive = False
+
+
+def test_failed_restart_frees_the_slot():
+    pool = FakePool(max_engines_per_key=1)
+    engine = pool.checkout(KEY)
+    pool.fail = 1
+    with pytest.raises(FileNotFoundError):
+        pool.restart(KEY, engine)
+    assert pool.get_stats()["engines"] == 0
+    # The slot is free again: the next checkout starts an engine instead of waiting forever.
+    assert pool.checkout(KEY, timeout=1).alive
+
+
+def test_failed_spawn_frees_the_slot():
+    pool = FakePool(max_engines_per_key=1)
+    pool.fail = 1
+    with pytest.raises(FileNotFoundError):
+        pool.checkout(KEY)
+    assert pool.checkout(KEY, timeout=1).alive
+
+
+def test_forked_worker_leaves_the_parents_engines_alone(monkeypatch):
+    pool = FakePool(max_engines_per_key=2)
+    parents = [pool.checkout(KEY), pool.checkout(KEY)]
+    pool.release(KEY, parents[0])
+    # As seen from a process pool worker forked here: one engine idle, one still checked out.
+    monkeypatch.setattr("engine_pool.os.getpid", lambda: -1)
+    engine = pool.checkout(KEY, timeout=1)
+    assert engine not in parents
+    assert all(parent.alive for parent in parents)
+    pool.release(KEY, parents[1])
+    pool.release(KEY, engine)
+    pool.close()
+    assert all(parent.alive for parent in parents)
+    assert not engine.alive
+    stats = pool.get_stats()
+    assert stats["inherited"] == 1
+    assert stats["engines"] == 0
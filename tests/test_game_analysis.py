@@ -0,0 +1,105 @@
+import chess
+import pytest
+
+from experiment_store import ExperimentStore
+from game_analysis import (CP_CAP, MATE_SCORE, AnalysisStore, analyze_moves, classify, move_accuracy,
+                           summarize_moves, terminal_cp, winning_chances)
+from game_record import GameRecord
+
+
+@pytest.mark.parametrize("drop, accuracy", [(0.0, 100.0), (1.84, 92.06), (10.0, 63.58), (30.0, 24.78), (100.0, 0.0)])
+def test_move_accuracy_follows_lichess(drop, accuracy):
+    assert move_accuracy(50.0, 50.0 - drop) == pytest.approx(accuracy, abs=0.01)
+
+
+def test_small_slip_from_equality_keeps_high_accuracy():
+    # A 20 cp slip from 0.00 takes the win percentage from 50 to ~48.16.
+    assert 50 + 50 * winning_chances(-20) == pytest.approx(48.16, abs=0.01)
+    assert move_accuracy(50.0, 50 + 50 * winning_chances(-20)) == pytest.approx(92.06, abs=0.01)
+
+
+def test_move_accuracy_ignores_gains():
+    assert move_accuracy(40.0, 60.0) == pytest.approx(100.0, abs=0.01)
+
+
+# Fool's mate: 1. f3 e5 2. g4 Qh4#
+FOOLS_MATE = ["f2f3", "e7e5", "g2g4", "d8h4"]
+
+
+def stub_evals(record, white_cps):
+    """Evaluations of every non-terminal position of `record`, in order, with the given White-side scores."""
+    evals = {}
+    for board, cp in zip(record.iter_boards(), white_cps):
+        evals[board.epd()] = (cp, None)
+    return evals
+
+
+def fools_mate(llm_color="White"):
+    record = GameRecord.from_moves(FOOLS_MATE)
+    return {"Game_record": record, "LLM_color": llm_color}, stub_evals(record, [20, -50, -40, -900])
+
+
+def test_cp_loss_is_from_the_movers_side_for_each_colour():
+    row, evals = fools_mate()
+    moves = analyze_moves(row, evals)
+    assert [move["mover"] for move in moves] == ["llm", "stockfish", "llm", "stockfish"]
+    # White: 20 -> -50 and -40 -> -900; Black (signs flipped): 50 -> 40, then mates.
+    assert [move["cp_loss"] for move in moves] == [70, 10, 860, 0]
+    assert [move["eval_after"] for move in moves] == [-50, -40, -900, -MATE_SCORE]
+
+
+def test_llm_as_black_gets_blacks_moves():
+    row, evals = fools_mate("Black")
+    summary = summarize_moves(analyze_moves(row, evals))
+    assert summary["llm_moves"] == 2
+    assert summary["acpl"] == 5.0
+    assert summary["blunders"] == 0
+
+
+def test_scores_are_clamped_to_cp_cap():
+    record = GameRecord.from_moves(["e2e4", "e7e5"])
+    moves = analyze_moves({"Game_record": record, "LLM_color": "White"},
+                          stub_evals(record, [5000, 3 * CP_CAP, 2 * CP_CAP]))
+    # Both sides stay beyond the cap: nothing is lost on the clamped scale.
+    assert [move["cp_loss"] for move in moves] == [0, 0]
+    assert moves[0]["classification"] is None
+
+
+def test_terminal_positions_need_no_evaluation():
+    assert terminal_cp(chess.Board("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1")) == 0  # stalemate
+    assert terminal_cp(chess.Board("8/8/8/8/8/8/8/K6k w - - 0 1")) == 0  # insufficient material
+    assert terminal_cp(chess.Board()) is None
+    row, evals = fools_mate()
+    assert analyze_moves(row, evals)[-1]["best_move"] is None  # the mate itself was never searched
+
+
+def test_classification_thresholds():
+    assert classify(0.0, -0.3) == "blunder"
+    assert classify(0.0, -0.2) == "mistake"
+    assert classify(0.0, -0.1) == "inaccuracy"
+    assert classify(0.0, -0.05) is None
+    assert classify(-0.5, 0.5) is None
+    row, evals = fools_mate()
+    summary = summarize_moves(analyze_moves(row, evals))
+    assert (summary["inaccuracies"], summary["mistakes"], summary["blunders"]) == (1, 0, 1)
+
+
+def test_pending_games_and_known_positions_skip_done_work(tmp_path):
+    path = str(tmp_path / "games.sqlite")
+    games = ExperimentStore(path)
+    first = games.record_game({"Game_record": GameRecord.from_moves(FOOLS_MATE), "LLM_color": "White"})
+    second = games.record_game({"Game_record": GameRecord.from_moves(["e2e4"]), "LLM_color": "Black"})
+    games.close()
+
+    store = AnalysisStore(path)
+    row, evals = fools_mate()
+    store.put_game(first, 12, analyze_moves(row, evals))
+    assert [row["id"] for row in store.pending_games(12)] == [second]
+    assert [row["id"] for row in store.pending_games(8)] == [second]
+    assert [row["id"] for row in store.pending_games(16)] == [first, second]
+
+    epds = list(evals)
+    store.put_positions([(epd, cp, best) for epd, (cp, best) in evals.items()], depth=10)
+    assert store.known_positions(epds, 8) == evals
+    assert store.known_positions(epds, 12) == {}
+    store.close()
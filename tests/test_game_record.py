@@ -0,0 +1,33 @@
+import pickle
+from array import array
+
+import chess
+
+from game_record import GameRecord, pack_move
+
+MOVES = ["e2e4", "e7e5", "g1f3", "b8c6"]
+
+
+def test_bytes_are_little_endian():
+    record = GameRecord.from_moves(MOVES)
+    data = record.to_bytes()
+    assert len(data) == 2 * len(MOVES)
+    first = pack_move(chess.Move.from_uci("e2e4"))
+    assert data[:2] == first.to_bytes(2, "little")
+
+
+def test_bytes_round_trip():
+    record = GameRecord.from_moves(MOVES)
+    assert GameRecord.from_bytes(record.to_bytes()) == record
+    assert pickle.loads(pickle.dumps(record)) == record
+
+
+def test_big_endian_host(monkeypatch):
+    record = GameRecord.from_moves(MOVES)
+    data = record.to_bytes()
+    monkeypatch.setattr("game_record.sys.byteorder", "big")
+    # On a big-endian host the native array is swapped, the serialised bytes are not.
+    swapped = array("H", record.moves)
+    swapped.byteswap()
+    assert GameRecord(moves=swapped).to_bytes() == data
+    assert GameRecord.from_bytes(data).moves == swapped
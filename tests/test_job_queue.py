@@ -0,0 +1,152 @@
+import time
+
+import pytest
+
+from experiment_store import ExperimentStore
+from game_record import GameRecord
+from job_queue import JobQueue, LeaseLost, run_worker
+from tournament import GameResult, GameSpec
+
+SPEC = GameSpec(model_name="stub", stockfish_path="stockfish").model_dump_json()
+MOVES = ["e2e4", "e7e5", "g1f3", "b8c6"]
+LEASE = 0.05
+
+
+def expire():
+    time.sleep(2 * LEASE)
+
+
+def row(record: GameRecord) -> dict:
+    return {"Game_record": record, "LLM_color": "white", "LLM_model_name": "stub", "Win": "draw"}
+
+
+class StubGames:
+    """Stands in for tournament.play_single_game: plays MOVES, checkpointing after each ply."""
+
+    def __init__(self, error=None, during=None):
+        self.error = error
+        # Called after the first checkpoint, e.g. to let another worker take the lease over.
+        self.during = during
+        self.resumed = []
+        self.raised = []
+
+    def __call__(self, spec, game_index, resume=None, checkpoint=None):
+        self.resumed.append(len(resume) if resume is not None else 0)
+        record = resume if resume is not None else GameRecord()
+        try:
+            for uci in MOVES[len(record):]:
+                record.append(GameRecord.from_moves([uci]).move_at(0))
+                checkpoint(record)
+                if self.during is not None:
+                    self.during()
+                    self.during = None
+        except LeaseLost as e:
+            self.raised.append(e)
+            return GameResult(game_index=game_index, wall_time=0.0, error=repr(e))
+        if self.error is not None:
+            return GameResult(game_index=game_index, wall_time=0.0, error=self.error)
+        return GameResult(game_index=game_index, wall_time=0.0, row=row(record))
+
+
+@pytest.fixture
+def queue_dir(tmp_path):
+    return str(tmp_path / "queue")
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "games.sqlite")
+
+
+def test_expired_lease_resumes_from_the_checkpoint(queue_dir):
+    queue = JobQueue(queue_dir, shards=1, lease_seconds=LEASE)
+    queue.submit(SPEC, 1)
+    first = queue.lease("a")
+    assert first.record is None and first.attempts == 1
+    assert queue.checkpoint(first, "a", GameRecord.from_moves(MOVES[:2]))
+    assert queue.lease("b") is None
+
+    expire()
+    second = queue.lease("b")
+    assert second.uid == first.uid and second.attempts == 2
+    assert second.record.ucis() == MOVES[:2]
+    # The first worker's lease is gone: its checkpoints and completion are refused.
+    assert not queue.checkpoint(first, "a", GameRecord.from_moves(MOVES[:3]))
+    assert not queue.complete(first, "a")
+    assert queue.complete(second, "b")
+    stats = {s["worker"]: s for s in queue.worker_stats()}
+    assert stats["a"]["expired"] == 1
+    assert stats["b"]["resumed"] == 1 and stats["b"]["completed"] == 1
+    assert queue.job_counts() == {"queued": 0, "leased": 0, "done": 1, "failed": 0}
+
+
+def test_expired_leases_fail_the_job_after_max_attempts(queue_dir):
+    queue = JobQueue(queue_dir, shards=1, lease_seconds=LEASE, max_attempts=2)
+    queue.submit(SPEC, 1)
+    assert queue.lease("a").attempts == 1
+    expire()
+    assert queue.lease("b").attempts == 2
+    expire()
+    assert queue.lease("c") is None
+    assert queue.job_counts()["failed"] == 1
+    error = queue.shards[0].execute("SELECT error FROM jobs").fetchone()[0]
+    assert error == "lease expired"
+
+
+def test_worker_resumes_an_abandoned_game(queue_dir, store_path, monkeypatch):
+    queue = JobQueue(queue_dir, shards=1, lease_seconds=LEASE)
+    queue.submit(SPEC, 1)
+    crashed = queue.lease("crashed")
+    queue.checkpoint(crashed, "crashed", GameRecord.from_moves(MOVES[:3]))
+    expire()
+
+    games = StubGames()
+    monkeypatch.setattr("tournament.play_single_game", games)
+    assert run_worker(queue_dir, store_path, worker="w", lease_seconds=LEASE) == 1
+    assert games.resumed == [3]
+    store = ExperimentStore(store_path)
+    (game,) = store.iter_games()
+    assert game["Game_record"].ucis() == MOVES
+    store.close()
+
+
+def test_worker_drops_a_game_taken_over_by_another(queue_dir, store_path, monkeypatch):
+    queue = JobQueue(queue_dir, shards=1, lease_seconds=LEASE)
+    queue.submit(SPEC, 1)
+    successor = []
+
+    def take_over():
+        expire()
+        successor.append(queue.lease("successor"))
+
+    games = StubGames(during=take_over)
+    monkeypatch.setattr("tournament.play_single_game", games)
+    assert run_worker(queue_dir, store_path, worker="slow", lease_seconds=LEASE, max_jobs=1) == 0
+    assert len(games.raised) == 1
+    assert successor[0].record.ucis() == MOVES[:1]
+    # The failure report of the slow worker doesn't requeue a job it no longer holds.
+    assert queue.job_counts()["leased"] == 1
+    assert ExperimentStore(store_path).count() == 0
+
+
+def test_failed_games_are_retried_until_max_attempts(queue_dir, store_path, monkeypatch):
+    queue = JobQueue(queue_dir, shards=1)
+    queue.submit(SPEC, 1)
+    games = StubGames(error="RuntimeError('engine died')")
+    monkeypatch.setattr("tournament.play_single_game", games)
+    assert run_worker(queue_dir, store_path, worker="w", max_attempts=2) == 0
+    # The second attempt resumes from the first one's last checkpoint.
+    assert games.resumed == [0, len(MOVES)]
+    assert queue.job_counts()["failed"] == 1
+    assert {s["worker"]: s for s in queue.worker_stats()}["w"]["failed"] == 2
+
+
+def test_job_results_are_recorded_once(store_path):
+    store = ExperimentStore(store_path)
+    game = row(GameRecord.from_moves(MOVES))
+    assert store.record_game(game, source="job:abc") is not None
+    # A slow worker finishing the same job after its successor doesn't add a second game.
+    assert store.record_game(game, source="job:abc") is None
+    assert store.record_game(game, source="job:def") is not None
+    assert store.count() == 2
+    store.close()
@@ -0,0 +1,35 @@
+from llm_cache import LLMMoveCache
+
+
+def test_hits_count_only_once_confirmed(tmp_path):
+    cache = LLMMoveCache(str(tmp_path / "cache.sqlite"))
+    cache.put("k", "answer", tokens=100, seconds=2.0)
+    assert cache.get("k") == "answer"
+    stats = cache.get_stats()
+    assert (stats["lookups"], stats["hits"], stats["tokens_saved"]) == (1, 0, 0)
+
+    cache.get("k")
+    cache.confirm_hit("k")
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["memory_hits"], stats["tokens_saved"], stats["seconds_saved"]) == (1, 1, 100, 2.0)
+    cache.confirm_hit("k")  # nothing new was found
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_disk_hits_are_confirmed_as_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    LLMMoveCache(path).put("k", "answer", tokens=7)
+    cache = LLMMoveCache(path)
+    cache.get("k")
+    cache.confirm_hit("k")
+    stats = cache.get_stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["tokens_saved"]) == (1, 0, 7)
+
+
+def test_expired_entries_are_not_served_from_memory(tmp_path):
+    cache = LLMMoveCache(str(tmp_path / "cache.sqlite"), max_age_seconds=60)
+    cache.put("k", "answer")
+    output, tokens, seconds, created = cache._memory["k"]
+    cache._memory["k"] = (output, tokens, seconds, created - 120)
+    assert cache.get("k") is None
+    assert "k" not in cache._memory
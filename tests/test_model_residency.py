@@ -0,0 +1,38 @@
+import pytest
+
+from model_residency import ModelResidency
+
+
+class FlakyResidency(ModelResidency):
+    """Loads succeed except for the models listed in `failing` (each entry fails once)."""
+
+    def __init__(self, failing):
+        super().__init__("http://ollama.invalid", max_loaded=2)
+        self.failing = list(failing)
+        self.loads = []
+
+    def _generate(self, model, keep_alive):
+        if model in self.failing:
+            self.failing.remove(model)
+            raise ConnectionError(f"cannot load {model}")
+        self.loads.append(model)
+        return {}
+
+
+def test_failed_prewarm_is_retried_when_activated():
+    residency = FlakyResidency(failing=["b"])
+    residency.activate("a")
+    residency.prewarm_async("b")
+    residency.activate("b")
+    assert residency.active == "b"
+    assert residency.loads == ["a", "b"]
+    assert residency.get_stats()["prewarm_failures"] == 1
+
+
+def test_activate_raises_when_the_model_cannot_load():
+    residency = FlakyResidency(failing=["b", "b"])
+    residency.activate("a")
+    residency.prewarm_async("b")
+    with pytest.raises(ConnectionError):
+        residency.activate("b")
+    assert residency.active is None
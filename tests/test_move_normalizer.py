@@ -0,0 +1,28 @@
+import chess
+import pytest
+
+from move_normalizer import MoveNormalizer
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("e2e4", ("e2e4", None)),
+    ("e2-e4", ("e2e4", "hyphen")),
+    ("E2-E4", ("e2e4", "hyphen")),
+    ("E2E4", ("e2e4", "case")),
+    ("e4", ("e2e4", "san")),
+    ("Nf3", ("g1f3", "san")),
+    ("Ng1-f3", ("g1f3", "lan")),
+    ("NG1-F3", ("g1f3", "lan")),
+    ("e2e5", (None, None)),
+])
+def test_repairs_are_attributed_to_the_first_transformation(answer, expected):
+    assert MoveNormalizer(chess.Board()).resolve(answer) == expected
+
+
+def test_castling_and_promotion():
+    board = chess.Board("r3k2r/1P6/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    normalizer = MoveNormalizer(board)
+    assert normalizer.resolve("O-O") == ("e1g1", "castling")
+    assert normalizer.resolve("0-0-0") == ("e1c1", "castling")
+    assert normalizer.resolve("b7b8") == ("b7b8q", "promotion")
+    assert normalizer.resolve("B7-B8") == ("b7b8q", "promotion")
@@ -0,0 +1,68 @@
+import copy
+from types import SimpleNamespace
+
+import chess
+
+from instrumentation import NULL_TRACER
+from llm_cache import LLMMoveCache
+from prompt_compiler import PromptCompiler
+from speculative import SpeculativeLLM, _DeferredHits
+from tests.test_engine_pool import FakePool
+
+
+def make_player(compiler):
+    return SimpleNamespace(history=[], tracer=NULL_TRACER, compiler=compiler, cache=None, retry_stats={"moves": 0},
+                           repair_stats={}, prompt_stats={"measured": 0}, load_stats={"calls": 0})
+
+
+def test_hit_keeps_the_compiler_state_of_the_speculative_turn():
+    compiler = PromptCompiler("system", "{movement_history}", "", token_budget=8)
+    board = chess.Board()
+    for move in ("e2e4", "e7e5", "g1f3", "b8c6"):
+        board.push_uci(move)
+    compiler.compile(board.move_stack[:2])
+    player = make_player(compiler)
+
+    clone = make_player(copy.copy(compiler))
+    clone.compiler._rendered = list(compiler._rendered)
+    clone.retry_stats["moves"] = 1
+    clone.compiler.compile(board.move_stack)
+    clone.compiler.calibrate("x" * 100, 10)
+
+    SpeculativeLLM._merge(player, clone)
+    assert player.retry_stats["moves"] == 1
+    assert player.compiler.chars_per_token == clone.compiler.chars_per_token != 4.0
+    assert player.compiler.truncations == clone.compiler.truncations > 0
+    assert len(player.compiler._rendered) == 4
+
+
+def test_only_the_kept_turn_counts_its_cache_hit(tmp_path):
+    cache = LLMMoveCache(str(tmp_path / "cache.sqlite"))
+    cache.put("kept", "{}", tokens=40, seconds=2.0)
+    cache.put("discarded", "{}", tokens=30, seconds=1.0)
+    player = make_player(None)
+    player.cache = cache
+    kept, discarded = make_player(None), make_player(None)
+    for clone, key in ((kept, "kept"), (discarded, "discarded")):
+        clone.cache = _DeferredHits(cache)
+        assert clone.cache.get(key) == "{}"
+        clone.cache.confirm_hit(key)
+    assert cache.get_stats()["hits"] == 0
+
+    SpeculativeLLM._merge(player, kept)
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["tokens_saved"] == 40
+    cache.close()
+
+
+def test_predictor_comes_from_the_pool_and_goes_back_to_it():
+    pool = FakePool(max_engines_per_key=1)
+    first = SpeculativeLLM("stockfish", k=3, depth=6, pool=pool)
+    assert first.engine_key.multipv == 3 and first.engine_key.elo is None
+    predictor = first.predictor
+    first.close()
+    second = SpeculativeLLM("stockfish", k=3, depth=6, pool=pool)
+    assert second.predictor is predictor
+    second.close()
+    assert pool.get_stats()["reused"] == 1